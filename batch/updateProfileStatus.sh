@@ -77,34 +77,24 @@ then
     echo "Invalid deployments root: $deployments_root" >&2;
     return 1;
 fi
-deployment_dirs=$(find $deployments_root -type d -maxdepth 1 -name '*MOAS*');
-if [ -z "$deployment_dirs" ]
-then
-    echo "No OOI glider deployments found: $deployments_root";
-    return 1;
-fi
 
 # Activate the gutils virtualenv
 workon gutils;
 
 env | grep PYTHONPATH;
 
-for d in $deployment_dirs
-do
-    echo "Deployment: $d";
-    # Process all deployments and send new data requests if needed
-    if [ -n "$DEBUG" ]
+# Update the profile status files of all deployments concurrently
+if [ -n "$DEBUG" ]
+then
+    process_deployments.py -l debug --status-only;
+else
+    if [ -z "$clobber" ]
     then
-        write_deployment_profile_status.py -l debug $d;
+        process_deployments.py --status-only;
     else
-        if [ -z "$clobber" ]
-        then
-            write_deployment_profile_status.py $d;
-        else
-            write_deployment_profile_status.py -c $d;
-        fi
+        process_deployments.py -c --status-only;
     fi
-done
+fi
 
 # Deactivate the gutils virtualenv
 deactivate;
@@ -74,55 +74,18 @@ then
     echo "Invalid deployments root: $deployments_root" >&2;
     exit 1;
 fi
-deployment_dirs=$(find $deployments_root -type d -name '*MOAS*');
-if [ -z "$deployment_dirs" ]
-then
-    echo "No configured deployments found: $deployments_root";
-    exit 0;
-fi
 
 # Activate the gutils virtualenv
 workon gutils;
 
-# Process all deployments and send new data requests if needed
-for d in $deployment_dirs
-do
-
-    # Skip if recovered.txt file is present
-    recovered_file="${d}/status/recovered.txt";
-    if [ -f "$recovered_file" ]
-    then
-        echo "Deployment $d has been recovered";
-        continue;
-    fi
-
-    echo "Processing deployment $d";
-
-    # Find all UFrame NetCDFs to be processed
-    nc_dir="${d}/nc-source";
-    nc_files=$(find $nc_dir -type f -name '*.nc');
-    if [ -z "$nc_files" ]
-    then
-        echo "No NetCDF files to process $d";
-        continue
-    fi
-
-    for nc in $nc_files:
-    do
-        echo "UFrame NetCDF: $nc";
-    done
-    
-    [ -n "$DEBUG" ] && continue;
-
-    create_ioos_dac_netcdf.py --timestamping --verbosity $d;
-
-    [ "$?" -ne 0 ] && continue;
-
-    for nc in $nc_files
-    do
-        mv $nc "${nc}.pro";
-    done
-done
+# Process all deployments concurrently.  Source NetCDF files are renamed with
+# a .pro extension once they have been processed.
+if [ -n "$DEBUG" ]
+then
+    process_deployments.py -x --no-status;
+else
+    process_deployments.py --timestamping --verbosity --no-status;
+fi
 
 # Deactivate the gutils virtualenv
 deactivate;
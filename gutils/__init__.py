@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 import numpy as np
-from scipy.signal import boxcar, convolve
+from scipy.ndimage import uniform_filter1d, median_filter
+from scipy.signal import savgol_filter
 
 
 def clean_dataset(dataset):
@@ -12,8 +13,72 @@ def clean_dataset(dataset):
 
 
 def boxcar_smooth_dataset(dataset, window_size):
-    window = boxcar(window_size)
-    return convolve(dataset, window, 'same') / window_size
+    """Running mean of dataset over window_size points, computed in O(n) 
+    regardless of window_size.  Values beyond the ends of dataset are taken as
+    0, as with a 'same' mode convolution with a boxcar window.
+    """
+    return smooth_dataset(dataset, window_size, kernel='boxcar')
+
+
+def median_smooth_dataset(dataset, window_size):
+    """Running median of dataset over window_size points.  The end values of
+    dataset are repeated beyond the ends.
+    """
+    return smooth_dataset(dataset, window_size, kernel='median')
+
+
+def savgol_smooth_dataset(dataset, window_size, polyorder=2):
+    """Savitzky-Golay filter of dataset over window_size points, which is 
+    increased to the next odd number if even.  Datasets shorter than the window
+    are returned unsmoothed.
+    """
+    return smooth_dataset(dataset, window_size, kernel='savgol', polyorder=polyorder)
+
+
+def _boxcar_kernel(dataset, window_size):
+    return uniform_filter1d(dataset, window_size, mode='constant', cval=0.0)
+
+
+def _median_kernel(dataset, window_size):
+    return median_filter(dataset, size=window_size, mode='nearest')
+
+
+def _savgol_kernel(dataset, window_size, polyorder=2):
+    window_size += 1 - window_size % 2
+    if dataset.shape[0] < window_size or window_size <= polyorder:
+        return dataset.copy()
+    return savgol_filter(dataset, window_size, polyorder, mode='interp')
+
+
+# Smoothing kernels available to smooth_dataset
+SMOOTHING_KERNELS = {
+    'boxcar': _boxcar_kernel,
+    'median': _median_kernel,
+    'savgol': _savgol_kernel
+}
+
+
+def smooth_dataset(dataset, window_size, kernel='boxcar', **kwargs):
+    """Smooth the 1-dimensional dataset with the named kernel over window_size
+    points.  window_size is truncated to an integer and must be at least 1.
+    Additional keyword arguments are passed to the kernel.
+    
+    Kernels:
+        boxcar: running mean (see boxcar_smooth_dataset)
+        median: running median (see median_smooth_dataset)
+        savgol: Savitzky-Golay filter (see savgol_smooth_dataset)
+    """
+    
+    if kernel not in SMOOTHING_KERNELS:
+        raise ValueError('Invalid smoothing kernel {:s}'.format(kernel))
+        
+    window_size = int(window_size)
+    if window_size < 1:
+        raise ValueError('Smoothing window size must be at least 1')
+        
+    dataset = np.asarray(dataset, dtype='f8')
+    
+    return SMOOTHING_KERNELS[kernel](dataset, window_size, **kwargs)
 
 
 def validate_glider_args(*args):
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""Glider deployment configuration.  The datatypes.json, global_attributes.json,
+deployment.json and instruments.json files in a deployment configuration
+directory are parsed and validated once and cached in memory.  Cached entries
+are reloaded only when a configuration file is modified.
+"""
+
+import os
+import json
+import logging
+from netCDF4 import default_fillvals as NC_FILL_VALUES
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+REQUIRED_CFG_FILES = ['datatypes.json',
+    'global_attributes.json',
+    'deployment.json',
+    'instruments.json']
+
+REQUIRED_DEPLOYMENT_KEYS = ['glider',
+    'trajectory_date',
+    'platform',
+    'global_attributes']
+
+REQUIRED_DATATYPE_KEYS = ['name',
+    'dimension',
+    'type',
+    'attrs']
+
+REQUIRED_GLOBAL_BOUND_ATTRS = ['units',
+    'resolution',
+    'accuracy',
+    'precision']
+
+REQUIRED_INSTRUMENT_KEYS = ['name',
+    'type',
+    'attrs']
+
+# Parsed JSON files keyed by real path: (mtime, size), contents
+_JSON_CACHE = {}
+# DeploymentConfig instances keyed by real path: file stamps, config
+_CONFIG_CACHE = {}
+
+
+def _file_stamp(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime, stat.st_size
+
+
+def load_json_config(json_path):
+    """Parse and return the contents of the json_path configuration file.  The
+    parsed contents are cached and returned on subsequent calls until the file
+    is modified.  The returned object is shared and must not be modified.
+    """
+
+    key = os.path.realpath(json_path)
+    stamp = _file_stamp(key)
+
+    cached = _JSON_CACHE.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(key, 'r') as fid:
+        contents = json.load(fid)
+
+    _JSON_CACHE[key] = (stamp, contents)
+
+    return contents
+
+
+def load_deployment_config(config_path):
+    """Load, validate and return the gutils.config.DeploymentConfig for the
+    deployment configuration directory config_path.  Returns None if any of the
+    configuration files are missing, cannot be parsed or are invalid.
+
+    The DeploymentConfig is cached and returned on subsequent calls until one
+    of the configuration files is modified.
+    """
+
+    key = os.path.realpath(config_path)
+    if not os.path.isdir(key):
+        logger.error('Invalid deployment configuration path {:s}'.format(config_path))
+        return
+
+    cfg_files = [os.path.join(key, f) for f in REQUIRED_CFG_FILES]
+    missing = [f for f in cfg_files if not os.path.isfile(f)]
+    if missing:
+        for f in missing:
+            logger.error('Missing required config file {:s}'.format(f))
+        return
+
+    stamps = [_file_stamp(f) for f in cfg_files]
+    cached = _CONFIG_CACHE.get(key)
+    if cached and cached[0] == stamps:
+        return cached[1]
+
+    contents = []
+    for f in cfg_files:
+        try:
+            contents.append(load_json_config(f))
+        except (IOError, OSError, ValueError) as e:
+            logger.error('Error in {:s} - {:s}'.format(f, str(e)))
+            return
+
+    config = DeploymentConfig(config_path, *contents)
+
+    errors = config.validate()
+    if errors:
+        for e in errors:
+            logger.error('Invalid configuration {:s} - {:s}'.format(config_path, e))
+        return
+
+    _CONFIG_CACHE[key] = (stamps, config)
+
+    return config
+
+
+class DeploymentConfig(object):
+    """Parsed glider deployment configuration.  May be passed to
+    gutils.nc.open_glider_netcdf in place of the configuration path.
+    """
+
+    def __init__(self, config_path, datatypes, global_attributes, deployment, instruments):
+
+        self.config_path = config_path
+        self.datatypes = datatypes
+        self.global_attributes = global_attributes
+        self.deployment = deployment
+        self.instruments = instruments
+
+        self._attrs = None
+
+    def __repr__(self):
+        return '<DeploymentConfig: {:s}>'.format(self.config_path)
+
+    @property
+    def attrs(self):
+        """Dictionary containing the global attributes, updated with the
+        deployment global attributes, and the deployment and instruments
+        configurations.
+        """
+
+        if self._attrs is None:
+            global_attrs = dict(self.global_attributes)
+            global_attrs.update(self.deployment['global_attributes'])
+            self._attrs = {'global' : global_attrs,
+                'deployment' : self.deployment,
+                'instruments' : self.instruments}
+
+        return self._attrs
+
+    def validate(self):
+        """Returns a list of errors found in the configuration"""
+
+        errors = []
+
+        if not isinstance(self.global_attributes, dict):
+            errors.append('global_attributes.json must contain an object')
+
+        if not isinstance(self.deployment, dict):
+            errors.append('deployment.json must contain an object')
+        else:
+            for k in REQUIRED_DEPLOYMENT_KEYS:
+                if k not in self.deployment:
+                    errors.append('deployment.json missing {:s}'.format(k))
+            for k in ['platform', 'global_attributes']:
+                if k in self.deployment and not isinstance(self.deployment[k], dict):
+                    errors.append('deployment.json {:s} must be an object'.format(k))
+
+        if not isinstance(self.instruments, list):
+            errors.append('instruments.json must contain an array')
+        else:
+            for i, instrument in enumerate(self.instruments):
+                for k in REQUIRED_INSTRUMENT_KEYS:
+                    if k not in instrument:
+                        errors.append('instruments.json instrument {:d} missing {:s}'.format(i, k))
+                if instrument.get('type') not in NC_FILL_VALUES:
+                    errors.append('instruments.json instrument {:d} invalid type'.format(i))
+
+        if not isinstance(self.datatypes, dict):
+            errors.append('datatypes.json must contain an object')
+            return errors
+
+        if 'timestamp' not in self.datatypes:
+            errors.append('datatypes.json missing timestamp')
+
+        for key, desc in self.datatypes.items():
+            # Empty configurations are skipped by the writer
+            if not desc:
+                continue
+            for k in REQUIRED_DATATYPE_KEYS:
+                if k not in desc:
+                    errors.append('datatypes.json {:s} missing {:s}'.format(key, k))
+            if desc.get('type') not in NC_FILL_VALUES:
+                errors.append('datatypes.json {:s} invalid type'.format(key))
+            attrs = desc.get('attrs', {})
+            if 'global_bound' in desc:
+                for k in REQUIRED_GLOBAL_BOUND_ATTRS:
+                    if k not in attrs:
+                        errors.append('datatypes.json {:s} global_bound missing attrs {:s}'.format(key, k))
+            if 'status_flag' in desc:
+                if 'attrs' not in desc['status_flag']:
+                    errors.append('datatypes.json {:s} status_flag missing attrs'.format(key))
+                if 'standard_name' not in attrs:
+                    errors.append('datatypes.json {:s} status_flag requires attrs standard_name'.format(key))
+
+        return errors
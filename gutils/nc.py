@@ -16,7 +16,6 @@
 
 import os
 import sys
-import json
 from datetime import datetime
 from dateutil import parser
 
@@ -25,6 +24,8 @@ from netCDF4 import Dataset, stringtoarr
 from netCDF4 import default_fillvals as NC_FILL_VALUES
 
 from gutils.ctd import calculate_practical_salinity, calculate_density
+from gutils.config import DeploymentConfig, load_json_config
+from gutils.readers.stream import GliderStream
 
 import logging
 logger = logging.getLogger(__name__)
@@ -42,6 +43,21 @@ GLIDER_QC = {
     "missing_value": 9
 }
 
+# Precedence of the GLIDER_QC flags, from lowest to highest, used to combine 
+# the flags returned by multiple QC methods.  The flags are not a severity 
+# scale: value_changed and interpolated_value describe how a value was 
+# produced and are overridden by any suspect or bad flag.
+GLIDER_QC_PRECEDENCE = (
+    'no_qc_performed',
+    'good_data',
+    'probably_good_data',
+    'value_changed',
+    'interpolated_value',
+    'bad_data_that_are_potentially_correctable',
+    'bad_data',
+    'missing_value'
+)
+
 GLIDER_UV_DATATYPE_KEYS = (
     'time_uv',
     'm_water_vx',
@@ -50,6 +66,23 @@ GLIDER_UV_DATATYPE_KEYS = (
     'lat_uv'
 )
 
+def combine_qc_flags(flags, other_flags):
+    """Returns the array of GLIDER_QC flags taking, for each value, the flag 
+    in flags or other_flags with the higher GLIDER_QC_PRECEDENCE.  Flags not
+    listed in GLIDER_QC_PRECEDENCE (not_used) have the lowest precedence.
+    """
+
+    rank = np.zeros(max(GLIDER_QC.values()) + 1, dtype='i1')
+    for i, name in enumerate(GLIDER_QC_PRECEDENCE):
+        rank[GLIDER_QC[name]] = i
+
+    flags = np.array(flags, dtype='i1')
+    other_flags = np.asarray(other_flags, dtype='i1')
+    replace = rank[other_flags] > rank[flags]
+    flags[replace] = other_flags[replace]
+
+    return flags
+
 def open_glider_netcdf(output_path, config_path, mode=None, COMP_LEVEL=None,
                        DEBUG=False):
 
@@ -58,6 +91,44 @@ def open_glider_netcdf(output_path, config_path, mode=None, COMP_LEVEL=None,
     return GliderNetCDFWriter(output_path, config_path, mode, COMP_LEVEL, DEBUG)
 
 
+def create_netcdf_skeleton(skeleton_path, config, datatype_keys=None,
+                           COMP_LEVEL=None):
+    """Creates a fully initialized NetCDF file containing the global attributes,
+    trajectory, platform, instruments and datatype variables, but no data, for
+    the gutils.config.DeploymentConfig config.  Each profile file of the
+    deployment may then be created by copying the skeleton and opening the copy
+    in append mode to write the profile id and data.
+
+    Input:
+    - skeleton_path: Path to the skeleton NetCDF file to create.
+    - config: gutils.config.DeploymentConfig.
+    - datatype_keys: Datatypes for which to create variables.
+                     Default: all datatypes in config.
+    """
+
+    with open_glider_netcdf(skeleton_path, config, mode='w',
+                            COMP_LEVEL=COMP_LEVEL) as glider_nc:
+        # Set global attributes
+        glider_nc.set_global_attributes(config.attrs['global'])
+
+        # Set Trajectory
+        glider_nc.set_trajectory_id(
+            config.deployment['glider'],
+            config.deployment['trajectory_date']
+        )
+
+        # Set Platform
+        glider_nc.set_platform(config.deployment['platform'])
+
+        # Set Instruments
+        glider_nc.set_instruments(config.instruments)
+
+        # Create the datatype variables
+        glider_nc.set_datatypes(datatype_keys)
+
+    return skeleton_path
+
+
 class GliderNetCDFWriter(object):
     """Writes a NetCDF file for glider datasets
 
@@ -70,6 +141,8 @@ class GliderNetCDFWriter(object):
 
         Input:
         - output_path: Path to new or existing NetCDF file.
+        - config_path: Path to the deployment configuration directory or a
+                       gutils.config.DeploymentConfig.
         - mode: 'w' to create or overwrite a NetCDF file.
                 'a' to append to an existing NetCDF file.
                 Default: 'w'
@@ -80,9 +153,18 @@ class GliderNetCDFWriter(object):
         self.output_path = output_path
         self.mode = mode or 'w'
         self.COMP_LEVEL = COMP_LEVEL or 1
-        self.config_path = config_path
+        if isinstance(config_path, DeploymentConfig):
+            self.config = config_path
+            self.config_path = config_path.config_path
+        else:
+            self.config = None
+            self.config_path = config_path
         self.DEBUG = DEBUG
         self.datatypes = {}
+        self.qaqc_methods = {}
+        # Running statistics of the time dimension variables, keyed by
+        # variable name.  None if not available.
+        self.variable_stats = None
         
         #self.__create_netcdf()
 
@@ -95,14 +177,16 @@ class GliderNetCDFWriter(object):
         # Meanings of QC_FLAGS
         self.QC_FLAG_MEANINGS = "no_qc_performed good_data probably_good_data bad_data_that_are_potentially_correctable bad_data value_changed not_used not_used interpolated_value missing_value"  # NOQA
 
-        self.qaqc_methods = {}
-
     def __load_datatypes(self):
         """ Internal function to setup known datatypes
 
             Adds variables from base_variables.json
         """
 
+        if self.config:
+            self.datatypes = self.config.datatypes
+            return
+
         datatypes_path = os.path.join(
             self.config_path,
             'datatypes.json'
@@ -114,11 +198,10 @@ class GliderNetCDFWriter(object):
         #        'datatypes.json'
         #    )
 
-        with open(datatypes_path, 'r') as f:
-            contents = f.read()
-        self.datatypes = json.loads(contents)
+        # Parsed datatypes are cached until datatypes.json is modified
+        self.datatypes = load_json_config(datatypes_path)
 
-    def __update_history(self):
+    def update_history(self):
         """ Updates the history, date_created, date_modified
         and date_issued file attributes
         """
@@ -159,9 +242,14 @@ class GliderNetCDFWriter(object):
         self.__setup_qaqc()
         self.__load_datatypes()
 
-        self.__update_history()
+        self.update_history()
         self.stream_index = self.__get_time_len()
 
+        # The bounds and profile variables of a new file are calculated from
+        # running statistics of the inserted data instead of reading the data
+        # back from the file
+        self.variable_stats = {} if self.stream_index == 0 else None
+
         return self
 
     def __exit__(self, type, value, tb):
@@ -188,7 +276,7 @@ class GliderNetCDFWriter(object):
         #self.__setup_qaqc()
         self.__load_datatypes()
 
-        self.__update_history()
+        self.update_history()
         self.stream_index = self.__get_time_len()
 
         #return self
@@ -316,9 +404,11 @@ class GliderNetCDFWriter(object):
             fill_value=NC_FILL_VALUES[desc['type']]
         )
 
-        # Add an attribute to note the variable name used in the source data file
-        desc['attrs']['source_variable'] = key
-        for k, v in sorted(desc['attrs'].items()):
+        # Add an attribute to note the variable name used in the source data
+        # file.  desc is shared with other writers and is not modified.
+        attrs = dict(desc['attrs'])
+        attrs['source_variable'] = key
+        for k, v in sorted(attrs.items()):
             datatype.setncattr(k, v)
 
         if 'status_flag' in desc:
@@ -335,26 +425,92 @@ class GliderNetCDFWriter(object):
             )
             # Append defaults
             sf_standard_name = desc['attrs']['standard_name'] + ' status_flag'
-            status_flag['attrs'].update({
+            status_flag_attrs = dict(status_flag['attrs'])
+            status_flag_attrs.update({
                 'standard_name': sf_standard_name,
                 'flag_meanings': self.QC_FLAG_MEANINGS,
                 'valid_min': self.QC_FLAGS[0],
                 'valid_max': self.QC_FLAGS[-1],
                 'flag_values': self.QC_FLAGS
             })
-            for key, value in sorted(status_flag['attrs'].items()):
+            for key, value in sorted(status_flag_attrs.items()):
                 status_flag_var.setncattr(key, value)
         
-    def perform_qaqc(self, key, value):
-        if key in self.qaqc_methods:
-            flag = self.qaqc_methods[key](value)
-        elif value == NC_FILL_VALUES['f8']:
-            flag = GLIDER_QC["missing_value"]
+    def set_datatypes(self, keys=None):
+        """ Creates the variables for the datatypes specified by keys or for all
+        datatypes if keys is not specified.  Dimension datatypes are created
+        first.
+        """
+
+        if keys is None:
+            keys = self.datatypes.keys()
+
+        keys = sorted(
+            keys,
+            key=lambda k: not self.datatypes.get(k, {}).get('is_dimension', False)
+        )
+        for key in keys:
+            if self.datatypes.get(key):
+                self.check_datatype_exists(key)
+
+    def register_qaqc_method(self, key, method):
+        """ Registers a vectorized QC method for the datatype key
+
+        Input:
+        - key: datatype key (ie: sci_water_temp)
+        - method: callable taking a numpy array of values and returning an
+                  array of GLIDER_QC flags of the same length.  See
+                  gutils.qaqc for range and spike tests.
+
+        Multiple methods may be registered for the same key.  The resulting
+        flag for each value is the flag returned by all methods with the 
+        highest GLIDER_QC_PRECEDENCE (see combine_qc_flags).
+        """
+
+        self.qaqc_methods.setdefault(key, [])
+        if callable(self.qaqc_methods[key]):
+            self.qaqc_methods[key] = [self.qaqc_methods[key]]
+        self.qaqc_methods[key].append(method)
+
+    def perform_qaqc_array(self, key, values):
+        """ Returns an int8 array of QC flags for the values of datatype key
+
+        Missing (NaN or _FillValue) values are flagged as missing_value.  All
+        other values are flagged by the methods registered for key in
+        qaqc_methods or as no_qc_performed if there are none.
+        """
+
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biuf':
+            values = values.astype('f8')
+
+        if key in self.datatypes:
+            fill_value = NC_FILL_VALUES[self.datatypes[key]['type']]
         else:
-            flag = GLIDER_QC['no_qc_performed']
+            fill_value = NC_FILL_VALUES['f8']
+        missing = values == fill_value
+        if values.dtype.kind == 'f':
+            missing |= np.isnan(values)
+
+        flags = np.full(values.shape, GLIDER_QC['no_qc_performed'], dtype='i1')
+
+        methods = self.qaqc_methods.get(key, [])
+        if callable(methods):
+            methods = [methods]
+        if methods:
+            # QC methods see missing values as NaN
+            qc_values = values.astype('f8')
+            qc_values[missing] = np.nan
+            for method in methods:
+                flags = combine_qc_flags(flags, method(qc_values))
+
+        flags[missing] = GLIDER_QC['missing_value']
+
+        return flags
+
+    def perform_qaqc(self, key, value):
+        return self.perform_qaqc_array(key, np.array([value]))[0]
 
-        return flag
-        
     def set_scalar(self, key, value=None):
         datatype = self.check_datatype_exists(key)
 
@@ -377,21 +533,120 @@ class GliderNetCDFWriter(object):
             value = NC_FILL_VALUES[datatype['type']]
 
         self.nc.variables[datatype['name']][index] = value
+        self.__update_stats(datatype['name'], index, [value])
 
         if "status_flag" in datatype:
             status_flag_name = self.get_status_flag_name(datatype['name'])
             flag = self.perform_qaqc(key, value)
             self.nc.variables[status_flag_name][index] = flag
 
+    def set_array_slice(self, key, start, values):
+        datatype = self.check_datatype_exists(key)
+
+        # Set None or NaN values to _FillValue
+        values = self.__fill_missing_values(datatype, values)
+        stop = start + len(values)
+
+        self.nc.variables[datatype['name']][start:stop] = values
+        self.__update_stats(datatype['name'], start, values)
+
+        if "status_flag" in datatype:
+            status_flag_name = self.get_status_flag_name(datatype['name'])
+            flags = self.perform_qaqc_array(key, values)
+            self.nc.variables[status_flag_name][start:stop] = flags
+
+    def __fill_missing_values(self, datatype, values):
+        """ Returns values as a numpy array with None and NaN values replaced
+        by the datatype _FillValue
+        """
+
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biuf':
+            values = values.astype('f8')
+
+        if values.dtype.kind == 'f':
+            missing = np.isnan(values)
+            if missing.any():
+                values = np.where(
+                    missing,
+                    NC_FILL_VALUES[datatype['type']],
+                    values
+                )
+
+        return values
+
+    def __update_stats(self, name, start, values):
+        """ Adds the values written to the time dimension variable name,
+        starting at index start, to the running statistics of the variable.
+        The statistics are invalidated unless the values are appended to the
+        values previously written in this session.
+        """
+
+        if self.variable_stats is None or 'time' not in self.nc.variables[name].dimensions:
+            return
+
+        stats = self.variable_stats.setdefault(name, {'count': 0})
+        if stats is None:
+            return
+        if start != stats['count']:
+            self.__invalidate_stats(name)
+            return
+
+        # Values as stored in the file, with missing values as NaN
+        values = np.asarray(values).astype(self.nc.variables[name].dtype)
+        if values.dtype.kind not in 'biuf':
+            self.__invalidate_stats(name)
+            return
+        if values.dtype.kind == 'f':
+            values = np.where(values == NC_FILL_VALUES['f8'], np.nan, values)
+            valid = values[~np.isnan(values)]
+        else:
+            valid = values
+
+        if valid.shape[0]:
+            stats['min'] = min(stats['min'], valid.min()) if 'min' in stats else valid.min()
+            stats['max'] = max(stats['max'], valid.max()) if 'max' in stats else valid.max()
+        stats['sum'] = stats['sum'] + values.sum() if 'sum' in stats else values.sum()
+        stats['count'] += values.shape[0]
+
+    def __invalidate_stats(self, name):
+        if self.variable_stats is not None:
+            self.variable_stats[name] = None
+
+    def __variable_stat(self, name, stat, operation):
+        """ Returns the min, max or mean (stat) of the time dimension variable
+        name from the running statistics if available.  Otherwise the data is
+        read from the file and reduced with operation.
+        """
+
+        variable = self.nc.variables[name]
+
+        stats = None
+        if self.variable_stats is not None and 'time' in variable.dimensions:
+            stats = self.variable_stats.get(name, {'count': 0})
+
+        if stats is None or (variable.dtype.kind != 'f' and stats['count'] < self.__get_time_len()):
+            return self.__netcdf_to_np_op(variable[:], operation)
+
+        # Values not written in this session are missing
+        if stat == 'mean':
+            if stats['count'] == 0 or stats['count'] < self.__get_time_len():
+                return variable.dtype.type(np.nan)
+            if variable.dtype.kind != 'f':
+                return np.float64(stats['sum']) / stats['count']
+            return stats['sum'].dtype.type(stats['sum'] / stats['count'])
+
+        return stats.get(stat, variable.dtype.type(np.nan))
+
     def set_array(self, key, values):
         datatype = self.check_datatype_exists(key)
 
         self.nc.variables[datatype['name']][:] = values
+        self.__invalidate_stats(datatype['name'])
         if "status_flag" in datatype:
             status_flag_name = self.get_status_flag_name(datatype['name'])
-            for i, value in enumerate(values):
-                flag = self.perform_qaqc(key, value)
-                self.nc.variables[status_flag_name][i] = flag
+            flags = self.perform_qaqc_array(key, values)
+            self.nc.variables[status_flag_name][:] = flags
 
     def set_segment_id(self, segment_id):
         """ Sets the segment ID as a variable
@@ -484,6 +739,58 @@ class GliderNetCDFWriter(object):
                     self.fill_uv_vars(line)
 
         self.stream_index += 1
+
+    def stream_insert(self, block):
+        """ Adds a block of rows to the NetCDF file.  Each datatype variable
+        and its status flag variable is written in a single slice.
+
+        Input:
+        - block: A columnar block of rows.  One of:
+                 gutils.readers.stream.GliderStream
+                 dictionary mapping datatype keys to equal length arrays
+                 numpy structured array with datatype keys as field names
+        """
+
+        if isinstance(block, GliderStream):
+            columns = block.columns
+        elif isinstance(block, np.ndarray) and block.dtype.names:
+            columns = {name: block[name] for name in block.dtype.names}
+        else:
+            columns = block
+
+        if 'timestamp' not in columns:
+            raise ValueError('No timestamp found for block')
+
+        num_rows = len(columns['timestamp'])
+        if num_rows == 0:
+            return
+
+        # Insert timestamp first to extend the time dimension
+        self.set_array_slice('timestamp', self.stream_index, columns['timestamp'])
+
+        for name, values in columns.items():
+            if name == 'timestamp':
+                continue  # Skip timestamp, inserted above
+
+            try:
+                datatype = self.check_datatype_exists(name)
+            except KeyError:
+                if self.DEBUG:
+                    logger.exception("Datatype {} does not exist".format(name))
+                continue
+
+            if len(values) != num_rows:
+                raise ValueError('Column {:s} length does not match timestamp'.format(name))
+
+            if datatype['dimension'] == 'time':
+                self.set_array_slice(name, self.stream_index, values)
+            else:
+                # Scalars take the value of the last row in the block
+                self.set_scalar(name, values[-1])
+                if name == "m_water_vx-m/s":
+                    self.fill_uv_vars({k: v[-1] for k, v in columns.items()})
+
+        self.stream_index += num_rows
         
     def contains(self, datatype_key):
         if datatype_key in self.datatypes:
@@ -536,33 +843,21 @@ class GliderNetCDFWriter(object):
         """
 
         if 'time' in self.nc.variables:
-            profile_time = self.__netcdf_to_np_op(
-                self.nc.variables['time'][:],
-                np.nanmin
-            )
+            profile_time = self.__variable_stat('time', 'min', np.nanmin)
             self.set_scalar('profile_time', profile_time)
 
         if 'lon' in self.nc.variables:
-            profile_lon = self.__netcdf_to_np_op(
-                self.nc.variables['lon'][:],
-                np.average
-            )
+            profile_lon = self.__variable_stat('lon', 'mean', np.average)
             self.set_scalar('profile_lon', profile_lon)
 
         if 'lat' in self.nc.variables:
-            profile_lat = self.__netcdf_to_np_op(
-                self.nc.variables['lat'][:],
-                np.average
-            )
+            profile_lat = self.__variable_stat('lat', 'mean', np.average)
             self.set_scalar('profile_lat', profile_lat)
             
     def update_global_title(self, glider):
         
         if 'time' in self.nc.variables:
-            profile_time = self.__netcdf_to_np_op(
-                self.nc.variables['time'][:],
-                np.nanmin
-            )
+            profile_time = self.__variable_stat('time', 'min', np.nanmin)
             dt = datetime.utcfromtimestamp(profile_time)
             self.nc.title = '{:s}-{:s}'.format(glider, dt.strftime('%Y%m%dT%H%M'))
 
@@ -574,20 +869,13 @@ class GliderNetCDFWriter(object):
         for key, desc in self.datatypes.items():
             if 'global_bound' in desc:
                 prefix = desc['global_bound']
-                dataset = self.nc.variables[desc['name']][:]
                 self.nc.setncattr(
                     prefix + '_min',
-                    self.__netcdf_to_np_op(
-                        dataset,
-                        np.nanmin
-                    )
+                    self.__variable_stat(desc['name'], 'min', np.nanmin)
                 )
                 self.nc.setncattr(
                     prefix + '_max',
-                    self.__netcdf_to_np_op(
-                        dataset,
-                        np.nanmax
-                    )
+                    self.__variable_stat(desc['name'], 'max', np.nanmax)
                 )
                 self.nc.setncattr(
                     prefix + '_units',
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Vectorized QC tests which may be registered with
+gutils.nc.GliderNetCDFWriter.register_qaqc_method.  Each function returns a
+callable that takes a numpy array of values and returns an array of
+gutils.nc.GLIDER_QC flags of the same length.
+"""
+
+import numpy as np
+
+from gutils.nc import GLIDER_QC
+
+
+def range_test(fail_min, fail_max, suspect_min=None, suspect_max=None):
+    """Returns a gross range test.
+
+    Values outside fail_min/fail_max are flagged as bad_data.  Values outside
+    suspect_min/suspect_max, if specified, are flagged as
+    bad_data_that_are_potentially_correctable.  All other finite values are
+    flagged as good_data.
+    """
+
+    def qaqc_range(values):
+
+        values = np.asarray(values, dtype='f8')
+        flags = np.full(values.shape, GLIDER_QC['good_data'], dtype='i1')
+
+        with np.errstate(invalid='ignore'):
+            if suspect_min is not None:
+                flags[values < suspect_min] = GLIDER_QC['bad_data_that_are_potentially_correctable']
+            if suspect_max is not None:
+                flags[values > suspect_max] = GLIDER_QC['bad_data_that_are_potentially_correctable']
+            flags[np.logical_or(values < fail_min, values > fail_max)] = GLIDER_QC['bad_data']
+
+        flags[np.isnan(values)] = GLIDER_QC['missing_value']
+
+        return flags
+
+    return qaqc_range
+
+
+def spike_test(suspect_threshold, fail_threshold):
+    """Returns a spike test.
+
+    The spike height of each value is the absolute difference between the value
+    and the mean of its neighbors, less half the absolute difference of the
+    neighbors.  Spike heights exceeding suspect_threshold are flagged as
+    bad_data_that_are_potentially_correctable and heights exceeding
+    fail_threshold are flagged as bad_data.  The first and last values cannot
+    be evaluated and are flagged as no_qc_performed.
+    """
+
+    def qaqc_spike(values):
+
+        values = np.asarray(values, dtype='f8')
+        flags = np.full(values.shape, GLIDER_QC['no_qc_performed'], dtype='i1')
+        if values.shape[0] < 3:
+            return flags
+
+        prev_values = values[:-2]
+        next_values = values[2:]
+        spike = np.abs(values[1:-1] - (prev_values + next_values) / 2) - np.abs(next_values - prev_values) / 2
+
+        spike_flags = np.full(spike.shape, GLIDER_QC['good_data'], dtype='i1')
+        with np.errstate(invalid='ignore'):
+            spike_flags[spike > suspect_threshold] = GLIDER_QC['bad_data_that_are_potentially_correctable']
+            spike_flags[spike > fail_threshold] = GLIDER_QC['bad_data']
+        # Values with a missing neighbor cannot be evaluated
+        spike_flags[np.isnan(spike)] = GLIDER_QC['no_qc_performed']
+        flags[1:-1] = spike_flags
+
+        flags[np.isnan(values)] = GLIDER_QC['missing_value']
+
+        return flags
+
+    return qaqc_spike
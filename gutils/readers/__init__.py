@@ -3,6 +3,10 @@ import numpy as np
 import logging
 import os
 
+from gutils.readers.stream import GliderStream
+from gutils.yo import ProfileIndex
+from gutils.yo.incremental import IncrementalYoIndexer
+
 logger = logging.getLogger(os.path.basename(__file__))
 
 def stream_to_yo(stream, depthsensor, timesensor=None):
@@ -13,7 +17,10 @@ def stream_to_yo(stream, depthsensor, timesensor=None):
      
     timesensor = timesensor or 'timestamp'
     
-    sensor_names = stream[0].keys()
+    if isinstance(stream, GliderStream):
+        sensor_names = stream.sensor_names
+    else:
+        sensor_names = stream[0].keys()
     if depthsensor not in sensor_names:
         logger.error('z_sensor {:s} not found in stream rows'.format(depthsensor))
         return np.empty((0,2))
@@ -22,23 +29,29 @@ def stream_to_yo(stream, depthsensor, timesensor=None):
         logger.error('t_sensor {:s} not found in stream rows'.format(timesensor))
         return np.empty((0,2))
         
+    if isinstance(stream, GliderStream):
+        return np.column_stack((stream[timesensor], stream[depthsensor])).astype('f8')
+        
     return np.asarray([[r[timesensor],r[depthsensor]] for r in stream])
     
 def stream_to_profiles(timestamps, profile_times):
     
     profile_streams = []
+    
+    if isinstance(profile_times, ProfileIndex):
+        # Profile rows are contiguous
+        profile_rows = profile_times.slices()
+    else:
+        profile_rows = (np.flatnonzero(np.logical_and(timestamps >= pt[0], timestamps <= pt[1])) for pt in profile_times)
 
     p_counter = 0
-    for pt in profile_times:
+    for profile_inds in profile_rows:
         
-        p0 = pt[0]
-        p1 = pt[1]
+        profile_ts = timestamps[profile_inds]
         
-        profile_inds = np.flatnonzero(np.logical_and(timestamps >= p0, timestamps <= p1))
+        profile_stream = np.full((len(profile_ts),3), np.nan)
         
-        profile_stream = np.full((len(profile_inds),3), np.nan)
-        
-        profile_stream[:,0] = timestamps[profile_inds]
+        profile_stream[:,0] = profile_ts
         profile_stream[:,2] = p_counter
         
         profile_streams.append(profile_stream)
@@ -46,4 +59,184 @@ def stream_to_profiles(timestamps, profile_times):
         p_counter += 1
         
     return profile_streams
-        
\ No newline at end of file
+        
+    
+def iter_stream_profiles(streams, depthsensor, timesensor=None, indexer=None, pending=None, flush=True):
+    """Generator indexing the profiles contained in a sequence of consecutive 
+    streams, such as the chunks of one or more time-ordered source files.  
+    streams is an iterable of (source, GliderStream) tuples.  Only the stream
+    rows which may belong to a profile that is not yet complete are carried 
+    over from one stream to the next, so the memory required does not depend 
+    on the total number of rows.
+    
+    Yields a (source, profile_times, profile_stream) tuple for each profile as
+    soon as it is complete, where source is that of the stream which completed
+    the profile, profile_times is the profile (start, end) time and 
+    profile_stream contains the profile rows, excluding the last row.  The 
+    remaining profiles are yielded after the last stream has been read.
+    
+    Each stream is sorted by timesensor.  Rows without a finite timestamp and
+    rows which are not later than the previously indexed rows are skipped.
+    
+    If flush is False, the remaining profiles are not indexed.  Instead, a 
+    final (source, None, pending) tuple is yielded, where pending contains the
+    rows buffered by the indexer.  Indexing is continued, for example by a 
+    later run, by passing pending along with a new indexer created with 
+    start_time=indexer.resume_time.
+    
+    Options:
+        timesensor: timestamp sensor name <Default=timestamp>
+        indexer: gutils.yo.incremental.IncrementalYoIndexer 
+            <Default=IncrementalYoIndexer()>
+        pending: GliderStream of the rows carried over from a previous call
+            with flush=False, which are indexed ahead of streams
+        flush: index the remaining profiles once the last stream has been
+            read <Default=True>
+    """
+    
+    timesensor = timesensor or 'timestamp'
+    if indexer is None:
+        indexer = IncrementalYoIndexer()
+        
+    if pending is not None and len(pending):
+        streams = prepend_stream(pending, streams, timesensor)
+        
+    # Stream rows which may belong to an incomplete profile.  pending_offset is
+    # the indexer row of the first pending row
+    pending = GliderStream()
+    pending_offset = indexer.row_offset
+    
+    source = None
+    for source, stream in streams:
+        
+        # Profiles are indexed as contiguous rows of the time-sorted stream
+        ts = stream[timesensor]
+        finite = np.isfinite(ts)
+        if not finite.all():
+            logger.warning('Skipping {:d} rows without a finite {:s} {:s}'.format(int((~finite).sum()), timesensor, str(source)))
+            stream = stream.take(finite)
+            ts = stream[timesensor]
+        if np.any(ts[1:] < ts[:-1]):
+            logger.info('Sorting {:s} by {:s}'.format(str(source), timesensor))
+            stream = stream.take(np.argsort(ts, kind='mergesort'))
+            
+        # Skip rows already read from a previous, overlapping stream
+        if indexer.last_timestamp is not None:
+            stream = stream.take(stream[timesensor] > indexer.last_timestamp)
+            
+        yo = stream_to_yo(stream, depthsensor, timesensor=timesensor)
+        if yo.shape[0] == 0:
+            logger.debug('No new records {:s}'.format(str(source)))
+            continue
+            
+        # Index the newly completed profiles
+        pending = GliderStream.concatenate([pending, stream])
+        profile_index = indexer.append(yo[:,0], yo[:,1])
+        
+        for profile_times, rows in zip(profile_index.times, profile_index.slices()):
+            yield source, profile_times, pending[rows.start-pending_offset:rows.stop-pending_offset-1]
+            
+        # Drop the rows which are no longer buffered by the indexer
+        pending = pending[indexer.row_offset - pending_offset:]
+        pending_offset = indexer.row_offset
+        
+    if not flush:
+        yield source, None, pending
+        return
+        
+    # Remaining profiles
+    profile_index = indexer.flush()
+    for profile_times, rows in zip(profile_index.times, profile_index.slices()):
+        yield source, profile_times, pending[rows.start-pending_offset:rows.stop-pending_offset-1]
+        
+def prepend_stream(pending, streams, timesensor):
+    """Generator yielding the (source, GliderStream) tuples in streams with the
+    pending GliderStream rows prepended to the first stream.  Rows of the first
+    stream which are not later than the last pending row are skipped."""
+    
+    last_ts = np.nanmax(pending[timesensor])
+    for source, stream in streams:
+        if pending is not None:
+            stream = GliderStream.concatenate([pending, stream.take(stream[timesensor] > last_ts)])
+            pending = None
+        yield source, stream
+        
+    if pending is not None:
+        yield None, pending
+        
+def merge_streams(sources, timesensor=None):
+    """Generator merging the streams read from several sources, such as 
+    overlapping source files, into a single time-ordered sequence of streams 
+    with duplicate timestamps removed.  sources is a list of (source, streams)
+    tuples, where streams is an iterable of the consecutive, time-ordered 
+    GliderStream pieces read from source.  Only the current piece of each 
+    source is held in memory.
+    
+    Yields a (source, GliderStream) tuple for each merged stream, which may be
+    passed to iter_stream_profiles, where source is the comma separated list 
+    of the sources contributing rows to the stream.  Of the rows with the same
+    timestamp, the row read from the first source in sources is kept.  Rows 
+    without a timestamp are skipped.
+    
+    Options:
+        timesensor: timestamp sensor name <Default=timestamp>
+    """
+    
+    timesensor = timesensor or 'timestamp'
+    
+    names = [str(source) for source, streams in sources]
+    pieces = [iter(streams) for source, streams in sources]
+    
+    def next_piece(i):
+        """Return the next non-empty, time-sorted piece of source i or None if
+        the source is exhausted"""
+        
+        for stream in pieces[i]:
+            ts = stream[timesensor]
+            if np.isnan(ts).any():
+                stream = stream.take(~np.isnan(ts))
+                ts = stream[timesensor]
+            if np.any(ts[1:] < ts[:-1]):
+                logger.info('Sorting {:s} by {:s}'.format(names[i], timesensor))
+                stream = stream.take(np.argsort(ts, kind='mergesort'))
+            if len(stream):
+                return stream
+                
+    buffers = [next_piece(i) for i in range(len(pieces))]
+    last_ts = None
+    
+    while any(b is not None for b in buffers):
+        
+        # No source can supply rows earlier than the end of the buffered piece
+        # ending first, so all buffered rows up to that time are merged
+        active = [i for i in range(len(buffers)) if buffers[i] is not None]
+        watermark = min(buffers[i][timesensor][-1] for i in active)
+        
+        merged = []
+        contributors = []
+        for i in active:
+            n = np.searchsorted(buffers[i][timesensor], watermark, side='right')
+            if n:
+                merged.append(buffers[i][:n])
+                contributors.append(names[i])
+            buffers[i] = buffers[i][n:] if n < len(buffers[i]) else next_piece(i)
+            
+        stream = merged[0] if len(merged) == 1 else GliderStream.concatenate(merged)
+        
+        # Stable sort so that duplicates are taken from the first source
+        ts = stream[timesensor]
+        order = np.argsort(ts, kind='mergesort')
+        ts = ts[order]
+        keep = np.ones(ts.shape[0], dtype=bool)
+        keep[1:] = ts[1:] != ts[:-1]
+        if last_ts is not None:
+            keep &= ts > last_ts
+            
+        if not keep.all():
+            logger.debug('Skipping {:d} duplicate rows {:s}'.format(int((~keep).sum()), ', '.join(contributors)))
+        if not keep.any():
+            continue
+            
+        last_ts = ts[keep][-1]
+        
+        yield ', '.join(contributors), stream.take(order[keep])
@@ -1,83 +1,128 @@
-
 import numpy as np
 import os
 import logging
+from collections import OrderedDict
+
+from gutils.readers.stream import GliderStream
 
 logger = logging.getLogger(os.path.basename(__file__))
 
 DBA_TIMESENSORS = ['m_present_time',
     'sci_m_present_time',
     'sci_ctd41cp_timestamp']
-    
-def dba_to_stream(dbd, timesensor=None):
-    """Parse a Slocum glider ascii dba file and return a dictionary containing 
-    the dbd file metadata and the data stream.  The
-    data stream is an array in which each element is a dictionary mapping the 
-    sensor name to the sensor value for each row contained in the dbd file.
+
+# numpy dtype of each sensor column by the number of bytes used to store the
+# sensor value in the binary file.  1 and 2 byte integer sensors are stored as
+# floats so that missing values may be NaN.  Narrowing the ascii dba values to
+# these dtypes rounds them, so dba_to_stream only narrows when asked to.
+DBA_SENSOR_DTYPES = {'1' : 'f4',
+    '2' : 'f4',
+    '4' : 'f4',
+    '8' : 'f8'}
+
+def parse_dba_header(fid):
+    """Parse the header and sensor label lines from the open dba file fid,
+    leaving fid positioned at the first data row.  Returns the header
+    dictionary and the lists of sensor names, units and bytes.
+    """
+
+    header = {}
+    line = ''
+    for line in fid:
+
+        tokens = line.strip().split(': ')
+        if len(tokens) == 1:
+            break
+
+        header[tokens[0]] = tokens[1]
+
+    # First line after the for break is the list of sensors
+    sensor_names = line.split()
+    # Next line is the units
+    sensor_units = next(fid, '').split()
+    # Next line is number of bytes
+    sensor_bytes = next(fid, '').split()
+
+    return header, sensor_names, sensor_units, sensor_bytes
+
+def dba_to_stream(dbd, timesensor=None, sensors=None, narrow=False):
+    """Parse a Slocum glider ascii dba file and return a dictionary containing
+    the dbd file metadata and the data stream.  The data stream is a
+    gutils.readers.stream.GliderStream containing a float64 column for each 
+    sensor contained in the dbd file and a timestamp column containing the 
+    values of timesensor.
+
+    Options:
+        timesensor: master time sensor name.  Taken from the first
+            DBA_TIMESENSORS sensor contained in the file if not specified
+        sensors: list of sensor names to load.  All sensors are loaded if not
+            specified
+        narrow: store each sensor column with the precision of the sensor 
+            (DBA_SENSOR_DTYPES) to reduce the memory required.  The values are
+            rounded to that precision.
     """
-    
-    dbd_data = {'meta' : {}, 'stream' : []}
+
+    dbd_data = {'meta' : {}, 'stream' : GliderStream()}
     if not os.path.isfile(dbd):
         logger.error('File does not exist {:s}'.format(dbd))
         return
-        
+
     with open(dbd, 'r') as fid:
-        
-        skiprows = 0
-        header = {}
-        for line in fid:
-            
-            tokens = line.strip().split(': ')
-            if len(tokens) == 1:
-                break
-                
-            if tokens[0] == 'num_ascii_tags' or tokens[0] == 'num_label_lines':
-                skiprows += int(tokens[1])
-                
-            header[tokens[0]] = tokens[1]
-        
-        # First line after the for break is the list of sensors
-        sensor_names = line.split()
-        # Next line is the units
-        sensor_units = fid.next().split()
-        # Next line is number of bytes
-        sensor_bytes = fid.next().split()
-        
-    # If no timesensor specified, find the first one in DBA_TIMESENSORS
-    if not timesensor:
-        for s in DBA_TIMESENSORS:
-            if s in sensor_names:
-                timesensor = s
-                break
-        
-    # Load the data into a numpy array
-    data = np.loadtxt(dbd, skiprows=skiprows)
-    if not len(data):
+
+        header, sensor_names, sensor_units, sensor_bytes = parse_dba_header(fid)
+
+        # If no timesensor specified, find the first one in DBA_TIMESENSORS
+        if not timesensor:
+            for s in DBA_TIMESENSORS:
+                if s in sensor_names:
+                    timesensor = s
+                    break
+
+        # Make sure timesensor is in sensor_names
+        if not timesensor:
+            logger.error('No master time sensor name found {:s}'.format(dbd))
+            return
+        elif timesensor not in sensor_names:
+            logger.error('Master time sensor {:s} not found {:s}'.format(timesensor, dbd))
+            return
+
+        # Tokenize all data rows at once
+        data = np.fromstring(fid.read(), sep=' ')
+
+    num_sensors = len(sensor_names)
+    num_rows = data.shape[0] // num_sensors
+    if not num_rows:
         logger.warning('No data rows found {:s}'.format(dbd))
         return
-        
-    stream = []
-    col_range = range(len(sensor_names))
-    for d in data:
-        
-        row = {sensor_names[c]:d[c] for c in col_range}
-        row['timestamp'] = row[timesensor]
-        
-        dbd_data['stream'].append(row)
-        
-    # Make sure timesensor is in sensor_names
-    if not timesensor:
-        logger.error('No master time sensor name found {:s}'.format(dbd))
-        return
-    elif timesensor not in sensor_names:
-        logger.error('Master time sensor {:s} not found {:s}'.format(dbd, timesensor))
-        return
-        
+    if data.shape[0] % num_sensors:
+        logger.warning('Skipping incomplete final data row {:s}'.format(dbd))
+
+    data = data[:num_rows*num_sensors].reshape((num_rows, num_sensors))
+
+    # Columns to load
+    if sensors:
+        missing = [s for s in sensors if s not in sensor_names]
+        for s in missing:
+            logger.warning('Sensor {:s} not found {:s}'.format(s, dbd))
+        columns = [c for c in range(num_sensors) if sensor_names[c] in sensors or sensor_names[c] == timesensor]
+    else:
+        columns = range(num_sensors)
+
+    stream_columns = OrderedDict()
+    for c in columns:
+        dtype = 'f8'
+        if narrow:
+            dtype = DBA_SENSOR_DTYPES.get(sensor_bytes[c] if c < len(sensor_bytes) else None, 'f8')
+        stream_columns[sensor_names[c]] = data[:,c].astype(dtype)
+    stream_columns['timestamp'] = data[:,sensor_names.index(timesensor)].copy()
+
+    dbd_data['stream'] = GliderStream(stream_columns)
+
     # Add the file metadata
     dbd_data['meta']['header'] = header
-    dbd_data['meta']['sensor_names'] = sensor_names
-    dbd_data['meta']['sensor_units'] = sensor_units
-    dbd_data['meta']['sensor_bytes'] = sensor_bytes
-    
+    dbd_data['meta']['sensor_names'] = [sensor_names[c] for c in columns]
+    dbd_data['meta']['sensor_units'] = [sensor_units[c] for c in columns]
+    dbd_data['meta']['sensor_bytes'] = [sensor_bytes[c] for c in columns]
+
     return dbd_data
-    
+
@@ -0,0 +1,320 @@
+"""Native reader for the Slocum glider binary data files (dbd, ebd, sbd, tbd,
+mbd, nbd).  Files are decoded directly into numpy columns without first
+converting them to ascii with the Teledyne dbd2asc tools.
+
+Binary file layout:
+    ascii header: num_ascii_tags lines of 'key: value' pairs
+    sensor list: total_num_sensors 's:' lines, unless the header
+        sensor_list_factored is 1, in which case the list is read from the
+        <sensor_list_crc>.cac sensor list cache file
+    known bytes cycle: 's', 'a', the int16 0x1234, the float32 123.456 and the
+        float64 123456789.12345, from which the byte order is determined
+    data cycles: 'd', state_bytes_per_cycle state bytes and the values of the
+        sensors updated with a new value.  The state bytes contain 2 bits for
+        each sensor in the file, most significant bits first:
+            0: sensor not updated (NaN)
+            1: sensor updated with its previous value
+            2: sensor updated with the new value that follows
+    end of file: 'X'
+"""
+
+import numpy as np
+import os
+import logging
+from collections import OrderedDict
+
+from gutils.readers.stream import GliderStream
+from gutils.readers.dba import DBA_TIMESENSORS, DBA_SENSOR_DTYPES
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DBD_CYCLE_TAG = ord('d')
+DBD_END_TAG = ord('X')
+
+# Binary value type by number of bytes
+DBD_VALUE_TYPES = {1 : 'i1',
+    2 : 'i2',
+    4 : 'f4',
+    8 : 'f8'}
+
+# 2 bit sensor states of the 4 sensors of each of the 256 possible state byte
+# values
+DBD_BYTE_STATES = (np.arange(256)[:,None] >> np.array([6, 4, 2, 0])) & 3
+
+# Number of state bytes decoded at once, so that the memory required does not
+# depend on the number of sensors in the file
+DBD_CHUNK_STATE_BYTES = 1000000
+
+def parse_sensor_list(lines):
+    """Parse the 's:' sensor list lines from a binary file or sensor list cache
+    file.  Returns a list of dictionaries, in file order, for the sensors
+    contained in the file.
+    """
+
+    sensors = []
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 7 or tokens[0] != 's:':
+            continue
+        if tokens[1] != 'T':
+            continue
+        sensors.append({'name' : tokens[5],
+            'units' : tokens[6],
+            'bytes' : int(tokens[4]),
+            'index' : int(tokens[3])})
+
+    return sorted(sensors, key=lambda s: s['index'])
+
+def read_sensor_list_cache(cache_file):
+    """Parse the sensor list cache file"""
+
+    with open(cache_file, 'r') as fid:
+        return parse_sensor_list(fid)
+
+def read_dbd_header(fid, cache_dir=None):
+    """Parse the ascii header and sensor list from the open binary file fid,
+    leaving fid positioned at the known bytes cycle.  The sensor list is read
+    from the cache_dir sensor list cache file if the sensor list is factored,
+    and is written to cache_dir if the cache file does not exist.
+
+    Returns the header dictionary and the list of sensors contained in the
+    file or None if the header or sensor list cannot be read.
+    """
+
+    header = {}
+    num_ascii_tags = None
+    while num_ascii_tags is None or len(header) < num_ascii_tags:
+        line = fid.readline().decode('ascii', 'replace')
+        tokens = line.strip().split(': ')
+        if len(tokens) != 2:
+            logger.error('Invalid binary header line: {:s}'.format(line.strip()))
+            return None, None
+        header[tokens[0]] = tokens[1]
+        if tokens[0] == 'num_ascii_tags':
+            num_ascii_tags = int(tokens[1])
+
+    crc = header.get('sensor_list_crc', '').lower()
+    cache_file = None
+    if cache_dir and crc:
+        cache_file = os.path.join(cache_dir, '{:s}.cac'.format(crc))
+
+    if header.get('sensor_list_factored') == '1':
+        if not cache_file or not os.path.isfile(cache_file):
+            logger.error('Sensor list cache file not found: {:s}'.format(cache_file or '{:s}.cac'.format(crc)))
+            return header, None
+        return header, read_sensor_list_cache(cache_file)
+
+    sensor_lines = [fid.readline().decode('ascii', 'replace') for i in range(int(header.get('total_num_sensors', 0)))]
+
+    if cache_file and not os.path.isfile(cache_file):
+        logger.debug('Writing sensor list cache {:s}'.format(cache_file))
+        try:
+            with open(cache_file, 'w') as cache_fid:
+                cache_fid.write(''.join(sensor_lines))
+        except (IOError, OSError) as e:
+            logger.warning('Failed to write sensor list cache {:s} ({:s})'.format(cache_file, str(e)))
+
+    return header, parse_sensor_list(sensor_lines)
+
+def known_bytes_order(raw, offset):
+    """Return the numpy byte order character ('>' or '<') of the known bytes
+    cycle at offset in the raw uint8 array or None if the known bytes cycle is
+    invalid"""
+
+    if raw.shape[0] < offset + 16 or raw[offset] != ord('s') or raw[offset+1] != ord('a'):
+        return
+
+    for byte_order in ['>', '<']:
+        if raw[offset+2:offset+4].view('{:s}i2'.format(byte_order))[0] == 0x1234:
+            return byte_order
+
+def dbd_value_bytes(sensor_bytes, state_bytes_per_cycle):
+    """Return the (state_bytes_per_cycle, 256) array containing the number of
+    new value bytes following each state byte for each of the 256 possible 
+    state byte values"""
+
+    sizes = np.zeros(state_bytes_per_cycle*4, dtype='i4')
+    sizes[:len(sensor_bytes)] = sensor_bytes
+
+    return np.dot(sizes.reshape((-1, 4)), DBD_BYTE_STATES.T == 2).astype('i4')
+
+def find_dbd_cycles(raw, offset, sensor_bytes, state_bytes_per_cycle):
+    """Return the array of byte offsets of each complete data cycle in the raw
+    uint8 array, starting at offset"""
+
+    num_bytes = raw.shape[0]
+    header_bytes = 1 + state_bytes_per_cycle
+    value_bytes = dbd_value_bytes(sensor_bytes, state_bytes_per_cycle)
+    state_inds = np.arange(state_bytes_per_cycle)
+
+    # Length of the data cycle that would start at each cycle tag byte, 
+    # computed in blocks of DBD_CHUNK_STATE_BYTES state bytes
+    tags = offset + np.flatnonzero(raw[offset:num_bytes - header_bytes + 1] == DBD_CYCLE_TAG)
+    cycle_bytes = np.empty(tags.shape[0], dtype='i8')
+    block_size = max(1, DBD_CHUNK_STATE_BYTES // state_bytes_per_cycle)
+    for b0 in range(0, tags.shape[0], block_size):
+        state_bytes = raw[tags[b0:b0+block_size,None] + 1 + state_inds]
+        cycle_bytes[b0:b0+block_size] = header_bytes + value_bytes[state_inds, state_bytes].sum(axis=1)
+    cycle_lengths = dict(zip(tags.tolist(), cycle_bytes.tolist()))
+
+    # Follow the cycles from offset
+    offsets = []
+    while offset < num_bytes:
+        num_cycle_bytes = cycle_lengths.get(offset)
+        if num_cycle_bytes is None:
+            tag = raw[offset]
+            if tag == DBD_CYCLE_TAG:
+                logger.warning('Incomplete final cycle')
+            elif tag != DBD_END_TAG:
+                logger.warning('Invalid cycle tag {:d} at byte {:d}'.format(int(tag), offset))
+            break
+        if offset + num_cycle_bytes > num_bytes:
+            logger.warning('Incomplete final cycle')
+            break
+        offsets.append(offset)
+        offset += num_cycle_bytes
+
+    return np.array(offsets, dtype='i8')
+
+def decode_dbd_cycles(raw, offsets, sensor_bytes, state_bytes_per_cycle, columns, byte_order):
+    """Decode the values of the sensor columns from the data cycles at offsets
+    in the raw uint8 array.  Returns a dictionary mapping each column to its
+    float64 values, with unchanged values filled from the previous new value,
+    and NaN where the sensor was not updated.
+    """
+
+    num_cycles = offsets.shape[0]
+    header_bytes = 1 + state_bytes_per_cycle
+    value_bytes = dbd_value_bytes(sensor_bytes, state_bytes_per_cycle)
+    state_inds = np.arange(state_bytes_per_cycle)
+
+    # Number of new value bytes preceding each column's value within the 
+    # values following its state byte, for each of the 256 possible state byte 
+    # values
+    preceding_bytes = {}
+    for c in columns:
+        j, k = divmod(c, 4)
+        preceding_bytes[c] = np.dot(DBD_BYTE_STATES[:,:k] == 2, np.asarray(sensor_bytes[j*4:j*4+k], dtype='i4')).astype('i4')
+
+    values = {c : np.full(num_cycles, np.nan) for c in columns}
+    states = {c : np.zeros(num_cycles, dtype='i1') for c in columns}
+
+    # Cycles are decoded in chunks of DBD_CHUNK_STATE_BYTES state bytes
+    chunk_size = max(1, DBD_CHUNK_STATE_BYTES // state_bytes_per_cycle)
+    for r0 in range(0, num_cycles, chunk_size):
+
+        chunk = offsets[r0:r0+chunk_size]
+        state_bytes = raw[chunk[:,None] + 1 + state_inds]
+
+        # Number of new value bytes preceding the values of each state byte
+        cycle_value_bytes = value_bytes[state_inds, state_bytes]
+        state_offsets = np.cumsum(cycle_value_bytes, axis=1, dtype='i4') - cycle_value_bytes
+        del cycle_value_bytes
+
+        for c in columns:
+            j, k = divmod(c, 4)
+            column_state_bytes = state_bytes[:,j]
+            chunk_states = DBD_BYTE_STATES[column_state_bytes,k]
+            states[c][r0:r0+chunk.shape[0]] = chunk_states
+            rows = np.flatnonzero(chunk_states == 2)
+            if not rows.shape[0]:
+                continue
+            num_value_bytes = sensor_bytes[c]
+            value_offsets = chunk[rows] + header_bytes + state_offsets[rows,j] + preceding_bytes[c][column_state_bytes[rows]]
+            column_bytes = raw[value_offsets[:,None] + np.arange(num_value_bytes)]
+            value_type = '{:s}{:s}'.format(byte_order, DBD_VALUE_TYPES[num_value_bytes])
+            values[c][r0 + rows] = np.ascontiguousarray(column_bytes).view(value_type)[:,0]
+
+    # Fill unchanged values from the most recent new value
+    cycle_inds = np.arange(num_cycles)
+    for c in columns:
+        last_new = np.maximum.accumulate(np.where(states[c] == 2, cycle_inds, -1))
+        repeated = np.logical_and(states[c] == 1, last_new >= 0)
+        values[c][repeated] = values[c][last_new[repeated]]
+
+    return values
+
+def dbd_to_stream(dbd, timesensor=None, sensors=None, cache_dir=None):
+    """Parse a Slocum glider binary data file and return a dictionary
+    containing the file metadata and the data stream, as returned by
+    gutils.readers.dba.dba_to_stream.
+
+    Options:
+        timesensor: master time sensor name.  Taken from the first
+            DBA_TIMESENSORS sensor contained in the file if not specified
+        sensors: list of sensor names to load.  All sensors are loaded if not
+            specified
+        cache_dir: sensor list cache file directory <Default=directory
+            containing dbd>
+    """
+
+    dbd_data = {'meta' : {}, 'stream' : GliderStream()}
+    if not os.path.isfile(dbd):
+        logger.error('File does not exist {:s}'.format(dbd))
+        return
+
+    cache_dir = cache_dir or os.path.dirname(os.path.abspath(dbd))
+
+    with open(dbd, 'rb') as fid:
+        header, file_sensors = read_dbd_header(fid, cache_dir=cache_dir)
+        if file_sensors is None:
+            logger.error('Failed to read sensor list {:s}'.format(dbd))
+            return
+        raw = np.frombuffer(fid.read(), dtype='u1')
+
+    sensor_names = [s['name'] for s in file_sensors]
+
+    # If no timesensor specified, find the first one in DBA_TIMESENSORS
+    if not timesensor:
+        for s in DBA_TIMESENSORS:
+            if s in sensor_names:
+                timesensor = s
+                break
+
+    # Make sure timesensor is in sensor_names
+    if not timesensor:
+        logger.error('No master time sensor name found {:s}'.format(dbd))
+        return
+    elif timesensor not in sensor_names:
+        logger.error('Master time sensor {:s} not found {:s}'.format(timesensor, dbd))
+        return
+
+    byte_order = known_bytes_order(raw, 0)
+    if not byte_order:
+        logger.error('Invalid known bytes cycle {:s}'.format(dbd))
+        return
+
+    sensor_bytes = [s['bytes'] for s in file_sensors]
+    state_bytes_per_cycle = int(header.get('state_bytes_per_cycle', (len(file_sensors) + 3) // 4))
+
+    offsets = find_dbd_cycles(raw, 16, sensor_bytes, state_bytes_per_cycle)
+    if not offsets.shape[0]:
+        logger.warning('No data cycles found {:s}'.format(dbd))
+        return
+
+    # Columns to load
+    if sensors:
+        missing = [s for s in sensors if s not in sensor_names]
+        for s in missing:
+            logger.warning('Sensor {:s} not found {:s}'.format(s, dbd))
+        columns = [c for c in range(len(sensor_names)) if sensor_names[c] in sensors or sensor_names[c] == timesensor]
+    else:
+        columns = list(range(len(sensor_names)))
+
+    values = decode_dbd_cycles(raw, offsets, sensor_bytes, state_bytes_per_cycle, columns, byte_order)
+
+    stream_columns = OrderedDict()
+    for c in columns:
+        stream_columns[sensor_names[c]] = values[c].astype(DBA_SENSOR_DTYPES.get(str(sensor_bytes[c]), 'f8'))
+    stream_columns['timestamp'] = values[sensor_names.index(timesensor)]
+
+    dbd_data['stream'] = GliderStream(stream_columns)
+
+    # Add the file metadata
+    dbd_data['meta']['header'] = header
+    dbd_data['meta']['sensor_names'] = [sensor_names[c] for c in columns]
+    dbd_data['meta']['sensor_units'] = [file_sensors[c]['units'] for c in columns]
+    dbd_data['meta']['sensor_bytes'] = [str(sensor_bytes[c]) for c in columns]
+
+    return dbd_data
+
@@ -3,48 +3,286 @@ import logging
 import requests
 import json
 import os
+import time
+import hashlib
+import tempfile
+from datetime import datetime
+from collections import OrderedDict
 from netCDF4 import Dataset
 
+from gutils.readers.nc import erddap_nc_to_gutils_stream, ERDDAP_VARIABLE_NAMES, ERDDAP_REQUIRED_PARAMETERS
+
 logger = logging.getLogger(os.path.basename(__file__))
 
-def fetch_glider_datasets(erddap_base_url, timeout=30, verify=True):
-    """Fetch the ERDDAP metadata records for all glider datasets at the erddap_base_url
+# Session shared by all requests so that connections to the ERDDAP server are
+# reused
+erddap_session = requests.session()
+
+# Length of the time window, in seconds, of each tabledap request
+ERDDAP_CHUNK_SECONDS = 86400
+
+# OOI glider dataset search
+ERDDAP_GLIDER_SEARCH = 'search/advanced.json?searchFor=MOAS&protocol=tabledap&cdm_data_type=trajectory&institution=ocean_observatories_initiative'
+# Number of dataset records requested per search result page
+ERDDAP_ITEMS_PER_PAGE = 1000
+# Number of seconds a cached dataset catalog is used without revalidation
+ERDDAP_CATALOG_MAX_AGE = 3600
+
+def fetch_glider_datasets(erddap_base_url, timeout=30, verify=True, cache_dir=None, 
+    max_age=ERDDAP_CATALOG_MAX_AGE, items_per_page=ERDDAP_ITEMS_PER_PAGE):
+    """Fetch the ERDDAP metadata records for all glider datasets at the 
+    erddap_base_url.  Search result pages of items_per_page records are 
+    requested until the last page has been fetched.  Returns None if a request
+    fails.
+    
+    If cache_dir is specified, the fetched catalog is written to cache_dir and
+    returned without any request for max_age seconds.  Once expired, each page
+    is revalidated with a conditional request (ETag/Last-Modified) and only 
+    the pages which have changed are downloaded.
     """
     
-    query = 'search/advanced.json?page=1&itemsPerPage=1000&searchFor=MOAS&protocol=tabledap&cdm_data_type=trajectory&institution=ocean_observatories_initiative'
+    search_url = '{:s}/{:s}'.format(erddap_base_url.strip('/'), ERDDAP_GLIDER_SEARCH)
+    
+    cache_file = None
+    cached_pages = []
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, 'erddap-catalog-{:s}.json'.format(hashlib.md5(search_url.encode('utf-8')).hexdigest()))
+        cache = read_catalog_cache(cache_file)
+        if cache and cache.get('items_per_page') == items_per_page:
+            if time.time() - cache['fetched'] < max_age:
+                logger.debug('Using cached dataset catalog {:s}'.format(cache_file))
+                return catalog_datasets(cache['pages'])
+            cached_pages = cache['pages']
+            
+    pages = []
+    while True:
+        
+        url = '{:s}&page={:d}&itemsPerPage={:d}'.format(search_url, len(pages) + 1, items_per_page)
+        
+        # Revalidate the previously fetched page
+        cached_page = cached_pages[len(pages)] if len(pages) < len(cached_pages) else None
+        headers = {}
+        if cached_page and cached_page['etag']:
+            headers['If-None-Match'] = cached_page['etag']
+        if cached_page and cached_page['last_modified']:
+            headers['If-Modified-Since'] = cached_page['last_modified']
+            
+        try:
+            r = erddap_session.get(url, headers=headers, timeout=timeout, verify=verify)
+        except requests.exceptions.RequestException as e:
+            logger.error('Request failed - {:s}'.format(str(e)))
+            return
+            
+        if r.status_code == 304:
+            page = cached_page
+        elif r.status_code == 404:
+            # ERDDAP responds with 404 when there are no more matching datasets
+            break
+        elif not r.ok:
+            logger.warning('Dataset search failed {:s} ({:s})'.format(url, r.reason))
+            return
+        else:
+            try:
+                table = r.json()['table']
+                page = {'etag' : r.headers.get('ETag'),
+                    'last_modified' : r.headers.get('Last-Modified'),
+                    'columnNames' : table['columnNames'],
+                    'rows' : table['rows']}
+            except (ValueError, KeyError) as e:
+                logger.error('Invalid dataset search response {:s} ({:s})'.format(url, str(e)))
+                return
+                
+        pages.append(page)
+        if len(page['rows']) < items_per_page:
+            break
+            
+    if cache_file:
+        write_catalog_cache(cache_file, {'fetched' : time.time(), 
+            'items_per_page' : items_per_page, 
+            'pages' : pages})
+        
+    return catalog_datasets(pages)
+    
+def catalog_datasets(pages):
+    """Return the list of dataset records contained in the dataset search 
+    result pages"""
+    
+    datasets = []
     
-    url = '{:s}/{:s}'.format(erddap_base_url.strip('/'), query.strip())
+    # Create a list of dicts containing each dataset
+    for page in pages:
+        for row in page['rows']:
+            
+            dataset = dict(zip(page['columnNames'], row))
+            if dataset['Dataset ID'] == u'allDatasets':
+                continue
+                
+            datasets.append(dataset)
+            
+    return datasets
+    
+def read_catalog_cache(cache_file):
+    """Return the cached dataset catalog or None if cache_file does not exist 
+    or cannot be read"""
+    
+    if not os.path.isfile(cache_file):
+        return
+        
+    try:
+        with open(cache_file, 'r') as fid:
+            return json.load(fid)
+    except (IOError, OSError, ValueError) as e:
+        logger.warning('Failed to read dataset catalog cache {:s} ({:s})'.format(cache_file, str(e)))
+        
+def write_catalog_cache(cache_file, cache):
+    """Write the dataset catalog cache to cache_file, replacing any existing 
+    cache file only once it has been written"""
     
+    tmp_path = None
     try:
-        r = requests.get(url, timeout=timeout, verify=verify)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.json', prefix='erddap')
+        with os.fdopen(fd, 'w') as fid:
+            json.dump(cache, fid)
+        os.rename(tmp_path, cache_file)
+    except (IOError, OSError) as e:
+        logger.warning('Failed to write dataset catalog cache {:s} ({:s})'.format(cache_file, str(e)))
+        if tmp_path and os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        
+def fetch_erddap_dataset_info(dataset_url, timeout=30, verify=True):
+    """Fetch the variable metadata of the ERDDAP tabledap dataset_url 
+    (ie: https://server/erddap/tabledap/datasetID) from the dataset info page.
+    Returns an ordered dictionary mapping each variable name to a dictionary 
+    of its attribute values, as strings, or None if the request fails.
+    """
+    
+    erddap_url, dataset_id = dataset_url.rstrip('/').split('/tabledap/')
+    url = '{:s}/info/{:s}/index.json'.format(erddap_url, os.path.splitext(dataset_id)[0])
+    
+    try:
+        r = erddap_session.get(url, timeout=timeout, verify=verify)
     except requests.exceptions.RequestException as e:
-        logger.error('Request failed - {:s}'.format(e))
+        logger.error('Request failed - {:s}'.format(str(e)))
         return
         
     if not r.ok:
-        logger.warning('{:s}'.format(r.message))
+        logger.warning('Dataset info request failed {:s} ({:s})'.format(url, r.reason))
         return
         
     try:
-        response = r.json()
-    except ValueError as e:
-        logger.error('{:s}'.format(e))
+        table = r.json()['table']
+        row_type, name, attribute, value = [table['columnNames'].index(c) for c in ['Row Type', 'Variable Name', 'Attribute Name', 'Value']]
+    except (ValueError, KeyError) as e:
+        logger.error('Invalid dataset info {:s} ({:s})'.format(url, str(e)))
         return
         
-    datasets = []
-    
-    col_count = range(len(response['table']['columnNames']))   
-    # Create a list of dicts containing each dataset
-    for row in response['table']['rows']:
-        
-        dataset = {response['table']['columnNames'][x]: row[x] for x in col_count}
-        if dataset['Dataset ID'] == u'allDatasets':
-            continue
+    info = OrderedDict()
+    for row in table['rows']:
+        if row[row_type] == 'variable':
+            info[row[name]] = {}
+        elif row[row_type] == 'attribute' and row[name] in info:
+            info[row[name]][row[attribute]] = row[value]
             
-        datasets.append(dataset)
+    return info
+    
+def erddap_tabledap_query(variables, start_ts=None, end_ts=None):
+    """Return the tabledap query string requesting the ERDDAP variables within
+    the time window [start_ts, end_ts), specified as unix times"""
+    
+    query = [','.join(variables)]
+    if start_ts is not None:
+        query.append('time>={:s}'.format(datetime.utcfromtimestamp(start_ts).strftime('%Y-%m-%dT%H:%M:%SZ')))
+    if end_ts is not None:
+        query.append('time<{:s}'.format(datetime.utcfromtimestamp(end_ts).strftime('%Y-%m-%dT%H:%M:%SZ')))
         
-    return datasets
+    return requests.utils.quote('&'.join(query), safe=',&=:')
     
-def fetch_erddap_stream_data(dataset_url, variables=[], start_ts=None, end_ts=None):
+def fetch_erddap_stream_data(dataset_url, variables=[], start_ts=None, end_ts=None, 
+    chunk_seconds=ERDDAP_CHUNK_SECONDS, timeout=60, verify=True):
+    """Generator fetching the ERDDAP tabledap dataset_url 
+    (ie: https://server/erddap/tabledap/datasetID) as a series of .nc subsets 
+    covering consecutive chunk_seconds time windows between the unix times 
+    start_ts and end_ts.  Yields the dictionary containing the sensor metadata
+    and the data stream of each non-empty subset, as returned by
+    gutils.readers.nc.erddap_nc_to_gutils_stream.  Raises IOError if the 
+    dataset info or a subset cannot be fetched or parsed, so that a partial 
+    fetch is not mistaken for the end of the dataset.
     
-    return
\ No newline at end of file
+    Options:
+        variables: list of variables to request, named as in the m2m files.  
+            Names not contained in the dataset are ignored.  All dataset 
+            variables are requested if not specified.
+        start_ts: start of the first time window <Default=start of the 
+            dataset time actual_range>
+        end_ts: end of the last time window.  The last window is open ended 
+            if not specified.  A single window is requested if start_ts is 
+            not specified and the dataset time actual_range is not available.
+    """
+    
+    dataset_url = os.path.splitext(dataset_url.rstrip('/'))[0]
+    
+    # Request only the variables contained in the dataset
+    info = fetch_erddap_dataset_info(dataset_url, timeout=timeout, verify=verify)
+    if not info:
+        raise IOError('Failed to fetch dataset info {:s}'.format(dataset_url))
+    dataset_variables = list(info.keys())
+    if variables:
+        requested = [ERDDAP_VARIABLE_NAMES.get(v, v) for v in set(variables).union(ERDDAP_REQUIRED_PARAMETERS)]
+        dataset_variables = [v for v in dataset_variables if v in requested]
+        
+    # Time windows covering the dataset time actual_range unless start_ts or 
+    # end_ts are specified.  The last window is open ended if end_ts is not 
+    # specified.
+    time_range = [float(t) for t in info.get('time', {}).get('actual_range', '').split(',') if t.strip()]
+    if start_ts is None and time_range:
+        start_ts = time_range[0]
+    windows = [(start_ts, end_ts)]
+    if start_ts is not None:
+        last_ts = end_ts
+        if last_ts is None:
+            last_ts = time_range[-1] if time_range else time.time()
+        windows = []
+        while start_ts + chunk_seconds < last_ts:
+            windows.append((start_ts, start_ts + chunk_seconds))
+            start_ts += chunk_seconds
+        # The last window extends to end_ts
+        windows.append((start_ts, end_ts))
+        
+    for t0, t1 in windows:
+        
+        url = '{:s}.nc?{:s}'.format(dataset_url, erddap_tabledap_query(dataset_variables, t0, t1))
+        logger.debug('Fetching {:s}'.format(url))
+        
+        try:
+            r = erddap_session.get(url, timeout=timeout, verify=verify, stream=True)
+        except requests.exceptions.RequestException as e:
+            logger.error('Request failed - {:s}'.format(str(e)))
+            raise
+            
+        # ERDDAP responds with 404 if the time window contains no observations
+        if r.status_code == 404:
+            logger.debug('No observations {:s}'.format(url))
+            r.close()
+            continue
+        if not r.ok:
+            r.close()
+            raise IOError('Request failed {:s} ({:s})'.format(url, r.reason))
+            
+        # Write the subset to a temporary file from which it is parsed
+        fd, nc_path = tempfile.mkstemp(suffix='.nc', prefix='erddap')
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                for chunk in r.iter_content(chunk_size=65536):
+                    fid.write(chunk)
+            dataset = erddap_nc_to_gutils_stream(nc_path)
+        except (IOError, OSError, requests.exceptions.RequestException) as e:
+            logger.error('Failed to read response {:s} ({:s})'.format(url, str(e)))
+            raise
+        finally:
+            r.close()
+            os.remove(nc_path)
+            
+        if not dataset:
+            raise IOError('Invalid response {:s}'.format(url))
+            
+        yield dataset
@@ -1,9 +1,14 @@
 
 import logging
 import os
+import re
 import numpy as np
+from datetime import datetime, timedelta
+from dateutil import parser
 from seawater.eos80 import dpth
+from collections import OrderedDict
 from netCDF4 import Dataset, num2date, date2num
+from gutils.readers.stream import GliderStream
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -36,80 +41,428 @@ M2M_REQUIRED_PARAMETERS = [u'sci_water_cond',
     u'lat',
     u'sci_water_temp',
     u'time']
+    
+# Dummy current values added to each m2m stream
+M2M_UV_PARAMETERS = [u'time_uv',
+    u'lat_uv',
+    u'lon_uv',
+    u'm_water_vx',
+    u'm_water_vy']
+    
+# Number of observations read at once by m2m_nc_chunks
+M2M_CHUNK_OBS = 500000
+
+# Number of evenly spaced time values, and of consecutive time values around
+# each binary search result, checked by nc_time_is_sorted
+NC_TIME_SORT_SAMPLES = 1000
+
+# ERDDAP tabledap variables are named as in the m2m files, except for the 
+# following m2m variable names
+ERDDAP_VARIABLE_NAMES = {u'lat' : u'latitude',
+    u'lon' : u'longitude'}
+    
+ERDDAP_REQUIRED_PARAMETERS = [u'time',
+    u'lat',
+    u'lon']
+    
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+# Calendars for which the fast time conversion path may be used
+NC_STANDARD_CALENDARS = ['standard', 'gregorian', 'proleptic_gregorian']
+# Start of the gregorian portion of the mixed julian/gregorian calendar
+GREGORIAN_START = datetime(1582, 10, 15)
+
+NC_TIME_UNIT_SECONDS = {'seconds' : 1.,
+    'second' : 1.,
+    'secs' : 1.,
+    'sec' : 1.,
+    's' : 1.,
+    'minutes' : 60.,
+    'minute' : 60.,
+    'mins' : 60.,
+    'min' : 60.,
+    'hours' : 3600.,
+    'hour' : 3600.,
+    'hrs' : 3600.,
+    'hr' : 3600.,
+    'h' : 3600.,
+    'days' : 86400.,
+    'day' : 86400.,
+    'd' : 86400.}
 
-def m2m_nc_to_gutils_stream(nc_file):
+def m2m_projection(datatypes):
+    """Return the list of m2m NetCDF variables to read for a deployment: the 
+    M2M_REQUIRED_PARAMETERS and the deployment datatypes.json keys"""
+    
+    variables = list(M2M_REQUIRED_PARAMETERS)
+    variables.extend([k for k in datatypes if k not in variables])
+    
+    return variables
+    
+def m2m_nc_to_gutils_stream(nc_file, variables=None, start_time=None, end_time=None):
     """Parse a NetCDF file created via a UFrame m2m asynchronous request and
     return a dictionary containing sensor metadata and the data stream.  The
-    data stream is an array in which each element is a dictionary mapping the 
-    sensor name to the sensor value for each observation contained in the NetCDF
-    file.
+    data stream is a gutils.readers.stream.GliderStream containing one column
+    for each observation variable contained in the NetCDF file.  Iterating over
+    the stream yields a dictionary mapping the sensor name to the sensor value
+    for each observation.
+    
+    Options:
+        variables: list of observation variables to read.  The 
+            M2M_REQUIRED_PARAMETERS are always read and names not contained in 
+            the file are ignored.  All observation variables are read if not
+            specified.  Use m2m_projection to create the list from the 
+            deployment datatypes.
+        start_time: read only observations at or after this unix time
+        end_time: read only observations at or before this unix time
+        
+    If the time variable is sorted, observations within the bounds are 
+    located with a binary search on the time variable so that only those 
+    observations are read from disk.  Otherwise, all observations are read and
+    those outside of the bounds are dropped.
     """
     
-    dataset = {'meta' : {}, 'stream' : []}
+    # Read all observations within the time bounds as a single chunk
+    chunks = m2m_nc_chunks(nc_file, variables=variables, start_time=start_time, end_time=end_time, chunk_size=None)
+    try:
+        return next(chunks, None)
+    finally:
+        chunks.close()
+        
+def m2m_nc_chunks(nc_file, variables=None, start_time=None, end_time=None, chunk_size=M2M_CHUNK_OBS):
+    """Generator parsing a NetCDF file created via a UFrame m2m asynchronous 
+    request in chunks of chunk_size consecutive observations.  Yields a 
+    dictionary containing the sensor metadata and the data stream of each 
+    chunk, as returned by m2m_nc_to_gutils_stream, so that the memory required
+    does not depend on the number of observations in the file.  Yields nothing
+    if the file is invalid or contains no observations within the time bounds.
+    
+    Options:
+        variables, start_time, end_time: see m2m_nc_to_gutils_stream
+        chunk_size: number of observations read at once.  All observations are
+            read as a single chunk if None <Default=M2M_CHUNK_OBS>
+    """
     
     nci = Dataset(nc_file, 'r')
     
-    num_obs = nci.dimensions['obs'].size
+    try:
+        
+        # Get NetCDF variables that have only obs as the dimension
+        obs_vars = [k for k in nci.variables.keys() if len(nci.variables[k].dimensions) == 1 and nci.variables[k].dimensions[0] == 'obs']
+            
+        if not obs_vars:
+            return
+            
+        # Read only the projected variables
+        if variables is not None:
+            projection = set(variables).union(M2M_REQUIRED_PARAMETERS)
+            obs_vars = [k for k in obs_vars if k in projection]
+            
+        # Get the units for each of obs_vars
+        obs_units = []
+        for v in obs_vars:
+            if 'units' not in nci.variables[v].ncattrs():
+                obs_units.append(None)
+                continue
+            obs_units.append(nci.variables[v].getncattr('units'))
+            
+        # Make sure all required parameters are present
+        has_required = True
+        for v in M2M_REQUIRED_PARAMETERS:
+            if v not in obs_vars:
+                logger.warning('Missing required parameter {:s} - {:s}'.format(v, nc_file))
+                has_required = False
+                
+        if not has_required:
+            return
+            
+        # Observations within the time bounds
+        index = slice(0, len(nci.dimensions['obs']))
+        filter_time = False
+        if start_time is not None or end_time is not None:
+            time_index = nc_time_slice(nci.variables['time'], start_time, end_time)
+            if time_index is None:
+                logger.warning('Time variable is not sorted - Reading all observations {:s}'.format(nc_file))
+                filter_time = True
+            elif time_index.stop <= time_index.start:
+                logger.info('No observations within time bounds {:s}'.format(nc_file))
+                return
+            else:
+                index = time_index
+                
+        # Add derived sensors and units
+        sensor_names = obs_vars + [u'timestamp', u'eos80_depth']
+        sensor_units = obs_units + [u'seconds since 1970-01-01 00:00:00Z', u'meters']
+            
+        time_units = nci.variables['time'].units
+        time_calendar = nci.variables['time'].calendar
+        
+        chunk_size = chunk_size or max(1, index.stop - index.start)
+        for chunk_start in range(index.start, index.stop, chunk_size):
+            
+            chunk = slice(chunk_start, min(chunk_start + chunk_size, index.stop))
+            
+            # Read each variable in a single slice
+            stream = GliderStream(OrderedDict((k, nc_variable_to_array(nci.variables[k], chunk)) for k in obs_vars))
+            
+            # Add dummy current values
+            for k in M2M_UV_PARAMETERS:
+                stream.add_column(k, None)
+                
+            # Convert time from native units (seconds since 1900-01-01) to unix time
+            stream.add_column(u'timestamp', nc_time_to_unix(stream['time'], time_units, time_calendar))
+            
+            # Drop the observations outside of the time bounds
+            if filter_time:
+                in_bounds = np.ones(len(stream), dtype=bool)
+                if start_time is not None:
+                    in_bounds &= stream['timestamp'] >= start_time
+                if end_time is not None:
+                    in_bounds &= stream['timestamp'] <= end_time
+                if not in_bounds.any():
+                    continue
+                stream = stream.take(in_bounds)
+                
+            # Calculate depth from pressure and latitude
+            stream.add_column(u'eos80_depth', dpth(stream['sci_water_pressure_dbar'], stream['lat']))
+            
+            yield {'meta' : {'sensor_names' : list(sensor_names), 'sensor_units' : list(sensor_units)},
+                'stream' : stream}
+            
+    finally:
+        nci.close()
+        
+def nc_time_to_unix(values, units, calendar='standard'):
+    """Convert an array of NetCDF time values with the specified units and 
+    calendar to unix time (seconds since 1970-01-01 00:00:00Z).
+    
+    Standard calendar time units (ie: seconds since 1900-01-01) are converted 
+    with a single scale and offset operation.  All other units and calendars
+    are converted using num2date/date2num on the entire array.
+    """
+    
+    values = np.asarray(values, dtype='f8')
     
-    # Get NetCDF variables that have only obs as the dimension
-    obs_vars = [k for k in nci.variables.keys() if len(nci.variables[k].dimensions) == 1 and nci.variables[k].dimensions[0] == 'obs']
+    scale_offset = nc_time_unix_scale_offset(units, calendar)
+    if scale_offset:
+        return values * scale_offset[0] + scale_offset[1]
         
-    if not obs_vars:
+    dts = num2date(values, units=units, calendar=calendar)
+    return np.asarray(date2num(dts, units='seconds since 1970-01-01 00:00:00', calendar='gregorian'), dtype='f8')
+    
+def nc_time_unix_scale_offset(units, calendar='standard'):
+    """Return the (scale, offset) tuple converting NetCDF time values with the
+    specified units and calendar to unix time as values*scale + offset.  Returns
+    None if the units or calendar require calendar aware conversion.
+    """
+    
+    calendar = (calendar or 'standard').lower()
+    if calendar not in NC_STANDARD_CALENDARS:
         return
         
-    # Get the units for each of obs_vars
-    obs_units = []
-    for v in obs_vars:
-        if 'units' not in nci.variables[v].ncattrs():
-            obs_units.append(None)
-            continue
-        obs_units.append(nci.variables[v].getncattr('units'))
-        
-    # Make sure all required parameters are present
-    has_required = True
-    for v in M2M_REQUIRED_PARAMETERS:
-        if v not in obs_vars:
-            logger.warning('Missing required parameter {:s} - {:s}'.format(v, nc_file))
-            has_required = False
-            
-    if not has_required:
+    match = re.match(r'^\s*(\w+)\s+since\s+(.+?)\s*$', units or '')
+    if not match:
         return
         
-    for r in range(num_obs):
+    unit = match.group(1).lower()
+    if unit not in NC_TIME_UNIT_SECONDS:
+        return
         
-        # Create the dict
-        row = {k:np.asscalar(nci.variables[k][r]) for k in obs_vars}
-        # Add dummy current values
-        row['time_uv'] = None
-        row['lat_uv'] = None
-        row['lon_uv'] = None
-        row['m_water_vx'] = None
-        row['m_water_vy'] = None
-        
-        # Convert time from native units (seconds since 1900-01-01) to unix time
-        dt = num2date(row['time'], units=nci.variables['time'].units, calendar=nci.variables['time'].calendar)
-        row[u'timestamp'] = date2num(dt, units='seconds since 1970-01-01 00:00:00', calendar='gregorian')
-        #row['lat'] = np.asscalar(row['lat'])
-        #row['lon'] = np.asscalar(row['lon'])
-        # Calculate depth from pressure and latitude
-        row[u'eos80_depth'] = dpth(row['sci_water_pressure_dbar'], row['lat'])
+    try:
+        ref_dt = parser.parse(match.group(2))
+    except (ValueError, OverflowError):
+        return
         
-        dataset['stream'].append(row)
+    # Express timezone aware reference times in UTC
+    if ref_dt.utcoffset() is not None:
+        ref_dt = ref_dt.replace(tzinfo=None) - ref_dt.utcoffset()
         
-    # Add derived sensors
-    obs_vars.append(u'timestamp')
-    obs_vars.append(u'eos80_depth')
-    # Add derived sensor units
-    obs_units.append(u'seconds since 1970-01-01 00:00:00Z')
-    obs_units.append(u'meters')
+    # Reference times prior to the julian/gregorian switch require calendar
+    # aware conversion for the mixed calendars
+    if calendar != 'proleptic_gregorian' and ref_dt < GREGORIAN_START:
+        return
+        
+    delta = ref_dt - UNIX_EPOCH
+    offset = delta.days * 86400. + delta.seconds + delta.microseconds / 1e6
+        
+    return NC_TIME_UNIT_SECONDS[unit], offset
     
-    dataset['meta']['sensor_names'] = obs_vars
-    dataset['meta']['sensor_units'] = obs_units
+def unix_to_nc_time(value, units, calendar='standard'):
+    """Convert the unix time value to a NetCDF time value with the specified
+    units and calendar"""
+    
+    scale_offset = nc_time_unix_scale_offset(units, calendar)
+    if scale_offset:
+        return (value - scale_offset[1]) / scale_offset[0]
         
-    return dataset
+    return date2num(UNIX_EPOCH + timedelta(seconds=value), units=units, calendar=calendar)
+    
+def nc_time_bisect(nc_var, value, side='left'):
+    """Return the index at which value would be inserted into the sorted 
+    one-dimensional NetCDF variable nc_var, as with numpy.searchsorted.  Only 
+    O(log n) values are read from disk.
+    """
+    
+    lo = 0
+    hi = nc_var.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        v = float(np.ma.filled(nc_var[mid], np.nan))
+        if v < value or (side == 'right' and v == value):
+            lo = mid + 1
+        else:
+            hi = mid
+            
+    return lo
+    
+def nc_time_is_sorted(time_var, rows=()):
+    """Return True if the one-dimensional NetCDF time variable time_var 
+    appears to be sorted in ascending order and contains no missing values.  
+    Only NC_TIME_SORT_SAMPLES evenly spaced values, the last value and the
+    NC_TIME_SORT_SAMPLES values surrounding each of rows are read, so an 
+    unsorted variable is not always detected.
+    """
+    
+    num_values = time_var.shape[0]
+    if num_values < 2:
+        return True
+        
+    step = max(1, num_values // NC_TIME_SORT_SAMPLES)
+    samples = [np.concatenate((np.ma.filled(np.ma.asarray(time_var[::step], dtype='f8'), np.nan), 
+        np.ma.filled(np.ma.asarray(time_var[-1:], dtype='f8'), np.nan)))]
+    for row in rows:
+        window = slice(max(0, row - NC_TIME_SORT_SAMPLES // 2), min(num_values, row + NC_TIME_SORT_SAMPLES // 2))
+        samples.append(np.ma.filled(np.ma.asarray(time_var[window], dtype='f8'), np.nan))
+        
+    for values in samples:
+        if np.isnan(values).any() or np.any(values[1:] < values[:-1]):
+            return False
+            
+    return True
+    
+def nc_time_slice(time_var, start_time=None, end_time=None):
+    """Return the slice of the sorted NetCDF time variable time_var containing
+    the values between the unix times start_time and end_time, inclusive.  
+    Unspecified bounds are unbounded.  Returns None if time_var is not sorted,
+    as checked by nc_time_is_sorted, in which case the values within the 
+    bounds are not contiguous.
+    """
+    
+    units = time_var.units
+    calendar = getattr(time_var, 'calendar', 'standard')
+    
+    start = 0
+    if start_time is not None:
+        start = nc_time_bisect(time_var, unix_to_nc_time(start_time, units, calendar), side='left')
+        
+    stop = time_var.shape[0]
+    if end_time is not None:
+        stop = nc_time_bisect(time_var, unix_to_nc_time(end_time, units, calendar), side='right')
+        
+    if not nc_time_is_sorted(time_var, rows=(start, stop)):
+        return
+        
+    return slice(start, max(start, stop))
+    
+def nc_variable_to_array(nc_var, index=None):
+    """Read the NetCDF variable, or the subset specified by index, in a single
+    slice and return a numpy array.  Masked floating point values are replaced
+    with NaN.
+    """
+    
+    if index is None:
+        index = slice(None)
+        
+    data = nc_var[index]
+    if not np.ma.isMaskedArray(data):
+        return np.asarray(data)
+        
+    if data.dtype.kind == 'f':
+        return data.filled(np.nan)
+        
+    return data.filled()
+    
+def erddap_nc_to_gutils_stream(nc_file, variables=None):
+    """Parse a NetCDF file created from an ERDDAP tabledap .nc or .ncCF request
+    and return a dictionary containing sensor metadata and the data stream, as
+    returned by m2m_nc_to_gutils_stream.  The stream contains one column for 
+    each variable with the same single dimension as the time variable.  
+    Variables are named as in the m2m files (ERDDAP_VARIABLE_NAMES), timestamp 
+    contains the unix time and, if sci_water_pressure_dbar is present, 
+    eos80_depth contains the depth calculated from pressure and latitude.
+    
+    Options:
+        variables: list of observation variables to read.  time, lat and lon 
+            are always read and names not contained in the file are ignored.
+            All observation variables are read if not specified.
+    """
     
-def erddap_nc_to_gutils_stream(nc_file):
+    dataset = {'meta' : {}, 'stream' : None}
     
-    dataset = []
+    nci = Dataset(nc_file, 'r')
+    
+    try:
+        
+        if 'time' not in nci.variables:
+            logger.warning('Missing required parameter time - {:s}'.format(nc_file))
+            return
+            
+        # Observation variables have only the time variable dimension: row 
+        # for .nc files and obs for .ncCF files
+        obs_dim = nci.variables['time'].dimensions
+        if len(obs_dim) != 1:
+            logger.warning('Invalid time dimension - {:s}'.format(nc_file))
+            return
+        nc_vars = [k for k in nci.variables.keys() if nci.variables[k].dimensions == obs_dim]
+        
+        # ERDDAP variable name to stream sensor name
+        sensor_names = {v : k for k, v in ERDDAP_VARIABLE_NAMES.items()}
+        obs_vars = [sensor_names.get(v, v) for v in nc_vars]
+        
+        # Make sure all required parameters are present
+        has_required = True
+        for v in ERDDAP_REQUIRED_PARAMETERS:
+            if v not in obs_vars:
+                logger.warning('Missing required parameter {:s} - {:s}'.format(v, nc_file))
+                has_required = False
+                
+        if not has_required:
+            return
+            
+        # Read only the projected variables
+        if variables is not None:
+            projection = set(variables).union(ERDDAP_REQUIRED_PARAMETERS)
+            nc_vars = [v for v, k in zip(nc_vars, obs_vars) if k in projection]
+            obs_vars = [k for k in obs_vars if k in projection]
+            
+        # Get the units for each of obs_vars
+        obs_units = [getattr(nci.variables[v], 'units', None) for v in nc_vars]
+        
+        # Read each variable in a single slice
+        stream = GliderStream(OrderedDict((k, nc_variable_to_array(nci.variables[v])) for k, v in zip(obs_vars, nc_vars)))
+        
+        # Add dummy current values
+        for k in M2M_UV_PARAMETERS:
+            if k not in stream.sensor_names:
+                stream.add_column(k, None)
+                
+        # Convert time from native units to unix time
+        time_var = nci.variables['time']
+        stream.add_column(u'timestamp', nc_time_to_unix(stream['time'], time_var.units, getattr(time_var, 'calendar', 'standard')))
+        obs_vars.append(u'timestamp')
+        obs_units.append(u'seconds since 1970-01-01 00:00:00Z')
+        
+        # Calculate depth from pressure and latitude
+        if 'sci_water_pressure_dbar' in stream.sensor_names:
+            stream.add_column(u'eos80_depth', dpth(stream['sci_water_pressure_dbar'], stream['lat']))
+            obs_vars.append(u'eos80_depth')
+            obs_units.append(u'meters')
+            
+    finally:
+        nci.close()
+        
+    dataset['stream'] = stream
+    dataset['meta']['sensor_names'] = obs_vars
+    dataset['meta']['sensor_units'] = obs_units
     
     return dataset
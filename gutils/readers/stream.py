@@ -0,0 +1,136 @@
+"""Columnar glider data stream.
+
+A GliderStream stores each sensor as a single numpy array rather than one
+dictionary per observation.  Rows can still be accessed as dictionaries
+mapping the sensor name to the sensor value, so code written against the
+original list of dicts stream continues to work.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class GliderStream(object):
+    """Columnar glider data stream backed by numpy arrays
+
+    Indexing:
+        stream['sensor_name']: the numpy array of values for sensor_name
+        stream[i]: dictionary mapping sensor name to value for row i
+        stream[i:j]: GliderStream containing rows i through j-1
+
+    Iterating over the stream yields one dictionary per row.
+    """
+
+    def __init__(self, columns=None):
+        """Initialize the stream from a dictionary mapping sensor names to
+        equal length arrays of values.  Column order is preserved if columns
+        is an OrderedDict.
+        """
+
+        self._columns = OrderedDict()
+        self._length = None
+
+        if columns:
+            for name, values in columns.items():
+                self.add_column(name, values)
+
+    def __len__(self):
+        return self._length or 0
+
+    def __iter__(self):
+        return self.rows()
+
+    def __getitem__(self, key):
+
+        if isinstance(key, string_types):
+            return self._columns[key]
+
+        if isinstance(key, (int, np.integer)):
+            return self.row(key)
+
+        if isinstance(key, slice):
+            return GliderStream(OrderedDict((k, v[key]) for k, v in self._columns.items()))
+
+        return self.take(key)
+
+    def __repr__(self):
+        return '<GliderStream: {:d} rows, {:d} sensors>'.format(len(self), len(self._columns))
+
+    @classmethod
+    def concatenate(cls, streams):
+        """Return a new GliderStream containing the rows of each GliderStream in
+        streams, in order.  Sensors missing from a stream are filled with NaN.
+        """
+
+        names = []
+        for stream in streams:
+            names.extend([n for n in stream.sensor_names if n not in names])
+
+        columns = OrderedDict()
+        for name in names:
+            columns[name] = np.concatenate([s[name] if s.has_sensor(name) else np.full(len(s), np.nan) for s in streams])
+
+        return cls(columns)
+
+    @property
+    def sensor_names(self):
+        return list(self._columns.keys())
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def keys(self):
+        return self.sensor_names
+
+    def has_sensor(self, name):
+        return name in self._columns
+
+    def add_column(self, name, values):
+        """Add or replace the sensor column name.  A scalar value (including
+        None, which is stored as NaN) is broadcast to the length of the stream.
+        """
+
+        if values is None:
+            values = np.nan
+
+        values = np.asarray(values)
+        if values.ndim == 0:
+            if self._length is None:
+                raise ValueError('Cannot broadcast scalar {:s} into an empty stream'.format(name))
+            values = np.full(self._length, values)
+        elif values.ndim != 1:
+            raise ValueError('Sensor {:s} must be a one-dimensional array'.format(name))
+
+        if self._length is None:
+            self._length = values.shape[0]
+        elif values.shape[0] != self._length:
+            raise ValueError('Sensor {:s} length {:d} does not match stream length {:d}'.format(
+                name, values.shape[0], self._length))
+
+        self._columns[name] = values
+
+    def row(self, index):
+        """Return a dictionary mapping sensor name to value for the row at index"""
+
+        return {k: v[index].item() for k, v in self._columns.items()}
+
+    def rows(self):
+        """Generator yielding a dictionary for each row in the stream"""
+
+        names = self.sensor_names
+        values = [self._columns[k].tolist() for k in names]
+        for r in zip(*values):
+            yield dict(zip(names, r))
+
+    def take(self, indices):
+        """Return a new GliderStream containing the rows specified by indices,
+        which may be an integer index array or a boolean mask.
+        """
+
+        return GliderStream(OrderedDict((k, v[indices]) for k, v in self._columns.items()))
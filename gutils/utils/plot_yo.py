@@ -4,8 +4,9 @@ import argparse
 import os
 import sys
 import numpy as np
-from gutils.readers.nc import m2m_nc_to_gutils_stream
+from gutils.readers.nc import m2m_nc_to_gutils_stream, erddap_nc_to_gutils_stream
 from gutils.readers.dba import dba_to_stream
+from gutils.readers.dbd import dbd_to_stream
 from gutils.readers import stream_to_yo
 from gutils.yo import find_yo_extrema
 from gutils.yo.filters import default_profiles_filter
@@ -27,11 +28,20 @@ def main(args):
         if not args.depth:
             args.depth = 'sci_water_pressure'
         dataset = dba_to_stream(args.filename, timesensor=args.time)
+    elif args.filetype == 'dbd':
+        if not args.depth:
+            args.depth = 'sci_water_pressure'
+        dataset = dbd_to_stream(args.filename, timesensor=args.time)
     elif args.filetype == 'm2m':
         args.time = args.time or None
         if not args.depth:
             args.depth = 'sci_water_pressure_dbar'
         dataset = m2m_nc_to_gutils_stream(args.filename)
+    elif args.filetype == 'erddap':
+        args.time = args.time or None
+        if not args.depth:
+            args.depth = 'sci_water_pressure_dbar'
+        dataset = erddap_nc_to_gutils_stream(args.filename)
         
     # Create the depth timeseries to index profiles
     yo = stream_to_yo(dataset['stream'], args.depth, timesensor=args.time)
@@ -56,7 +66,7 @@ if __name__ == '__main__':
     arg_parser.add_argument(
         '-f', '--filetype',
         help='Type of source filename <Default=dba>',
-        choices=['dba', 'm2m', 'erddap'],
+        choices=['dba', 'dbd', 'm2m', 'erddap'],
         default='dba'
     )
     
@@ -7,7 +7,7 @@ import os
 from gutils import (
     validate_glider_args,
     clean_dataset,
-    boxcar_smooth_dataset
+    smooth_dataset
 )
 
 # For Readability
@@ -45,12 +45,132 @@ def create_profile_entry(dataset, start, end):
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-def find_yo_extrema(timestamps, depth, tsint=10):
+class ProfileIndex(object):
+    """Compact index of the profiles in a glider time series.  Each profile is
+    stored as the contiguous block of rows start:stop of the time series, which
+    must be sorted by time, along with its start/stop timestamps, depth range 
+    and direction.
+    
+    Attributes (one array element per profile):
+        start: first row of the profile
+        stop: last row + 1 of the profile
+        t0: profile start timestamp
+        t1: profile stop timestamp
+        min_depth: minimum depth
+        max_depth: maximum depth
+        direction: 1 for a downcast, -1 for an upcast, 0 if unknown
+        
+    Iterating over or indexing the ProfileIndex with an integer yields the 
+    [t0, t1] profile times, as with the Nx2 array returned by find_yo_extrema.
+    """
+    
+    def __init__(self, start, stop, t0, t1, min_depth, max_depth, direction):
+        
+        self.start = np.asarray(start, dtype='i8')
+        self.stop = np.asarray(stop, dtype='i8')
+        self.t0 = np.asarray(t0, dtype='f8')
+        self.t1 = np.asarray(t1, dtype='f8')
+        self.min_depth = np.asarray(min_depth, dtype='f8')
+        self.max_depth = np.asarray(max_depth, dtype='f8')
+        self.direction = np.asarray(direction, dtype='i1')
+        
+    def __len__(self):
+        return self.start.shape[0]
+        
+    def __iter__(self):
+        return iter(self.times)
+        
+    def __getitem__(self, key):
+        
+        if isinstance(key, (int, np.integer)):
+            return self.times[key]
+            
+        return self.select(key)
+        
+    def __repr__(self):
+        return '<ProfileIndex: {:d} profiles>'.format(len(self))
+        
+    @property
+    def times(self):
+        """Nx2 array of profile start/stop times"""
+        return np.column_stack((self.t0, self.t1))
+        
+    @property
+    def shape(self):
+        return (len(self), 2)
+        
+    def slices(self):
+        """Generator yielding the slice of rows of each profile"""
+        
+        for start, stop in zip(self.start.tolist(), self.stop.tolist()):
+            yield slice(start, stop)
+            
+    def select(self, indices):
+        """Return a new ProfileIndex containing the profiles specified by 
+        indices, which may be a slice, an integer index array or a boolean mask.
+        """
+        
+        return ProfileIndex(self.start[indices],
+            self.stop[indices],
+            self.t0[indices],
+            self.t1[indices],
+            self.min_depth[indices],
+            self.max_depth[indices],
+            self.direction[indices])
+            
+    @classmethod
+    def from_times(cls, timestamps, depth, profile_times):
+        """Create the ProfileIndex from the Nx2 array of profile start/stop times
+        indexed from the timestamps and depth time series.  The rows of each 
+        profile are those with timestamps between the profile start and stop 
+        times, inclusive.
+        
+        Raises ValueError if timestamps is not sorted in ascending order.
+        """
+        
+        timestamps = np.asarray(timestamps, dtype='f8')
+        depth = np.asarray(depth, dtype='f8')
+        profile_times = np.asarray(profile_times, dtype='f8').reshape((-1, 2))
+        
+        if np.any(timestamps[1:] < timestamps[:-1]) or np.isnan(timestamps).any():
+            raise ValueError('Profile index timestamps must be sorted and finite')
+        
+        start = np.searchsorted(timestamps, profile_times[:,0], side='left')
+        stop = np.maximum(np.searchsorted(timestamps, profile_times[:,1], side='right'), start)
+        
+        min_i, max_i, valid = find_segment_extrema(depth, start, stop)
+        
+        min_depth = np.full(start.shape, np.nan)
+        max_depth = np.full(start.shape, np.nan)
+        min_depth[valid] = depth[min_i[valid]]
+        max_depth[valid] = depth[max_i[valid]]
+        
+        # Depth increases through a downcast
+        direction = np.zeros(start.shape, dtype='i1')
+        direction[np.logical_and(valid, min_i < max_i)] = 1
+        direction[np.logical_and(valid, min_i > max_i)] = -1
+        
+        return cls(start, stop, profile_times[:,0], profile_times[:,1], min_depth, max_depth, direction)
+        
+        
+def find_yo_extrema(timestamps, depth, tsint=10, return_index=False, maxgap=3600, auto_tsint=False, 
+    smoothing='boxcar'):
     """Returns the start and stop timestamps for every profile indexed from the 
     depth timeseries
 
     Parameters:
         time, depth
+        
+    Options:
+        return_index: return a ProfileIndex instead of the array of start and 
+            stop timestamps.  timestamps must be sorted in ascending order.
+        maxgap: the time series is split at time gaps between valid depths 
+            larger than maxgap seconds and each segment is indexed separately
+            <Default=3600>
+        auto_tsint: interpolate each segment at its median sampling interval,
+            if larger than tsint
+        smoothing: name of the gutils.smooth_dataset kernel used to smooth the
+            interpolated depths <Default=boxcar>
 
     Returns:
         A Nx2 array of the start and stop timestamps indexed from the yo
@@ -60,6 +180,9 @@ def find_yo_extrema(timestamps, depth, tsint=10):
 
     validate_glider_args(timestamps, depth)
 
+    timestamps = np.asarray(timestamps, dtype='f8')
+    depth = np.asarray(depth, dtype='f8')
+
     est_data = np.column_stack((
         timestamps,
         depth
@@ -69,10 +192,71 @@ def find_yo_extrema(timestamps, depth, tsint=10):
     est_data[est_data[:, DATA_DIM] <= 0] = float('nan')
 
     est_data = clean_dataset(est_data)
+    est_data = est_data[np.argsort(est_data[:, TIME_DIM], kind='mergesort')]
+    
+    # Interpolate only the data-bearing segments between time gaps so that 
+    # gaps are not filled with interpolated depths
+    gap_rows = np.flatnonzero(np.diff(est_data[:, TIME_DIM]) > maxgap) + 1
+    if gap_rows.shape[0]:
+        logger.debug('Splitting yo at {:d} time gaps'.format(gap_rows.shape[0]))
+    
+    windows = [np.empty((0,2))]
+    for segment in np.split(est_data, gap_rows):
+        
+        segment_tsint = tsint
+        if auto_tsint and segment.shape[0] > 1:
+            segment_tsint = max(tsint, np.median(np.diff(segment[:, TIME_DIM])))
+            
+        windows.append(find_yo_segment_windows(segment, segment_tsint, smoothing=smoothing))
+        
+    windows = np.concatenate(windows)
+    
+    # Sort the original records by time so that the records in each segment
+    # window are a contiguous block of rows
+    order = np.argsort(timestamps, kind='mergesort')
+    sorted_ts = timestamps[order]
+    sorted_z = depth[order]
+    
+    # First and last + 1 rows of the records that fall between the interpolated 
+    # segment start and end timestamps
+    starts = np.searchsorted(sorted_ts, windows[:, 0], side='left')
+    stops = np.searchsorted(sorted_ts, windows[:, 1], side='right')
+    
+    # Find the rows corresponding to the minimum and maximum depth of each 
+    # segment
+    min_i, max_i, valid = find_segment_extrema(sorted_z, starts, stops)
+    if not valid.all():
+        logger.warning('{:d} segments contain no valid depths'.format(np.count_nonzero(~valid)))
+    
+    # Create Nx2 numpy array of profile start/stop times - kerfoot method
+    profile_times = np.column_stack((
+        sorted_ts[np.minimum(min_i, max_i)[valid]],
+        sorted_ts[np.maximum(min_i, max_i)[valid]]
+    ))
+    
+    if return_index:
+        return ProfileIndex.from_times(timestamps, depth, profile_times)
 
+    return profile_times
+
+
+def find_yo_segment_windows(est_data, tsint, smoothing='boxcar'):
+    """Returns an Nx2 array of the time windows containing each dive and climb
+    of the time-sorted, NaN-free Nx2 est_data time/depth array.  The depths are 
+    interpolated onto a fixed tsint-spaced grid and smoothed over tsint/2 grid
+    points with the smoothing kernel to locate the inflections, and each window
+    is widened by 2 * tsint.
+    """
+    
+    if est_data.shape[0] < 2:
+        return np.empty((0,2))
+        
     # Create the fixed timestamp array from the min timestamp to the max timestamp
     # spaced by tsint intervals
-    ts = np.arange(est_data[:,0].min(), est_data[:,0].max(), tsint)
+    ts = np.arange(est_data[0, TIME_DIM], est_data[-1, TIME_DIM], tsint)
+    if ts.shape[0] == 0:
+        return np.empty((0,2))
+        
     # Stretch estimated values for interpolation to span entire dataset
     interp_z = np.interp(
         ts,
@@ -82,69 +266,68 @@ def find_yo_extrema(timestamps, depth, tsint=10):
         right=est_data[-1, 1]
     )
 
-    filtered_z = boxcar_smooth_dataset(interp_z, tsint/2)
+    filtered_z = smooth_dataset(interp_z, max(1, int(tsint/2)), kernel=smoothing)
 
     delta_depth = calculate_delta_depth(filtered_z)
 
     #interp_indices = np.argwhere(delta_depth == 0).flatten()
 
-    p_inds = np.empty((0,2))
+    # Start and end row of each yo segment on the interpolated grid
     inflections = np.where(np.diff(delta_depth) != 0)[0]
+    p_inds = np.column_stack((
+        np.concatenate(([0], inflections)),
+        np.concatenate((inflections, [len(ts)-1]))
+    ))
 
-    p_inds = np.append(p_inds, [[0, inflections[0]]], axis=0)
-    for p in range(len(inflections)-1):
-        p_inds = np.append(p_inds,[[inflections[p], inflections[p+1]]], axis=0)
-    p_inds = np.append(p_inds, [[inflections[-1], len(ts)-1]], axis=0)
-
-    #profile_timestamps = np.empty((0,2))
     ts_window = tsint*2
     
-    # Create orig GUTILS return value - lindemuth method
-    # Initialize an nx3 numpy array of nans
-    profiled_dataset = np.full((len(timestamps),3), np.nan)
-    # Replace TIME_DIM column with the original timestamps
-    profiled_dataset[:, TIME_DIM] = timestamps
-    # Replace DATA_DIM column with the original depths
-    profiled_dataset[:, DATA_DIM] = depth
+    return np.column_stack((
+        ts[p_inds[:, 0]] - ts_window,
+        ts[p_inds[:, 1]] + ts_window
+    ))
+
+
+def find_segment_extrema(values, starts, stops):
+    """Returns the rows containing the minimum and maximum non-NaN value in each
+    segment of values.  Segments may overlap.  Ties are resolved to the first 
+    row, as with np.nanargmin/np.nanargmax.
+
+    Parameters:
+        values: array of values
+        starts: array containing the first row of each segment
+        stops: array containing the last row + 1 of each segment
+        
+    Returns:
+        min_rows, max_rows, valid: the minimum value rows, maximum value rows and
+        a boolean array which is False for segments containing no non-NaN values
+        and for which min_rows and max_rows are meaningless
+    """
+
+    num_values = len(values)
+    starts = np.asarray(starts, dtype='i8')
+    stops = np.asarray(stops, dtype='i8')
+    
+    # Number of non-NaN values in each segment
+    counts = np.concatenate(([0], np.cumsum(~np.isnan(values))))
+    valid = np.logical_and(stops > starts, counts[stops] - counts[starts] > 0)
     
-    # Create Nx2 numpy array of profile start/stop times - kerfoot method
-    profile_times = np.full((p_inds.shape[0], 2), np.nan)
+    # Segment reduceat indices: [start0, stop0, start1, stop1, ...].  Reductions
+    # at even positions are the segments
+    indices = np.column_stack((starts, stops)).ravel()
     
-    # Start profile index
-    profile_ind = 0
-    # Iterate through the profile start/stop indices
-    for p in p_inds:
-        # Profile start row
-        p0 = int(p[0])
-        # Profile end row
-        p1 = int(p[1])
-        # Find all rows in the original yo that fall between the interpolated timestamps
-        profile_i = np.flatnonzero(np.logical_and(profiled_dataset[:, TIME_DIM] >= ts[p0]-ts_window,profiled_dataset[:, TIME_DIM] <= ts[p1]+ts_window))
-        # Slice out the profile
-        pro = profiled_dataset[profile_i]
-        # Find the row index corresponding to the minimum depth
-        try:
-            min_i = np.nanargmin(pro[:,1])
-        except ValueError as e:
-            logger.warning(e)
-            continue
-        # Find the row index corresponding to the maximum depth
-        try:
-            max_i = np.nanargmax(pro[:,1])
-        except ValueError as e:
-            logger.warning(e)
-            continue
-        # Sort the min/max indices in ascending order
-        sorted_i = np.sort([min_i, max_i])
-        # Set the profile index 
-        profiled_dataset[profile_i[sorted_i[0]]:profile_i[sorted_i[1]],2] = profile_ind
-        
-        # kerfoot method
-        profile_times[profile_ind,:] = [timestamps[profile_i[sorted_i[0]]], timestamps[profile_i[sorted_i[1]]]]
-        # Increment the profile index
-        profile_ind += 1
-            
-        #profile_timestamps = np.append(profile_timestamps, [[est_data[profile_i[0][0],0], est_data[profile_i[0][-1],0]]], axis=0)
-
-    #return profiled_dataset
-    return profile_times
+    extrema = []
+    for v in [values, -values]:
+        # The stable sort ranks ties by row and puts NaNs last, so the smallest
+        # rank in a segment is the first row containing its extreme value
+        sorted_rows = np.argsort(v, kind='mergesort')
+        ranks = np.empty(num_values + 1, dtype='i8')
+        ranks[sorted_rows] = np.arange(num_values)
+        ranks[-1] = num_values
+        if num_values:
+            segment_ranks = np.minimum.reduceat(ranks, indices)[::2]
+        else:
+            segment_ranks = np.zeros(len(starts), dtype='i8')
+        segment_ranks[~valid] = 0
+        extrema.append(sorted_rows[segment_ranks] if num_values else segment_ranks)
+        
+    return extrema[0], extrema[1], valid
@@ -8,51 +8,199 @@ import numpy as np
 
 from gutils.yo import (
     TIME_DIM,
-    DATA_DIM
+    DATA_DIM,
+    ProfileIndex,
+    find_segment_extrema
 )
 
-def default_profiles_filter(yo, profile_times):
+def default_profiles_filter(yo, profile_times, breaks=False):
+    """Returns profile start/stop times for which the indexed profile contains
+    at least 3 non-NaN points and spans at least 1 depth unit.  If breaks is 
+    True, profiles are first split at time breaks using filter_profile_breaks.
+    """
     
-    profile_times = filter_profiles_min_points(yo, profile_times)
-    profile_times = filter_profiles_min_depthspan(yo, profile_times)
-    profile_times = filter_profiles_min_depthspan(yo, profile_times)
+    if breaks:
+        profile_times = filter_profile_breaks(yo, profile_times)
     
-    return profile_times
+    return filter_profiles(yo, profile_times, minpoints=3, mindepthspan=1)
     
-def filter_profile_breaks(yo, profile_times):
+def _profile_rows(yo, profile_times):
+    """Returns the non-NaN yo records, sorted by time, and the first and last + 
+    1 rows of each profile in the returned records"""
     
-    filt_p_times = np.empty((0,2))
-
-    for p in profile_times:
+    valid_rows = np.all(~np.isnan(yo), axis=1)
+    
+    if isinstance(profile_times, ProfileIndex):
+        # Map the profile rows to the rows of the yo with the NaN rows 
+        # eliminated
+        pro = yo[valid_rows]
+        valid_count = np.concatenate(([0], np.cumsum(valid_rows)))
+        starts = valid_count[profile_times.start]
+        stops = valid_count[profile_times.stop]
+    else:
+        profile_times = np.asarray(profile_times, dtype='f8').reshape((-1, 2))
+        # Eliminate NaN rows and sort by time so that each profile is a 
+        # contiguous block of rows
+        pro = yo[valid_rows]
+        pro = pro[np.argsort(pro[:,TIME_DIM], kind='mergesort')]
+        # First and last + 1 rows of each profile
+        starts = np.searchsorted(pro[:,TIME_DIM], profile_times[:,0], side='left')
+        stops = np.maximum(np.searchsorted(pro[:,TIME_DIM], profile_times[:,1], side='right'), starts)
+        
+    return pro, starts, stops
+    
+def profile_statistics(yo, profile_times):
+    """Computes the statistics of each indexed profile in a single pass over the
+    yo.  Only the non-NaN yo records are considered.
+    
+    Parameters:
+        yo: Nx2 numpy array containing the timestamp and depth records
+        profile_times: Nx2 numpy array containing the start/stop times of indexed
+            profiles from gutils.yo.find_yo_extrema or the gutils.yo.ProfileIndex
+            indexed from yo
+            
+    Returns:
+        dictionary containing arrays of the number of points (points), depth
+        range (depthspan), time range (timespan) and largest time difference 
+        between consecutive points (maxgap) of each profile.  Statistics which
+        cannot be computed for a profile are NaN.
+    """
     
-        # Create the profile by finding all timestamps in yo that are included in the
-        # window p
-        pro = yo[np.logical_and(yo[:,0] >= p[0], yo[:,0] <= p[1])]
+    pro, starts, stops = _profile_rows(yo, profile_times)
         
-        pro = pro[np.all(~np.isnan(pro),axis=1)]
+    t = pro[:,TIME_DIM]
+    z = pro[:,DATA_DIM]
+    points = stops - starts
+    
+    stats = {'points' : points,
+        'depthspan' : np.full(points.shape, np.nan),
+        'timespan' : np.full(points.shape, np.nan),
+        'maxgap' : np.full(points.shape, np.nan)}
         
-        # Diff the timestamps
-        tdiff = np.diff(pro[:,0])
-        # Median and stdev
-        med = np.median(tdiff)
-        std = np.std(tdiff)
+    has_points = points > 0
+    min_i, max_i, valid = find_segment_extrema(z, starts, stops)
+    stats['depthspan'][has_points] = z[max_i[has_points]] - z[min_i[has_points]]
+    stats['timespan'][has_points] = t[stops[has_points]-1] - t[starts[has_points]]
+    
+    # Largest time difference within each profile: the time differences of a 
+    # profile are rows start through stop - 2
+    has_gaps = points > 1
+    if has_gaps.any():
+        tdiff = np.concatenate((np.diff(t), [np.nan, np.nan]))
+        gap_inds = np.column_stack((starts[has_gaps], stops[has_gaps] - 1)).ravel()
+        stats['maxgap'][has_gaps] = np.maximum.reduceat(tdiff, gap_inds)[::2]
         
-        # Find profile time breaks
-        p_breaks = np.where(tdiff > med+std)
-        if not len(p_breaks):
-            filt_p_times = np.append(filt_p_times, p)
-            continue
+    return stats
+    
+def filter_profiles(yo, profile_times, minpoints=3, mindepthspan=1, mintimespan=None, maxgap=None):
+    """Returns profile start/stop times for which the indexed profile satisfies
+    all of the specified criteria.  The profile statistics are computed once 
+    and all criteria are applied together.  Criteria set to None are not 
+    applied.
+    
+    Parameters:
+        yo: Nx2 numpy array containing the timestamp and depth records
+        profile_times: Nx2 numpy array containing the start/stop times of indexed
+            profiles from gutils.yo.find_yo_extrema
+            
+    Options:
+        minpoints: minimum number of non-NaN points <Default=3>
+        mindepthspan: minimum depth range (meters, decibars, bars) <Default=1>
+        mintimespan: minimum number of seconds spanned <Default=None>
+        maxgap: maximum number of seconds between consecutive points 
+            <Default=None>
             
-        p0 = np.append(np.array(0), p_breaks[0].copy())
-        p1 = np.append(p_breaks[0].copy()+1, pro.shape[0]-1)
-        p_inds = np.column_stack((p0, p1))
+    Returns:
+        Nx2 numpy array containing valid profile start/stop times, or a 
+        gutils.yo.ProfileIndex if profile_times is a ProfileIndex
+    """
+    
+    if not isinstance(profile_times, ProfileIndex):
+        profile_times = np.asarray(profile_times, dtype='f8').reshape((-1, 2))
+    
+    stats = profile_statistics(yo, profile_times)
+    
+    valid = np.ones(len(profile_times), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if minpoints is not None:
+            valid &= stats['points'] >= minpoints
+        if mindepthspan is not None:
+            valid &= stats['depthspan'] >= mindepthspan
+        if mintimespan is not None:
+            valid &= stats['timespan'] >= mintimespan
+        if maxgap is not None:
+            valid &= stats['maxgap'] <= maxgap
+            
+    if isinstance(profile_times, ProfileIndex):
+        return profile_times.select(valid)
         
-        for i in p_inds:
-            t0 = pro[i[0],0]
-            t1 = pro[i[1],0]
-            filt_p_times = np.append(filt_p_times, [[t0, t1]], axis=0)
+    return profile_times[valid]
+    
+def filter_profile_breaks(yo, profile_times):
+    """Splits each indexed profile at time breaks: time differences between 
+    consecutive non-NaN points that exceed the median plus the standard 
+    deviation of all of the profile's time differences.  All profiles are 
+    split in a single vectorized pass over the yo.
+    
+    Parameters:
+        yo: Nx2 numpy array containing the timestamp and depth records
+        profile_times: Nx2 numpy array containing the start/stop times of indexed
+            profiles from gutils.yo.find_yo_extrema or the gutils.yo.ProfileIndex
+            indexed from yo
+            
+    Returns:
+        Nx2 numpy array containing the split profile start/stop times, or a 
+        gutils.yo.ProfileIndex if profile_times is a ProfileIndex
+    """
+    
+    pro, starts, stops = _profile_rows(yo, profile_times)
+    t = pro[:,TIME_DIM]
+    tdiff = np.diff(t)
+    
+    # Rows of tdiff belonging to each profile: start through stop - 2.  
+    # Consecutive profiles may share a record, so rows are repeated as needed
+    num_profiles = starts.shape[0]
+    num_diffs = np.maximum(stops - starts - 1, 0)
+    diff_profile = np.repeat(np.arange(num_profiles), num_diffs)
+    diff_offsets = np.concatenate(([0], np.cumsum(num_diffs)))
+    diff_rows = np.repeat(starts, num_diffs) + np.arange(diff_offsets[-1]) - np.repeat(diff_offsets[:-1], num_diffs)
+    d = tdiff[diff_rows]
+    
+    # Median of each profile's time differences, from the differences sorted
+    # within each profile
+    has_diffs = num_diffs > 0
+    sorted_d = d[np.lexsort((d, diff_profile))]
+    lower = diff_offsets[:-1][has_diffs] + (num_diffs[has_diffs] - 1) // 2
+    upper = diff_offsets[:-1][has_diffs] + num_diffs[has_diffs] // 2
+    med = np.zeros(num_profiles)
+    med[has_diffs] = (sorted_d[lower] + sorted_d[upper]) / 2
+    
+    # Standard deviation of each profile's time differences
+    counts = np.maximum(num_diffs, 1)
+    mean = np.bincount(diff_profile, weights=d, minlength=num_profiles) / counts
+    std = np.sqrt(np.bincount(diff_profile, weights=(d - mean[diff_profile])**2, minlength=num_profiles) / counts)
+    
+    # Profile time breaks start a new profile at the row following the break
+    breaks = d > (med + std)[diff_profile]
+    segment_profile = np.concatenate((np.arange(num_profiles), diff_profile[breaks]))
+    segment_starts = np.concatenate((starts, diff_rows[breaks] + 1))
+    order = np.lexsort((segment_starts, segment_profile))
+    segment_profile = segment_profile[order]
+    segment_starts = segment_starts[order]
+    
+    # Each split profile ends at the start of the next split profile of the 
+    # same profile or at the end of the profile
+    segment_stops = stops[segment_profile]
+    same_profile = segment_profile[1:] == segment_profile[:-1]
+    segment_stops[:-1][same_profile] = segment_starts[1:][same_profile]
+    
+    valid = segment_stops > segment_starts
+    split_times = np.column_stack((t[segment_starts[valid]], t[segment_stops[valid] - 1]))
+    
+    if isinstance(profile_times, ProfileIndex):
+        return ProfileIndex.from_times(yo[:,TIME_DIM], yo[:,DATA_DIM], split_times)
             
-    return filt_p_times
+    return split_times
         
     
 def filter_profiles_min_points(yo, profile_times, minpoints=3):
@@ -72,21 +220,7 @@ def filter_profiles_min_points(yo, profile_times, minpoints=3):
         Nx2 numpy array containing valid profile start/stop times
     """
     
-    new_profile_times = np.full((0,2), np.nan)
-    
-    for p in profile_times:
-        
-        # Create the profile by finding all timestamps in yo that are included in the
-        # window p
-        pro = yo[np.logical_and(yo[:,TIME_DIM] >= p[0], yo[:,TIME_DIM] <= p[1])]
-        
-        # Eliminate NaN rows
-        pro = pro[np.all(~np.isnan(pro),axis=1)]
-        
-        if pro.shape[0] >= minpoints:
-            new_profile_times = np.append(new_profile_times, [p], axis=0)
-            
-    return new_profile_times
+    return filter_profiles(yo, profile_times, minpoints=minpoints, mindepthspan=None)
     
 def filter_profiles_min_depthspan(yo, profile_times, mindepthspan=1):
     """Returns profile start/stop times for which the indexed profile depth range
@@ -105,19 +239,7 @@ def filter_profiles_min_depthspan(yo, profile_times, mindepthspan=1):
         Nx2 numpy array containing valid profile start/stop times
     """
     
-    new_profile_times = np.full((0,2), np.nan)
-    
-    for p in profile_times:
-        
-        pro = yo[np.logical_and(yo[:,TIME_DIM] >= p[0], yo[:,TIME_DIM] <= p[1])]
-        
-        # Eliminate NaN rows
-        pro = pro[np.all(~np.isnan(pro),axis=1)]
-        
-        if np.max(pro[:,DATA_DIM]) - np.min(pro[:,DATA_DIM]) >= mindepthspan:
-            new_profile_times = np.append(new_profile_times, [p], axis=0)
-            
-    return new_profile_times
+    return filter_profiles(yo, profile_times, minpoints=None, mindepthspan=mindepthspan)
             
 def filter_profiles_min_timespan(yo, profile_times, mintimespan=10):
     """Returns profile start/stop times for which the indexed profile spans at 
@@ -136,14 +258,4 @@ def filter_profiles_min_timespan(yo, profile_times, mintimespan=10):
         Nx2 numpy array containing valid profile start/stop times
     """
     
-    new_profile_times = np.full((0,2), np.nan)
-    
-    for p in profile_times:
-        
-        pro = yo[np.logical_and(yo[:,TIME_DIM] >= p[0], yo[:,TIME_DIM] <= p[1])]
-        
-        # Eliminate NaN rows
-        pro = pro[np.all(~np.isnan(pro),axis=1)]
-        
-        if np.max(pro[:,TIME_DIM]) - np.min(pro[:,TIME_DIM]) >= mintimespan:
-            new_profile_times = np.append(new_profile_times, [p], axis=0)
\ No newline at end of file
+    return filter_profiles(yo, profile_times, minpoints=None, mindepthspan=None, mintimespan=mintimespan)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""Incremental profile indexing of a glider depth time series which arrives in
+consecutive pieces, such as a series of telemetered source files.
+"""
+
+import numpy as np
+import logging
+import os
+
+from gutils.yo import (
+    ProfileIndex,
+    find_yo_extrema
+)
+from gutils.yo.filters import default_profiles_filter
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+def empty_profile_index():
+    return ProfileIndex([], [], [], [], [], [], [])
+
+
+class IncrementalYoIndexer(object):
+    """Stateful profile indexer for a time series which is appended to over 
+    time.
+    
+    Each call to append indexes the newly appended samples along with the 
+    trailing partial profile carried over from the previous call, preceded by
+    margin seconds of samples so that the interpolation and smoothing windows 
+    are unchanged at the start of the buffer.  Only complete profiles which 
+    have not previously been returned are returned.  The remaining, possibly
+    incomplete, profiles are returned by flush.
+    
+    Profiles are returned as a gutils.yo.ProfileIndex whose rows are offsets
+    from the first sample ever appended.
+    """
+    
+    def __init__(self, tsint=10, profiles_filter=default_profiles_filter, margin=None, start_time=None):
+        """Parameters:
+            tsint: find_yo_extrema interpolation interval, in seconds
+            profiles_filter: function taking the yo and ProfileIndex and 
+                returning the ProfileIndex of valid profiles
+            margin: number of seconds of samples preceding the partial profile
+                to carry over <Default=10 * tsint>
+            start_time: end time of the last previously indexed profile.
+                Profiles starting before start_time are not returned.  Samples
+                from margin seconds before start_time should be appended so
+                that the next profile is indexed as if all preceding samples 
+                were available.
+        """
+        
+        self.tsint = tsint
+        self.profiles_filter = profiles_filter
+        self.margin = margin if margin is not None else tsint*10
+        
+        # Row of the first buffered sample, counted from the first sample ever
+        # appended
+        self.row_offset = 0
+        self.last_timestamp = None
+        
+        self._timestamps = np.empty(0)
+        self._depth = np.empty(0)
+        # End time of the last complete profile, from which indexing resumes
+        self._resume_t = start_time
+        
+    @property
+    def resume_time(self):
+        """End time of the last complete profile, or the start_time if no 
+        profile has been completed, to pass as the start_time of a new indexer
+        continuing from the buffered samples"""
+        return self._resume_t
+        
+    def __repr__(self):
+        return '<IncrementalYoIndexer: {:d} buffered samples>'.format(self._timestamps.shape[0])
+        
+    def append(self, timestamps, depth):
+        """Append the time-sorted, finite timestamps and depth samples, which 
+        must all be later than the previously appended samples, and return the
+        ProfileIndex of newly completed profiles.
+        """
+        
+        timestamps = np.asarray(timestamps, dtype='f8')
+        depth = np.asarray(depth, dtype='f8')
+        if timestamps.shape[0] == 0:
+            return empty_profile_index()
+            
+        if not np.isfinite(timestamps).all():
+            raise ValueError('Appended timestamps must be finite')
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            raise ValueError('Appended timestamps must be sorted')
+        if self.last_timestamp is not None and timestamps[0] <= self.last_timestamp:
+            raise ValueError('Appended timestamps must be later than the previously appended timestamps')
+            
+        self._timestamps = np.concatenate((self._timestamps, timestamps))
+        self._depth = np.concatenate((self._depth, depth))
+        self.last_timestamp = timestamps[-1]
+        
+        return self._index(final=False)
+        
+    def flush(self):
+        """Return the ProfileIndex of the remaining profiles, including the 
+        final profile, and clear the buffered samples"""
+        
+        profile_index = self._index(final=True)
+        
+        self.row_offset += self._timestamps.shape[0]
+        self._timestamps = np.empty(0)
+        self._depth = np.empty(0)
+        self._resume_t = None
+        
+        return profile_index
+        
+    def _index(self, final):
+        
+        # No profiles can be indexed until at least 2 samples, one of which 
+        # has a valid depth, have been appended
+        if self._timestamps.shape[0] < 2 or not np.isfinite(self._depth).any():
+            return empty_profile_index()
+            
+        profile_index = find_yo_extrema(self._timestamps, self._depth, tsint=self.tsint, return_index=True)
+            
+        if len(profile_index) == 0:
+            return empty_profile_index()
+            
+        # A profile is complete once the samples extend margin seconds past its
+        # end, beyond the reach of the extrema search and smoothing windows
+        if final:
+            complete = np.ones(len(profile_index), dtype=bool)
+        else:
+            complete = profile_index.t1 <= self._timestamps[-1] - self.margin
+            
+        # Skip profiles that were returned by the previous call.  The profile 
+        # boundaries may shift by up to the extrema search window once more 
+        # samples are available.
+        new = complete.copy()
+        if self._resume_t is not None:
+            new &= profile_index.t0 >= self._resume_t - self.tsint*2
+            
+        yo = np.column_stack((self._timestamps, self._depth))
+        new_profiles = self.profiles_filter(yo, profile_index.select(new)) if new.any() else empty_profile_index()
+        new_profiles.start += self.row_offset
+        new_profiles.stop += self.row_offset
+        
+        if not final and new.any():
+            # Resume from the end of the last complete profile, keeping the 
+            # margin preceding it
+            self._resume_t = profile_index.t1[new].max()
+            trim = np.searchsorted(self._timestamps, self._resume_t - self.margin, side='left')
+            self._timestamps = self._timestamps[trim:]
+            self._depth = self._depth[trim:]
+            self.row_offset += trim
+            
+        return new_profiles
@@ -2,16 +2,22 @@
 import numpy as np
 from matplotlib import pyplot as plt
 
+from gutils.yo import ProfileIndex
+
 def plot_yo(yo, profile_times):
     """Plot the glider yo and the indexed profiles"""
     
     plt.plot(yo[:,0], -yo[:,1], 'k.')
     
-    for p in profile_times:
+    if isinstance(profile_times, ProfileIndex):
+        # Profile rows are contiguous
+        profiles = (yo[s] for s in profile_times.slices())
+    else:
+        # Create the profile by finding all timestamps in yo that are included
+        # in the window p
+        profiles = (yo[np.logical_and(yo[:,0] >= p[0], yo[:,0] <= p[1])] for p in profile_times)
     
-        # Create the profile by finding all timestamps in yo that are included in the
-        # window p
-        pro = yo[np.logical_and(yo[:,0] >= p[0], yo[:,0] <= p[1])]
+    for pro in profiles:
         
         pro = pro[np.all(~np.isnan(pro),axis=1)]
 
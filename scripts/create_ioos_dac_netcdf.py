@@ -15,108 +15,253 @@ import shutil
 import argparse
 import tempfile
 import glob
-import sys
+import multiprocessing
+from collections import OrderedDict
 from datetime import datetime
 
 import numpy as np
 
-from gutils.yo import find_yo_extrema
 from gutils.gps import interpolate_gps
-from gutils.yo.filters import default_profiles_filter
+from gutils.yo.incremental import IncrementalYoIndexer
 
-from gutils.nc import open_glider_netcdf, GLIDER_UV_DATATYPE_KEYS
+from gutils.nc import open_glider_netcdf, create_netcdf_skeleton, GLIDER_UV_DATATYPE_KEYS
+from gutils.config import load_deployment_config
 #from gutils.nc import open_glider_netcdf
 
 from gutils.readers.nc import *
-from gutils.readers import stream_to_yo, stream_to_profiles
+from gutils.readers import iter_stream_profiles, merge_streams
+from gutils.readers.stream import GliderStream
+from gutils.readers.erddap import fetch_erddap_stream_data
 from ooidac import build_trajectory_name
 
-REQUIRED_CFG_FILES = ['datatypes.json',
-    'global_attributes.json',
-    'deployment.json',
-    'instruments.json']
-    
 import logging
 logger = logging.getLogger('gutils.nc')
 
 
-def create_reader(nc_file, nc_type):
+# Number of profile NetCDF files written at once
+PROFILE_WRITE_BATCH = 100
+
+# Stream column containing the index of the source of each row, which is not a
+# datatype and is not written to the profile NetCDF files
+SOURCE_SENSOR = u'source_index'
+
+
+def create_reader(nc_file, nc_type, variables=None, start_time=None):
+    """Generator yielding the source NetCDF file datasets in chunks of 
+    consecutive observations"""
     
     if nc_type == 'm2m':
-        dataset = m2m_nc_to_gutils_stream(nc_file)
+        datasets = m2m_nc_chunks(nc_file, variables=variables, start_time=start_time)
     elif nc_type == 'erddap':
-        dataset = erddap_nc_to_gutils_stream(nc_file)
+        dataset = erddap_nc_to_gutils_stream(nc_file, variables=variables)
+        datasets = [dataset] if dataset else []
     else:
         logger.error('Invalid NetCDF source file type {:s}'.format(nc_type))
         return
         
-    if not dataset:
-        logger.warning('No dataset parsed {:s}'.format(nc_file))
-        return
+    num_chunks = 0
+    for dataset in datasets:
+        num_chunks += 1
+        yield dataset
         
-    return dataset
+    if not num_chunks:
+        logger.warning('No dataset parsed {:s}'.format(nc_file))
 
 
-def find_profiles(stream, timesensor='timestamp', depthsensor='sci_water_pressure_dbar'):
-        
-    # Create the yo
-    yo = stream_to_yo(stream, depthsensor, timesensor=timesensor)
-    if yo.shape[0] == 0:
+def read_source_file(args, nc_file, variables=None, start_time=None, source_index=None):
+    """Generator yielding the GliderStream of each chunk of the source NetCDF 
+    file.  If source_index is specified, it is added to each row as the 
+    SOURCE_SENSOR column."""
+    
+    logger.info('Reading {:s}'.format(nc_file))
+    for dataset in create_reader(nc_file, args.nctype, variables=variables, start_time=start_time):
+        if source_index is not None and len(dataset['stream']):
+            dataset['stream'].add_column(SOURCE_SENSOR, source_index)
+        yield dataset['stream']
+    logger.info('{:s} read complete'.format(nc_file))
+
+
+def read_source_streams(args, nc_files, variables=None, start_time=None, source_names=None):
+    """Generator yielding a (source, GliderStream) tuple for each time-ordered
+    chunk of the source data.  The source NetCDF files, which may overlap, are
+    merged into a single stream with duplicate timestamps removed.  If 
+    args.erddap_url is specified, a chunk is yielded for each time window 
+    fetched from the ERDDAP dataset instead.
+    
+    If the source_names list is specified, each source NetCDF file or ERDDAP 
+    URL is appended to it and the SOURCE_SENSOR column of each row contains 
+    the index of its source in source_names.
+    """
+    
+    if args.erddap_url:
+        source_index = None
+        if source_names is not None:
+            source_index = len(source_names)
+            source_names.append(args.erddap_url)
+        logger.info('Fetching {:s}'.format(args.erddap_url))
+        for dataset in fetch_erddap_stream_data(args.erddap_url, variables=variables, start_ts=start_time):
+            if source_index is not None and len(dataset['stream']):
+                dataset['stream'].add_column(SOURCE_SENSOR, source_index)
+            yield args.erddap_url, dataset['stream']
+        logger.info('{:s} fetch complete'.format(args.erddap_url))
         return
         
-    # Index the profiles
-    profile_times = find_yo_extrema(yo[:,0], yo[:,1])
-    # Filter indexed profiles
-    profile_times = default_profiles_filter(yo, profile_times)
-    if profile_times.shape[0] == 0:
-        logger.warning('No valid profiles found {:s}'.format(nc_file))
-        return
+    sources = []
+    for nc_file in sorted(nc_files):
+        source_index = None
+        if source_names is not None:
+            source_index = len(source_names)
+            source_names.append(nc_file)
+        sources.append((nc_file, read_source_file(args, nc_file, variables=variables, start_time=start_time, source_index=source_index)))
+    logger.info('Merging {:d} source NetCDF files'.format(len(sources)))
+    for source, stream in merge_streams(sources, timesensor=args.time):
+        yield source, stream
+
+
+def profile_source(profile_stream, source_names, default=None):
+    """Return the comma separated list of the sources in source_names of the
+    profile_stream rows, in order of appearance, or default if the rows have no
+    SOURCE_SENSOR column"""
+    
+    if not profile_stream.has_sensor(SOURCE_SENSOR):
+        return default
         
-    # Break the dataset['stream'] into arrays of profiles
-    #return stream_to_profiles(yo[:,0], profile_times)
-
-    return profile_times
-
-
-def init_netcdf(file_path, config_path, attrs, profile_id):
-    with open_glider_netcdf(file_path, config_path, mode='w') as glider_nc:
-        # Set global attributes
-        glider_nc.set_global_attributes(attrs['global'])
-
-        # Set Trajectory
-        glider_nc.set_trajectory_id(
-            attrs['deployment']['glider'],
-            attrs['deployment']['trajectory_date']
-        )
+    source_indices = profile_stream[SOURCE_SENSOR]
+    source_indices = source_indices[np.isfinite(source_indices)].astype('i8')
+    if not source_indices.shape[0]:
+        return default
+        
+    unique_indices, first_rows = np.unique(source_indices, return_index=True)
+    
+    return ', '.join([source_names[i] for i in unique_indices[np.argsort(first_rows)]])
+    
+    
+def init_netcdf(glider_nc, attrs, profile_id):
+    """Write the source file history and profile id to the open glider_nc, 
+    which was copied from the deployment NetCDF skeleton created by 
+    gutils.nc.create_netcdf_skeleton
+    """
+    
+    # Set the history global attribute
+    glider_nc.set_global_attributes({'history': attrs['global']['history']})
+    
+    # Append this session to the history
+    glider_nc.update_history()
 
-        # Set Platform
-        glider_nc.set_platform(attrs['deployment']['platform'])
+    # Set Segment ID
+    #glider_nc.set_segment_id(segment_id)
 
-        # Set Instruments
-        glider_nc.set_instruments(attrs['instruments'])
+    # Set Profile ID
+    glider_nc.set_profile_id(profile_id)
+        
 
-        # Set Segment ID
-        #glider_nc.set_segment_id(segment_id)
+def write_profile_netcdf(job):
+    """Create the profile NetCDF file described by job by copying the deployment
+    NetCDF skeleton and writing the profile id and data in a single session.  
+    Runs in a worker process when --workers is greater than 1.
+    
+    Returns a tuple containing the written file path and a dictionary 
+    containing the UV variable values, or None if the profile has no UV values.
+    """
+    
+    tmp_path = job['tmp_path']
+    logger.debug('tmp_path={:s}'.format(tmp_path))
+    
+    # Copy the NetCDF skeleton, write the profile id and data and update the 
+    # bounds in a single session
+    shutil.copyfile(job['skeleton_path'], tmp_path)
+    with open_glider_netcdf(tmp_path, job['config'], mode='a') as glider_nc:
+        
+        # Write the source file history and profile id
+        init_netcdf(glider_nc, job['attrs'], job['profile_id'])
+        
+        # Append the profile rows to the NetCDF file
+        glider_nc.stream_insert(job['profile_stream'])
+        
+        # Read the UV Variables for the ordered backfill pass
+        uv_values = read_uv_variables(glider_nc)
+        
+        # Update the scalar profile variables
+        glider_nc.update_profile_vars()
+        
+        # Update the global title attribute with the glider name and
+        # formatted self.nc.variables['profile_time']:
+        # glider-YYYYmmddTHHMM
+        glider_nc.update_global_title(job['glider_name'])
+        
+        # Global attribute bounds are updated when the file is closed
+        
+    return tmp_path, uv_values
+    
 
-        # Set Profile ID
-        glider_nc.set_profile_id(profile_id)
+def read_uv_variables(glider_nc):
+    """Returns a dictionary mapping the UV datatype keys to the values written to
+    glider_nc or None if no time_uv value has been written
+    """
+    
+    time_uv = glider_nc.get_scalar('time_uv')
+    if time_uv is None or np.ma.is_masked(time_uv):
+        return
         
+    uv_values = {}
+    for key_name in GLIDER_UV_DATATYPE_KEYS:
+        uv_values[key_name] = glider_nc.get_scalar(key_name)
+        
+    return uv_values
+    
 
 def fill_uv_variables(dst_glider_nc, uv_values):
     for key, value in uv_values.items():
+        if np.ma.is_masked(value):
+            value = None
         dst_glider_nc.set_scalar(key, value)
 
 
-def backfill_uv_variables(src_glider_nc, empty_uv_processed_paths):
-    uv_values = {}
-    for key_name in GLIDER_UV_DATATYPE_KEYS:
-        uv_values[key_name] = src_glider_nc.get_scalar(key_name)
-
+def backfill_uv_variables(uv_values, empty_uv_processed_paths, config):
     for file_path in empty_uv_processed_paths:
-        with open_glider_netcdf(file_path, 'a') as dst_glider_nc:
+        with open_glider_netcdf(file_path, config, mode='a') as dst_glider_nc:
             fill_uv_variables(dst_glider_nc, uv_values)
 
     return uv_values
+    
+
+def update_uv_variables(written_profiles, config, uv_values=None, empty_uv_processed_paths=None):
+    """Fill the UV variables of the profile NetCDF files written without UV 
+    values in a single pass, in profile order.  Profiles preceded by a profile
+    containing UV values are filled from the nearest preceding one.  Profiles
+    preceding the first profile containing UV values are back-filled from it.
+    No profile is filled if none contains UV values.
+    
+    Parameters:
+        written_profiles: list of (file path, uv_values) tuples returned by 
+            write_profile_netcdf
+        config: gutils.config.DeploymentConfig
+        
+    Options:
+        uv_values: UV values of the last profile containing UV values preceding
+            written_profiles
+        empty_uv_processed_paths: paths of the files preceding 
+            written_profiles which are waiting to be back-filled
+            
+    Returns a tuple containing the UV values of the last profile containing UV 
+    values and the list of paths still waiting to be back-filled, which are
+    passed to the next call for the following profiles.
+    """
+    
+    empty_uv_processed_paths = list(empty_uv_processed_paths or [])
+    for tmp_path, profile_uv_values in written_profiles:
+        if profile_uv_values is not None:
+            uv_values = backfill_uv_variables(
+                profile_uv_values, empty_uv_processed_paths, config
+            )
+            del empty_uv_processed_paths[:]
+        elif uv_values is not None:
+            with open_glider_netcdf(tmp_path, config, mode='a') as glider_nc:
+                fill_uv_variables(glider_nc, uv_values)
+        else:
+            empty_uv_processed_paths.append(tmp_path)
+            
+    return uv_values, empty_uv_processed_paths
 
 
 def create_arg_parser():
@@ -162,6 +307,15 @@ def create_arg_parser():
         default='m2m'
     )
     
+    parser.add_argument(
+        '-e', '--erddap-url',
+        help='ERDDAP tabledap dataset URL (ie: https://server/erddap/tabledap/datasetID) from which the source data is fetched in place of the source NetCDF files'
+    )
+    
+    parser.add_argument('--flush',
+        help='Write the trailing, possibly incomplete, profile instead of carrying it over to the next run.  Use for the final run of a deployment',
+        action='store_true')
+        
     parser.add_argument(
         '-p', '--profilestart',
         help='Number specifying the starting profile id <Default=1>',
@@ -169,6 +323,13 @@ def create_arg_parser():
         default=1
     )
 
+    parser.add_argument(
+        '-w', '--workers',
+        help='Number of worker processes used to write profile NetCDF files <Default=1>',
+        type=int,
+        default=1
+    )
+
     parser.add_argument(
         '-t', '--time',
         help="Set time parameter to use for profile recognition <Default=timestamp>",
@@ -190,41 +351,6 @@ def create_arg_parser():
     return parser
 
 
-def read_attrs(glider_config_path):
-    # Load in configurations
-    attrs = {}
-
-    def cfg_file(name):
-        return os.path.join(
-            glider_config_path,
-            name
-        )
-
-    # Load institute global attributes
-    global_attrs_path = cfg_file("global_attributes.json")
-    with open(global_attrs_path, 'r') as f:
-        attrs['global'] = json.load(f)
-
-    # Load deployment attributes (including global attributes)
-    deployment_attrs_path = cfg_file("deployment.json")
-    try:
-        with open(deployment_attrs_path, 'r') as f:
-            attrs['deployment'] = json.load(f)
-    except (OSError, ValueError) as e:
-        logger.error('Error in {:s} - {:s}'.format(deployment_attrs_path, e))
-        return
-
-    # Load instruments
-    instruments_attrs_path = cfg_file("instruments.json")
-    with open(instruments_attrs_path, 'r') as f:
-        attrs['instruments'] = json.load(f)
-
-    # Fill in global attributes
-    attrs['global'].update(attrs['deployment']['global_attributes'])
-
-    return attrs
-
-
 def process_ooi_dataset(args):
 
     glider_deployment_path = args.glider_deployment_path
@@ -239,16 +365,10 @@ def process_ooi_dataset(args):
     if not os.path.isdir(cfg_path):
         logger.error('Deployment configuration path does not exist {:s}'.format(cfg_path))
         return 1
-    # Make sure required config file exist
-    cfg_status = True
-    for f in REQUIRED_CFG_FILES:
-        cfg_file = os.path.join(cfg_path, f)
-        if not os.path.isfile(cfg_file):
-            logger.error('Missing required config file {:s}'.format(cfg_file))
-            cfg_status = False
-    if not cfg_status:
+    # Read and validate the deployment configuration files
+    config = load_deployment_config(cfg_path)
+    if not config:
         return 1
-    
         
     # Create path to glider deployment status files
     status_path  = os.path.join(glider_deployment_path, 'status')
@@ -257,19 +377,24 @@ def process_ooi_dataset(args):
         logger.error('Deployment status path does not exist {:s}'.format(status_path))
         return 1
         
-    # Search for source NetCDF files
-    nc_source_dir = os.path.join(glider_deployment_path, 'nc-source')
-    logger.debug('Source NetCDF location {:s}'.format(nc_source_dir))
-    if not os.path.isdir(nc_source_dir):
-        logger.error('Invalid source NetCDF directory {:s}'.format(nc_source_dir))
-        return 1
-    nc_files = glob.glob(os.path.join(nc_source_dir, '*.nc'))
-    if not nc_files:
-        logger.info('No deployment source NetCDF files found {:s}'.format(nc_source_dir))
-        return 1
+    # Search for source NetCDF files unless the source data is fetched from 
+    # ERDDAP
+    nc_files = []
+    if not args.erddap_url:
+        nc_source_dir = os.path.join(glider_deployment_path, 'nc-source')
+        logger.debug('Source NetCDF location {:s}'.format(nc_source_dir))
+        if not os.path.isdir(nc_source_dir):
+            logger.error('Invalid source NetCDF directory {:s}'.format(nc_source_dir))
+            return 1
+        nc_files = glob.glob(os.path.join(nc_source_dir, '*.nc'))
+        if not nc_files:
+            logger.info('No deployment source NetCDF files found {:s}'.format(nc_source_dir))
+            return 1
     
-    # Read deployment configuration files
-    attrs = read_attrs(cfg_path)
+    # Deployment configuration attributes.  Copy the global attributes so that 
+    # the cached configuration is not modified
+    attrs = dict(config.attrs)
+    attrs['global'] = dict(attrs['global'])
 
     glider_name = attrs['deployment']['glider']
     deployment_name = build_trajectory_name(
@@ -281,6 +406,7 @@ def process_ooi_dataset(args):
     profile_status_file = os.path.join(status_path, '{:s}-profiles.json'.format(deployment_name))
     profile_id = 1
     existing_nc = []
+    profile_start_time = None
     if os.path.isfile(profile_status_file):
         try:
             with open(profile_status_file, 'r') as fid:
@@ -295,153 +421,363 @@ def process_ooi_dataset(args):
             profile_id = max([p['profile_id'] for p in profile_status]) + 1
             # Create a list NetCDF files that have previously been created
             existing_nc = {os.path.basename(p['filename']):p['filename'] for p in profile_status}
+            # Indexing resumes from the end time of the last written profile
+            # unless the existing files are clobbered
+            if not args.clobber:
+                profile_start_time = max([p['profile_max_time'] for p in profile_status])
+                
+    # Source observations of the trailing profile carried over from the 
+    # previous run, which are no longer available from the processed source
+    # files
+    pending_status_file = os.path.join(status_path, '{:s}-pending.npz'.format(deployment_name))
+    pending = None
+    pending_sources = None
+    if not args.clobber and os.path.isfile(pending_status_file):
+        pending, profile_start_time, pending_sources = read_pending_stream(pending_status_file)
+        if pending is None:
+            return 1
     
-    # Process each input NetCDF file
-    for nc_file in nc_files:
-        
-        # Create the NC_GLOBAL:history with the name of the source UFrame NetCDF file
-        history = '{:s}: Data Source {:s}'.format(datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), nc_file)
-        attrs['global']['history'] = '{:s}\n'.format(history)
-        
-        try:
-           
-            logger.info('Reading {:s}'.format(nc_file))
-            dataset = create_reader(nc_file, args.nctype)
-            logger.info('{:s} read complete'.format(nc_file))
-            if not dataset:
-                logger.warning('Skipping invalid NetCDF {:s}'.format(nc_file))
+    # Create the deployment NetCDF skeleton from which each profile NetCDF file
+    # is copied
+    skeleton_dir = tempfile.mkdtemp()
+    skeleton_path = os.path.join(skeleton_dir, '{:s}-skeleton.nc'.format(deployment_name))
+    logger.debug('Creating NetCDF skeleton {:s}'.format(skeleton_path))
+    create_netcdf_skeleton(skeleton_path, config)
+    
+    # Pool of worker processes for writing the profile NetCDF files
+    pool = None
+    if args.workers > 1:
+        logger.debug('Writing NetCDF files with {:d} worker processes'.format(args.workers))
+        pool = multiprocessing.Pool(args.workers)
+    
+    try:
+        status = write_deployment_netcdfs(args, config, attrs, nc_files, skeleton_path, 
+            glider_name, deployment_name, profile_id, existing_nc, pool, 
+            start_time=profile_start_time, pending=pending, 
+            pending_sources=pending_sources, pending_path=pending_status_file)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        shutil.rmtree(skeleton_dir)
+
+    return status
+    
+
+def write_deployment_netcdfs(args, config, attrs, nc_files, skeleton_path, glider_name,
+    deployment_name, profile_id, existing_nc, pool=None, start_time=None, 
+    pending=None, pending_sources=None, pending_path=None):
+    """Index the profiles in the time-ordered source NetCDF files and write 
+    each profile NetCDF file.  Profiles which span consecutive source files are
+    written once they are complete.  If start_time, the end time of the last 
+    previously written profile, is specified, only profiles starting after 
+    start_time are written.  
+    
+    pending is the GliderStream of the source observations carried over from
+    the previous run, which are indexed ahead of the source observations 
+    following them, and pending_sources is the list of their source names.  
+    Otherwise, only source observations from the indexer margin preceding 
+    start_time are read.
+    
+    The NC_GLOBAL:history of each profile NetCDF file lists the source(s) of 
+    the profile observations.
+    
+    Unless args.flush is set, the trailing profile is not written and its 
+    source observations are written to pending_path, to be carried over to 
+    the next run.  Returns 1, without writing the remaining profiles or 
+    updating pending_path, if the source data cannot be read.
+    """
+    
+    indexer = IncrementalYoIndexer(start_time=start_time)
+    
+    # Read the observations preceding start_time needed to index the profile
+    # following start_time, or those following the carried over observations
+    if pending is not None and len(pending):
+        start_time = np.nanmax(pending[args.time])
+    elif start_time is not None:
+        start_time -= indexer.margin
+    if start_time is not None:
+        logger.info('Reading source observations after {:s}'.format(datetime.utcfromtimestamp(start_time).strftime('%Y-%m-%dT%H:%M:%SZ')))
+    
+    # Source variables written to the profile NetCDF files or used to index 
+    # the profiles
+    variables = m2m_projection(config.datatypes) + [args.time, args.depth]
+    
+    # Profiles are written in batches as they are completed, so that only the
+    # current batch and the incomplete profile are held in memory
+    # Source of each observation, starting with those of the carried over 
+    # observations
+    source_names = list(pending_sources or [])
+    streams = read_source_streams(args, nc_files, variables=variables, start_time=start_time, 
+        source_names=source_names)
+    profiles = iter_stream_profiles(streams, args.depth, timesensor=args.time, indexer=indexer, 
+        pending=pending, flush=args.flush)
+    
+    batch = []
+    # UV values and files waiting to be back-filled carried over to the next
+    # batch from the same source file(s)
+    uv_state = None
+    try:
+        for source, profile_times, profile_stream in profiles:
+            
+            # Source observations of the trailing profile
+            if profile_times is None:
+                pending = profile_stream
                 continue
                 
-            stream = dataset['stream']
+            # Each batch contains the profiles from the same source file(s)
+            source = profile_source(profile_stream, source_names, default=source)
+            if batch and (source != batch[0][0] or len(batch) >= PROFILE_WRITE_BATCH):
+                profile_id, uv_state = write_profile_netcdfs(args, config, attrs, batch, skeleton_path, 
+                    glider_name, deployment_name, profile_id, existing_nc, pool, 
+                    uv_state=uv_state, final=source != batch[0][0])
+                batch = []
                 
-            # Find profile breaks
-            profile_times = find_profiles(stream, depthsensor=args.depth, timesensor=args.time)
-    
-        except ValueError as e:
-            logger.error('{} - Skipping'.format(e))
-            return 1
+            batch.append((source, profile_times, profile_stream))
             
-        if profile_times.shape[0] == 0:
-            logger.info('No profiles indexed {:s}'.format(nc_file))
-            continue
+        if batch:
+            write_profile_netcdfs(args, config, attrs, batch, skeleton_path, glider_name, 
+                deployment_name, profile_id, existing_nc, pool, uv_state=uv_state)
+            uv_state = None
+        else:
+            logger.info('No profiles indexed')
+            
+    except ValueError as e:
+        logger.error('{} - Skipping'.format(e))
+        return 1
+    except IOError as e:
+        # The source data was only partially read.  The remaining profiles
+        # are not written so that they are indexed again, from the complete
+        # source data, by the next run.
+        logger.error('Source data read failed ({}) - Skipping remaining profiles'.format(e))
+        return 1
+    finally:
+        # Files waiting to be back-filled by a batch which was not written
+        remove_pending_netcdfs(uv_state)
         
-        uv_values = None
-        movepairs = []
-#        uv_values = []
-        empty_uv_processed_paths = []
-    
-        # Tempdirectory
-        tmpdir = tempfile.mkdtemp()
-    
-        # All timestamps from stream
-        ts = [r[args.time] for r in stream]
-        
-        # Create a new NetCDF file for each profile
-        for profile in profile_times:
-
-            # Profile start time
-            p0 = profile[0]
-            # Profile end time
-            p1 = profile[-1]
-            # Find all rows in ts that are between p0 & p1
-            p_inds = np.flatnonzero(np.logical_and(ts >= p0, ts <= p1))
-            profile_stream = stream[p_inds[0]:p_inds[-1]]
-        
-            # Path to hold file while we create it
-            _, tmp_path = tempfile.mkstemp(dir=tmpdir, suffix='.nc', prefix='gutils')
-
-            # Open new NetCDF
-            begin_time = datetime.utcfromtimestamp(np.mean(profile))
-            filename = "%s-%s_%s.nc" % (
-                glider_name,
-                begin_time.strftime("%Y%m%dT%H%M%SZ"),
-                args.mode
-            )
+    if not pending_path:
+        return 0
+        
+    if args.flush:
+        if os.path.isfile(pending_path):
+            logger.info('Removing carried over observations {:s}'.format(pending_path))
+            os.remove(pending_path)
+        return 0
+        
+    logger.info('Carrying over {:d} source observations to the next run'.format(len(pending)))
+    if not write_pending_stream(pending_path, pending, indexer.resume_time, source_names):
+        return 1
             
-            # Skip this write operation if the args.clobber is False and the file has
-            # been previously written
-            if not args.clobber:
-                if filename in existing_nc:
-                    logging.warning('Skipping (Profile NetCDF already exists: {:s}'.format(filename))
-                    continue
-            elif args.clobber:
-                # If arg.clobber is True, try to delete the existing file provided
-                # we can find it
-                if os.path.isfile(existing_nc[filename]):
-                    logging.info('Clobbering existing NetCDF: {:s}'.format(existing_nc[filename]))
-                    try:
-                        os.remove(p[filename])
-                    except OSError as e:
-                        logging.warning('Failed to delete existing file: {:s} ({:s})'.format(existing_nc[filename], e))
-
-            # Full path to the file to be written
-            file_path = os.path.join(
-                args.output_path,
-                deployment_name,
-                filename
-            )
+    return 0
 
-            logger.debug('tmp_path={:s}'.format(tmp_path))
-            #init the NetCDF output file
-            init_netcdf(tmp_path, cfg_path, attrs, profile_id)
-            
-            with open_glider_netcdf(tmp_path, cfg_path, mode='a') as glider_nc:
-                for line in profile_stream:
-                    
-                    #Append the row to the NetCDF file
-                    glider_nc.stream_dict_insert(line)
-    
-                # Handle UV Variables
-                if glider_nc.contains('time_uv'):
-                    uv_values = backfill_uv_variables(
-                        glider_nc, empty_uv_processed_paths
-                    )
-                elif uv_values is not None:
-                    fill_uv_variables(glider_nc, uv_values)
-                    del empty_uv_processed_paths[:]
-                else:
-                    empty_uv_processed_paths.append(tmp_path)
-    
-                # Update the scalar profile variables
-                glider_nc.update_profile_vars()
-                glider_nc.update_bounds()
-                
-                # Update the global title attribute with the glider name and
-                # formatted self.nc.variables['profile_time']:
-                # glider-YYYYmmddTHHMM
-                glider_nc.update_global_title(glider_name)
+
+def read_pending_stream(pending_path):
+    """Read the source observations carried over from the previous run, 
+    written by write_pending_stream.  Returns a tuple containing the 
+    GliderStream, the end time of the last written profile, which is None if
+    no profile has been written, and the list of source names indexed by the
+    SOURCE_SENSOR column, or (None, None, None) if the file cannot be read.
+    """
+    
+    try:
+        with np.load(pending_path, allow_pickle=False) as pending_data:
+            names = pending_data['names'].tolist()
+            stream = GliderStream(OrderedDict((name, pending_data['column{:d}'.format(i)]) for i, name in enumerate(names)))
+            resume_time = float(pending_data['resume_time'])
+            sources = pending_data['sources'].tolist()
+    except (IOError, OSError, KeyError, ValueError) as e:
+        logger.error('Carried over observations read error {:s} ({:s})'.format(pending_path, str(e)))
+        return None, None, None
+        
+    logger.info('Read {:d} carried over source observations {:s}'.format(len(stream), pending_path))
+    
+    return stream, resume_time if np.isfinite(resume_time) else None, sources
+    
     
-            movepairs.append((tmp_path, file_path))
+def write_pending_stream(pending_path, stream, resume_time, source_names):
+    """Write the GliderStream of source observations carried over to the next
+    run, the end time of the last written profile and the source names 
+    indexed by the SOURCE_SENSOR column to pending_path.  The file is replaced 
+    atomically so that a failed write leaves the previous file in place.  
+    Returns True if the file was written.
+    """
+    
+    # Keep only the names of the sources of the carried over observations
+    sources = []
+    if stream.has_sensor(SOURCE_SENSOR) and len(stream):
+        source_indices = stream[SOURCE_SENSOR].astype('i8')
+        unique_indices, source_indices = np.unique(source_indices, return_inverse=True)
+        sources = [source_names[i] for i in unique_indices]
+        stream = stream[:]
+        stream.add_column(SOURCE_SENSOR, source_indices)
+        
+    pending_data = {'column{:d}'.format(i) : stream[name] for i, name in enumerate(stream.sensor_names)}
+    pending_data['names'] = np.array(stream.sensor_names, dtype='U')
+    pending_data['resume_time'] = np.nan if resume_time is None else resume_time
+    pending_data['sources'] = np.array(sources, dtype='U')
+    
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pending_path), suffix='.npz', prefix='gutils')
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            np.savez(fid, **pending_data)
+        os.rename(tmp_path, pending_path)
+    except (IOError, OSError, ValueError) as e:
+        logger.error('Failed to write carried over observations {:s} ({:s})'.format(pending_path, str(e)))
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        return False
+        
+    return True
+
+
+def write_profile_netcdfs(args, config, attrs, profiles, skeleton_path, glider_name, 
+    deployment_name, profile_id, existing_nc, pool=None, uv_state=None, final=True):
+    """Write a NetCDF file for each of the (source, profile_times, 
+    profile_stream) tuples in profiles, all of which are from the same source 
+    NetCDF file(s).  
     
-            profile_id += 1
+    uv_state, returned by the previous call for the same source, contains the 
+    last UV values and the files written without UV values which are waiting
+    to be back-filled.  Unless final is True, files waiting to be back-filled
+    are not moved to the output path but are carried over to the next call 
+    for the same source.
     
-        # Set move_status to False if any NetCDF move fails so that the temporary
-        # directory is not removed.
-        move_status = True
-        for tp, fp in movepairs:
-            dest_dir = os.path.dirname(fp)
-            if not os.path.isdir(dest_dir):
+    Returns a tuple containing the next profile id and the uv_state to pass to
+    the next call for the same source, or None if final is True.
+    """
+    
+    uv_state = uv_state or {'uv_values' : None, 'pending' : []}
+    
+    # Create the NC_GLOBAL:history with the name(s) of the source UFrame NetCDF file(s)
+    history = '{:s}: Data Source {:s}'.format(datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), profiles[0][0])
+    attrs['global']['history'] = '{:s}\n'.format(history)
+    
+    movepairs = []
+    jobs = []
+
+    # Tempdirectory
+    tmpdir = tempfile.mkdtemp()
+
+    # Describe a new NetCDF file for each profile.  Profile ids are assigned
+    # here, in profile order, so that they do not depend on the order in 
+    # which the files are written
+    for source, profile, profile_stream in profiles:
+    
+        # Open new NetCDF
+        begin_time = datetime.utcfromtimestamp(np.mean(profile))
+        filename = "%s-%s_%s.nc" % (
+            glider_name,
+            begin_time.strftime("%Y%m%dT%H%M%SZ"),
+            args.mode
+        )
+        
+        # Skip this write operation if the args.clobber is False and the file has
+        # been previously written
+        if not args.clobber:
+            if filename in existing_nc:
+                logging.warning('Skipping (Profile NetCDF already exists: {:s}'.format(filename))
+                continue
+        elif filename in existing_nc:
+            # If arg.clobber is True, try to delete the existing file provided
+            # we can find it
+            if os.path.isfile(existing_nc[filename]):
+                logging.info('Clobbering existing NetCDF: {:s}'.format(existing_nc[filename]))
                 try:
-                    logger.debug('Creating NetCDF destination {:s}'.format(dest_dir))
-                    os.makedirs(dest_dir)
+                    os.remove(existing_nc[filename])
                 except OSError as e:
-                    logger.error('Failed to create {:s} ({:s})'.format(dest_dir, e))
-                    continue
-            # Move the file from the temporary directory to the destination
-            if args.verbosity:
-                sys.stdout.write('{:s}\n'.format(fp))
+                    logging.warning('Failed to delete existing file: {:s} ({:s})'.format(existing_nc[filename], e))
+
+        # Path to hold file while we create it
+        fd, tmp_path = tempfile.mkstemp(dir=tmpdir, suffix='.nc', prefix='gutils')
+        os.close(fd)
+
+        # Full path to the file to be written
+        file_path = os.path.join(
+            args.output_path,
+            deployment_name,
+            filename
+        )
+        
+        jobs.append({'tmp_path' : tmp_path,
+            'skeleton_path' : skeleton_path,
+            'config' : config,
+            'attrs' : attrs,
+            'profile_id' : profile_id,
+            'profile_stream' : profile_stream,
+            'glider_name' : glider_name})
+
+        movepairs.append((tmp_path, file_path))
+
+        profile_id += 1
+        
+    # Write the profile NetCDF files
+    if pool:
+        written_profiles = pool.map(write_profile_netcdf, jobs)
+    else:
+        written_profiles = [write_profile_netcdf(job) for job in jobs]
+        
+    # Handle UV Variables in profile order, continuing from the previous 
+    # batch from the same source
+    uv_values, empty_uv_processed_paths = update_uv_variables(written_profiles, config, 
+        uv_values=uv_state['uv_values'], 
+        empty_uv_processed_paths=[tp for tp, fp in uv_state['pending']])
+    movepairs = uv_state['pending'] + movepairs
+    
+    # Files which have not been back-filled are moved once they are filled by
+    # the next batch or the source is complete
+    pending = []
+    if not final:
+        pending = [(tp, fp) for tp, fp in movepairs if tp in empty_uv_processed_paths]
+        movepairs = [(tp, fp) for tp, fp in movepairs if tp not in empty_uv_processed_paths]
+        
+    tmpdirs = set([tmpdir] + [os.path.dirname(tp) for tp, fp in movepairs])
+
+    for tp, fp in movepairs:
+        dest_dir = os.path.dirname(fp)
+        if not os.path.isdir(dest_dir):
             try:
-                shutil.move(tp, fp)
+                logger.debug('Creating NetCDF destination {:s}'.format(dest_dir))
+                os.makedirs(dest_dir)
             except OSError as e:
-                logger.error('Failed to move NetCDF {:s} ({:s})'.format(tp, e))
-                move_status = False
+                logger.error('Failed to create {:s} ({:s})'.format(dest_dir, e))
                 continue
+        # Move the file from the temporary directory to the destination
+        if args.verbosity:
+            sys.stdout.write('{:s}\n'.format(fp))
+        try:
+            shutil.move(tp, fp)
+        except OSError as e:
+            logger.error('Failed to move NetCDF {:s} ({:s})'.format(tp, e))
+            continue
+    
+    # Remove the temporary directories emptied by the moves.  Directories
+    # containing files which failed to move or are waiting to be back-filled
+    # are kept.
+    for d in tmpdirs:
+        if not os.listdir(d):
+            os.rmdir(d)
+            
+    if final:
+        return profile_id, None
         
-        # Remove the temporary directory if all NetCDF moves succeeded        
-        if move_status:
-            shutil.rmtree(tmpdir)
+    return profile_id, {'uv_values' : uv_values, 'pending' : pending}
 
-    return 0
+
+def remove_pending_netcdfs(uv_state):
+    """Remove the files in uv_state, returned by write_profile_netcdfs, which 
+    are waiting to be back-filled, along with their emptied temporary 
+    directories.  Files which have already been moved are skipped."""
+    
+    if not uv_state:
+        return
+        
+    for tp, fp in uv_state['pending']:
+        tmpdir = os.path.dirname(tp)
+        if os.path.isfile(tp):
+            logger.debug('Removing unfinished NetCDF {:s}'.format(tp))
+            os.remove(tp)
+        if os.path.isdir(tmpdir) and not os.listdir(tmpdir):
+            os.rmdir(tmpdir)
 
 
 def main():
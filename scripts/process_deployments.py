@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+import multiprocessing
+from ooidac import write_dataset_status_file
+from create_ioos_dac_netcdf import create_arg_parser, process_ooi_dataset
+
+def find_deployments(deployments_home):
+    """Return the sorted list of OOI glider deployment directories in
+    deployments_home"""
+
+    return sorted([d for d in glob.glob(os.path.join(deployments_home, '*MOAS*')) if os.path.isdir(d)])
+
+def is_recovered(deployment_path, subdir):
+    """Returns True if the deployment subdir directory contains a recovered.txt
+    file.  NetCDF files are not written once status/recovered.txt exists and the
+    profile status file is not updated once cfg/recovered.txt exists."""
+
+    return os.path.isfile(os.path.join(deployment_path, subdir, 'recovered.txt'))
+
+def process_deployment(job):
+    """Write new DAC NetCDF files from the deployment source NetCDF files and
+    update the deployment profile status file.  Source NetCDF files are renamed
+    with a .pro extension after they have been processed.  Runs in a worker
+    process.
+
+    Returns a dictionary containing the deployment path, the NetCDF and status
+    exit codes (None if not run), whether an unexpected error occurred and the
+    elapsed time, in seconds.
+    """
+
+    deployment_path = job['deployment_path']
+
+    result = {'deployment_path' : deployment_path,
+        'netcdf_status' : None,
+        'profile_status' : None,
+        'error' : False,
+        'elapsed' : 0.}
+
+    t0 = time.time()
+
+    try:
+
+        if job['netcdf']:
+            nc_files = glob.glob(os.path.join(deployment_path, 'nc-source', '*.nc'))
+            if not nc_files:
+                logging.info('No NetCDF files to process {:s}'.format(deployment_path))
+            else:
+                nc_args = create_arg_parser().parse_args(job['netcdf_args'] + [deployment_path, deployment_path])
+                result['netcdf_status'] = process_ooi_dataset(nc_args)
+                if result['netcdf_status'] == 0:
+                    for nc in nc_files:
+                        os.rename(nc, '{:s}.pro'.format(nc))
+
+        if job['status']:
+            logging.info('Writing {:s} deployment status'.format(deployment_path))
+            profile_status_file = write_dataset_status_file(deployment_path, clobber=job['clobber'])
+            result['profile_status'] = 0 if profile_status_file else 1
+
+    except Exception:
+        logging.exception('Error processing deployment {:s}'.format(deployment_path))
+        result['error'] = True
+
+    result['elapsed'] = time.time() - t0
+
+    return result
+
+def main(args):
+    """Write new U.S. IOOS National Glider Data Assembly Center NetCDF files and
+    update the profile status files for all OOI glider deployments found in
+    OOI_GLIDER_DAC_HOME/deployments.  Deployments are processed concurrently by a
+    pool of worker processes."""
+
+    # Configure logging
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(module)s:%(funcName)s:[line %(lineno)d]:%(levelname)s:%(message)s'
+    if args.timestamping:
+        log_format = '%(asctime)s:%(funcName)s:%(module)s:[line %(lineno)d]:%(levelname)s:%(message)s'
+    logging.basicConfig(format=log_format, level=log_level)
+
+    # Deployments home directory
+    deployments_root = args.root or os.getenv('OOI_GLIDER_DAC_HOME')
+    if not deployments_root:
+        logging.error('No deployments root specified (OOI_GLIDER_DAC_HOME not set?)')
+        return 1
+    if not os.path.isdir(deployments_root):
+        logging.error('Invalid deployments root {:s}'.format(deployments_root))
+        return 1
+    deployments_home = os.path.join(deployments_root, 'deployments')
+    if not os.path.isdir(deployments_home):
+        logging.error('Invalid deployments home {:s}'.format(deployments_home))
+        return 1
+
+    deployment_paths = find_deployments(deployments_home)
+    if not deployment_paths:
+        logging.info('No OOI glider deployments found {:s}'.format(deployments_home))
+        return 0
+
+    # Arguments passed to create_ioos_dac_netcdf.process_ooi_dataset.  Each
+    # deployment is written by a single worker process.
+    netcdf_args = ['--workers', '1']
+    if args.verbosity:
+        netcdf_args.append('--verbosity')
+    if args.flush:
+        netcdf_args.append('--flush')
+
+    jobs = []
+    for deployment_path in deployment_paths:
+
+        write_netcdf = not args.status_only
+        if write_netcdf and is_recovered(deployment_path, 'status'):
+            logging.info('Skipping NetCDF files: {:s} has been recovered'.format(deployment_path))
+            write_netcdf = False
+
+        write_status = not args.no_status
+        if write_status and is_recovered(deployment_path, 'cfg'):
+            logging.info('Skipping profile status: {:s} has been recovered'.format(deployment_path))
+            write_status = False
+
+        if not write_netcdf and not write_status:
+            continue
+
+        if args.debug:
+            sys.stdout.write('{:s}\n'.format(deployment_path))
+            for nc in glob.glob(os.path.join(deployment_path, 'nc-source', '*.nc')):
+                sys.stdout.write('UFrame NetCDF: {:s}\n'.format(nc))
+            continue
+
+        jobs.append({'deployment_path' : deployment_path,
+            'netcdf' : write_netcdf,
+            'netcdf_args' : netcdf_args,
+            'status' : write_status,
+            'clobber' : args.clobber})
+
+    if not jobs:
+        return 0
+
+    workers = max(1, min(args.workers, len(jobs)))
+    logging.info('Processing {:d} deployments with {:d} worker processes'.format(len(jobs), workers))
+
+    t0 = time.time()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = list(pool.imap_unordered(process_deployment, jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [process_deployment(job) for job in jobs]
+
+    # Report per-deployment timings and exit codes
+    exit_status = 0
+    for result in sorted(results, key=lambda r: r['deployment_path']):
+        logging.info('{:s}: netcdf={} status={} error={} elapsed={:0.1f}s'.format(
+            os.path.basename(result['deployment_path']),
+            result['netcdf_status'],
+            result['profile_status'],
+            result['error'],
+            result['elapsed']))
+        if result['netcdf_status'] or result['profile_status'] or result['error']:
+            exit_status = 1
+
+    logging.info('Processed {:d} deployments in {:0.1f}s'.format(len(results), time.time() - t0))
+
+    return exit_status
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+
+    arg_parser.add_argument('-r', '--root',
+        help='Root directory containing the OOI glider deployment folders.  Taken from OOI_GLIDER_DAC_HOME if not specified')
+
+    arg_parser.add_argument('-w', '--workers',
+        help='Maximum number of deployments processed concurrently <Default=number of CPUs>',
+        type=int,
+        default=multiprocessing.cpu_count())
+
+    arg_parser.add_argument('-c', '--clobber',
+        help='Clobber and rewrite the profile status files',
+        action='store_true')
+
+    arg_parser.add_argument('--status-only',
+        help='Update the profile status files but do not write new NetCDF files',
+        action='store_true')
+
+    arg_parser.add_argument('--no-status',
+        help='Write new NetCDF files but do not update the profile status files',
+        action='store_true')
+
+    arg_parser.add_argument('--flush',
+        help='Write the trailing, possibly incomplete, profile of each deployment instead of carrying it over to the next run',
+        action='store_true')
+
+    arg_parser.add_argument('-v', '--verbosity',
+        help='Print created NetCDF filenames to STDOUT',
+        action='store_true')
+
+    arg_parser.add_argument('--timestamping',
+        help='Timestamp log entries',
+        action='store_true')
+
+    arg_parser.add_argument('-x', '--debug',
+        help='Print the deployments and UFrame NetCDF files to be processed but do not process them',
+        action='store_true')
+
+    arg_parser.add_argument('-l', '--loglevel',
+        help='Verbosity level <Default=info>',
+        type=str,
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+
+from gutils.config import load_deployment_config, load_json_config
+
+CFG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'deployment-master', 'cfg')
+
+DEPLOYMENT = {'glider' : 'ce05moas-gl326',
+    'trajectory_date' : '20170401T0000',
+    'global_attributes' : {'wmo_id' : '4801234'},
+    'platform' : {'type' : 'platform', 'id' : 'gl326'}}
+
+
+def make_config_dir(tmpdir):
+
+    cfg_path = str(tmpdir.mkdir('cfg'))
+    for name in ['datatypes', 'global_attributes', 'instruments']:
+        shutil.copy(os.path.join(CFG_PATH, '{:s}.json.new'.format(name)), os.path.join(cfg_path, '{:s}.json'.format(name)))
+    write_deployment(cfg_path, DEPLOYMENT)
+
+    return cfg_path
+
+
+def write_deployment(cfg_path, deployment, mtime=None):
+
+    deployment_path = os.path.join(cfg_path, 'deployment.json')
+    with open(deployment_path, 'w') as fid:
+        json.dump(deployment, fid, sort_keys=True)
+    if mtime is not None:
+        os.utime(deployment_path, (mtime, mtime))
+
+    return deployment_path
+
+
+def test_load_deployment_config_cached(tmpdir):
+
+    cfg_path = make_config_dir(tmpdir)
+
+    config = load_deployment_config(cfg_path)
+    assert config.deployment['glider'] == 'ce05moas-gl326'
+    assert config.attrs['global']['wmo_id'] == '4801234'
+
+    # Unmodified configurations are not reloaded
+    assert load_deployment_config(cfg_path) is config
+    assert load_deployment_config(os.path.join(cfg_path, '.')) is config
+    assert load_json_config(os.path.join(cfg_path, 'datatypes.json')) is config.datatypes
+
+
+def test_load_deployment_config_modified_size(tmpdir):
+
+    cfg_path = make_config_dir(tmpdir)
+    config = load_deployment_config(cfg_path)
+    mtime = os.stat(os.path.join(cfg_path, 'deployment.json')).st_mtime
+
+    # Same modification time, different size
+    deployment = dict(DEPLOYMENT, glider='ce05moas-gl3260')
+    write_deployment(cfg_path, deployment, mtime=mtime)
+
+    reloaded = load_deployment_config(cfg_path)
+    assert reloaded is not config
+    assert reloaded.deployment['glider'] == 'ce05moas-gl3260'
+    # Configuration files which were not modified are not parsed again
+    assert reloaded.datatypes is config.datatypes
+
+
+def test_load_deployment_config_modified_mtime(tmpdir):
+
+    cfg_path = make_config_dir(tmpdir)
+    config = load_deployment_config(cfg_path)
+    deployment_path = os.path.join(cfg_path, 'deployment.json')
+    stat = os.stat(deployment_path)
+
+    # Same size, different modification time
+    deployment = dict(DEPLOYMENT, glider='ce05moas-gl327')
+    write_deployment(cfg_path, deployment, mtime=stat.st_mtime + 10)
+    assert os.stat(deployment_path).st_size == stat.st_size
+
+    reloaded = load_deployment_config(cfg_path)
+    assert reloaded is not config
+    assert reloaded.deployment['glider'] == 'ce05moas-gl327'
+    assert load_deployment_config(cfg_path) is reloaded
+
+
+def test_load_deployment_config_invalid(tmpdir):
+    """Invalid configurations are not cached"""
+
+    cfg_path = make_config_dir(tmpdir)
+    config = load_deployment_config(cfg_path)
+    mtime = os.stat(os.path.join(cfg_path, 'deployment.json')).st_mtime
+
+    deployment = dict(DEPLOYMENT)
+    del deployment['platform']
+    write_deployment(cfg_path, deployment, mtime=mtime + 10)
+    assert load_deployment_config(cfg_path) is None
+
+    with open(os.path.join(cfg_path, 'deployment.json'), 'w') as fid:
+        fid.write('{"glider" :')
+    assert load_deployment_config(cfg_path) is None
+
+    write_deployment(cfg_path, DEPLOYMENT, mtime=mtime + 20)
+    reloaded = load_deployment_config(cfg_path)
+    assert reloaded is not config
+    assert reloaded.deployment == config.deployment
+
+    os.remove(os.path.join(cfg_path, 'instruments.json'))
+    assert load_deployment_config(cfg_path) is None
+    assert load_deployment_config(str(tmpdir.join('missing'))) is None
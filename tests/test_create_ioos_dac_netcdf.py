@@ -0,0 +1,140 @@
+import glob
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from create_ioos_dac_netcdf import create_arg_parser, process_ooi_dataset
+from ooidac import build_trajectory_name, write_dataset_status_file
+
+CFG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'deployment-master', 'cfg')
+
+DEPLOYMENT = {'glider' : 'ce05moas-gl326',
+    'trajectory_date' : '20170401T0000',
+    'global_attributes' : {'wmo_id' : '4801234', 'deployment_number' : '5'},
+    'platform' : {'type' : 'platform',
+        'id' : 'gl326',
+        'wmo_id' : '4801234',
+        'long_name' : 'Coastal Endurance Glider 326',
+        'comment' : '',
+        'instrument' : ''}}
+
+# Seconds between the NetCDF and unix epochs
+EPOCH_1900 = 2208988800.
+
+
+def make_deployment(path):
+
+    os.makedirs(os.path.join(path, 'cfg'))
+    for name in ['datatypes', 'global_attributes', 'instruments']:
+        shutil.copy(os.path.join(CFG_PATH, '{:s}.json.new'.format(name)), os.path.join(path, 'cfg', '{:s}.json'.format(name)))
+    with open(os.path.join(path, 'cfg', 'deployment.json'), 'w') as fid:
+        json.dump(DEPLOYMENT, fid)
+
+    for d in ['status', 'nc-source', 'nc-archive']:
+        os.makedirs(os.path.join(path, d))
+
+    return path
+
+
+def make_m2m_nc(path, t0, n, dt=4.):
+    """Write an m2m source NetCDF file containing n observations of 1200 second
+    sawtooth dives and climbs between 1 and 201 dbar"""
+
+    t = t0 + np.arange(n) * dt
+    phase = ((t - 1492900000.) % 1200.) / 1200.
+    p = np.where(phase < 0.5, phase * 2, (1 - phase) * 2) * 200 + 1
+
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('obs', n)
+        values = {'time' : (t + EPOCH_1900, 'seconds since 1900-01-01 0:0:0'),
+            'sci_water_pressure_dbar' : (p, 'dbar'),
+            'sci_water_pressure' : (p / 10., 'bar'),
+            'lat' : (44.5 + 0 * t, 'degrees_north'),
+            'lon' : (-124.5 + 0 * t, 'degrees_east'),
+            'sci_water_temp' : (10 - p / 50, 'deg_C'),
+            'sci_water_cond' : (3.5 + 0 * t, 'S m-1'),
+            'practical_salinity' : (33 + p / 100, '1'),
+            'sci_seawater_density' : (1025 + p / 100, 'kg m-3')}
+        for name, (data, units) in values.items():
+            var = nc.createVariable(name, 'f8', ('obs',))
+            var.units = units
+            var[:] = data
+        nc.variables['time'].calendar = 'gregorian'
+        nc.createVariable('deployment', 'i4', ('obs',))[:] = np.ones(n)
+
+
+def run(deployment_path, *args):
+    """Write the profile NetCDF files, then update the status file and mark the
+    source files processed, as process_deployments does"""
+
+    nc_args = create_arg_parser().parse_args(list(args) + [deployment_path, deployment_path])
+    status = process_ooi_dataset(nc_args)
+    assert status == 0
+
+    write_dataset_status_file(deployment_path)
+    for nc in glob.glob(os.path.join(deployment_path, 'nc-source', '*.nc')):
+        os.rename(nc, '{:s}.pro'.format(nc))
+
+
+def history_sources(history):
+    """Return the names of the source files in the NC_GLOBAL:history"""
+
+    sources = history.split('Data Source ')[1].split('\n')[0]
+    return [os.path.basename(source) for source in sources.split(', ')]
+
+
+def read_profiles(deployment_path):
+
+    trajectory = build_trajectory_name(DEPLOYMENT['glider'], DEPLOYMENT['trajectory_date'])
+    profiles = {}
+    for nc in sorted(glob.glob(os.path.join(deployment_path, trajectory, '*.nc'))):
+        with Dataset(nc) as nci:
+            profiles[os.path.basename(nc)] = (int(nci.variables['profile_id'][0]),
+                nci.variables['time'][:].filled(np.nan),
+                nci.variables['pressure'][:].filled(np.nan),
+                history_sources(nci.history))
+
+    return profiles
+
+
+def test_resume_from_carried_over_profile(tmpdir):
+    """Profiles written by consecutive runs, each reading only the new source
+    file, are the same as those written by a single run reading both files"""
+
+    # The source files are split in the middle of a profile
+    t0 = 1492900000.
+    single = make_deployment(str(tmpdir.join('single')))
+    make_m2m_nc(os.path.join(single, 'nc-source', 'a.nc'), t0, 1725)
+    make_m2m_nc(os.path.join(single, 'nc-source', 'b.nc'), t0 + 1725 * 4., 1725)
+    run(single, '--flush')
+
+    consecutive = make_deployment(str(tmpdir.join('consecutive')))
+    make_m2m_nc(os.path.join(consecutive, 'nc-source', 'a.nc'), t0, 1725)
+    run(consecutive)
+    assert len(glob.glob(os.path.join(consecutive, 'status', '*-pending.npz'))) == 1
+
+    make_m2m_nc(os.path.join(consecutive, 'nc-source', 'b.nc'), t0 + 1725 * 4., 1725)
+    run(consecutive, '--flush')
+    assert not glob.glob(os.path.join(consecutive, 'status', '*-pending.npz'))
+
+    expected = read_profiles(single)
+    profiles = read_profiles(consecutive)
+
+    assert len(expected) > 20
+    assert sorted(profiles.keys()) == sorted(expected.keys())
+    for filename in expected:
+        assert profiles[filename][0] == expected[filename][0]
+        np.testing.assert_array_equal(profiles[filename][1], expected[filename][1])
+        np.testing.assert_array_equal(profiles[filename][2], expected[filename][2])
+        assert profiles[filename][3] == expected[filename][3]
+
+    # Only the profile spanning both source files lists both
+    sources = [expected[filename][3] for filename in sorted(expected)]
+    assert sources.count(['a.nc', 'b.nc']) == 1
+    assert sources.count(['a.nc']) + sources.count(['b.nc']) == len(sources) - 1
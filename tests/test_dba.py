@@ -0,0 +1,116 @@
+import numpy as np
+
+from gutils.readers.dba import dba_to_stream
+
+HEADER = ['dbd_label: DBD_ASC(dinkum_binary_data_ascii)file',
+    'encoding_ver: 2',
+    'num_ascii_tags: 14',
+    'all_sensors: 0',
+    'filename: unit_326-2017-100-0-0',
+    'the8x3_filename: 01340000',
+    'filename_extension: dbd',
+    'filename_label: unit_326-2017-100-0-0-dbd(01340000)',
+    'mission_name: STOCK.MI',
+    'fileopen_time: Mon_Apr_10_12:00:00_2017',
+    'sensors_per_cycle: 7',
+    'num_label_lines: 3',
+    'num_segments: 1',
+    'segment_filename_0: unit_326-2017-100-0-0']
+
+SENSOR_NAMES = ['m_present_time', 'sci_m_present_time', 'sci_water_pressure', 'sci_water_temp', 'm_depth', 'x_flag',
+    'x_count']
+SENSOR_UNITS = ['timestamp', 'timestamp', 'bar', 'degc', 'm', 'enum', 'nodim']
+SENSOR_BYTES = ['8', '8', '4', '4', '4', '1', '2']
+
+
+def write_dba(path, rows=100, seed=0):
+    """Write an ascii dba file and return the rows x sensors array of values"""
+
+    rng = np.random.RandomState(seed)
+    t = 1491825600. + np.arange(rows) * 2.
+    pressure = rng.rand(rows) * 20
+    data = np.column_stack([t, t + 0.5, pressure, 10 - pressure / 2, pressure * 10,
+        rng.randint(0, 3, rows), rng.randint(-500, 500, rows)])
+    data[:, 2:][rng.rand(rows, 5) < 0.5] = np.nan
+
+    with open(path, 'w') as fid:
+        fid.write('\n'.join(HEADER) + '\n')
+        for labels in [SENSOR_NAMES, SENSOR_UNITS, SENSOR_BYTES]:
+            fid.write(' '.join(labels) + ' \n')
+        np.savetxt(fid, data, fmt='%.17g')
+
+    return data
+
+
+def test_dba_to_stream(tmpdir):
+
+    path = str(tmpdir.join('unit_326-2017-100-0-0.dba'))
+    data = write_dba(path)
+
+    dba = dba_to_stream(path)
+
+    assert dba['meta']['header']['filename'] == 'unit_326-2017-100-0-0'
+    assert dba['meta']['sensor_names'] == SENSOR_NAMES
+    assert dba['meta']['sensor_units'] == SENSOR_UNITS
+    assert dba['meta']['sensor_bytes'] == SENSOR_BYTES
+    assert dba['stream'].sensor_names == SENSOR_NAMES + ['timestamp']
+    for i, name in enumerate(SENSOR_NAMES):
+        assert dba['stream'][name].dtype == np.dtype('f8')
+        np.testing.assert_array_equal(dba['stream'][name], data[:, i], err_msg=name)
+    # The timestamp is the first time sensor in the file
+    np.testing.assert_array_equal(dba['stream']['timestamp'], data[:, 0])
+
+
+def test_dba_to_stream_sensors(tmpdir):
+    """Only the requested sensors, and the time sensor, are loaded in file
+    order"""
+
+    path = str(tmpdir.join('unit_326-2017-100-0-0.dba'))
+    data = write_dba(path)
+
+    sensors = ['x_count', 'sci_water_temp', 'not_in_file']
+    dba = dba_to_stream(path, timesensor='sci_m_present_time', sensors=sensors)
+
+    names = ['sci_m_present_time', 'sci_water_temp', 'x_count']
+    assert dba['meta']['sensor_names'] == names
+    assert dba['meta']['sensor_units'] == ['timestamp', 'degc', 'nodim']
+    assert dba['meta']['sensor_bytes'] == ['8', '4', '2']
+    assert dba['stream'].sensor_names == names + ['timestamp']
+    for name in names:
+        np.testing.assert_array_equal(dba['stream'][name], data[:, SENSOR_NAMES.index(name)], err_msg=name)
+    np.testing.assert_array_equal(dba['stream']['timestamp'], data[:, 1])
+
+
+def test_dba_to_stream_narrow(tmpdir):
+
+    path = str(tmpdir.join('unit_326-2017-100-0-0.dba'))
+    data = write_dba(path)
+
+    dba = dba_to_stream(path, narrow=True)
+
+    for i, (name, dtype) in enumerate(zip(SENSOR_NAMES, ['f8', 'f8', 'f4', 'f4', 'f4', 'f4', 'f4'])):
+        assert dba['stream'][name].dtype == np.dtype(dtype), name
+        np.testing.assert_array_equal(dba['stream'][name], data[:, i].astype(dtype), err_msg=name)
+    assert dba['stream']['timestamp'].dtype == np.dtype('f8')
+
+
+def test_dba_to_stream_invalid(tmpdir):
+
+    path = str(tmpdir.join('unit_326-2017-100-0-0.dba'))
+    data = write_dba(path, rows=10)
+
+    # The incomplete final row is skipped
+    with open(path, 'r') as fid:
+        contents = fid.read()
+    with open(path, 'w') as fid:
+        fid.write(contents.rstrip().rsplit(' ', 2)[0] + '\n')
+    np.testing.assert_array_equal(dba_to_stream(path)['stream']['timestamp'], data[:-1, 0])
+
+    assert dba_to_stream(path, timesensor='m_gps_time') is None
+    assert dba_to_stream(str(tmpdir.join('missing.dba'))) is None
+
+    with open(path, 'w') as fid:
+        fid.write('\n'.join(HEADER) + '\n')
+        for labels in [SENSOR_NAMES, SENSOR_UNITS, SENSOR_BYTES]:
+            fid.write(' '.join(labels) + ' \n')
+    assert dba_to_stream(path) is None
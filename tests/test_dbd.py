@@ -0,0 +1,133 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from gutils.readers.dbd import dbd_to_stream
+
+# struct format character by number of value bytes
+STRUCT_TYPES = {1 : 'b', 2 : 'h', 4 : 'f', 8 : 'd'}
+
+
+def write_dbd(path, byte_order='>', factored=False, cache_dir=None, num_cycles=500, seed=0):
+    """Write a Slocum binary data file containing num_cycles data cycles with
+    random sensor states and values.  The sensor list is written to the
+    cache_dir sensor list cache file, instead of the file, if factored.
+
+    Returns the list of sensor names in the file and the num_cycles x
+    num_sensors array of the expected decoded values.
+    """
+
+    rng = np.random.RandomState(seed)
+    names = ['m_present_time', 'm_depth', 'sci_water_pressure', 'c_wpt_lat', 'x_flag', 'x_count']
+    names += ['x_sensor_{:d}'.format(i) for i in range(15)]
+    sensor_bytes = [8, 4, 4, 8, 1, 2] + rng.choice([1, 2, 4, 8], 15).tolist()
+    num_sensors = len(names)
+    state_bytes_per_cycle = (num_sensors + 3) // 4
+
+    # The sensor list includes a sensor which is not in the file
+    sensor_lines = ['s: F    0   -1 4 m_unused nodim\n']
+    for i, (name, num_bytes) in enumerate(zip(names, sensor_bytes)):
+        sensor_lines.append('s: T {:4d} {:4d} {:d} {:s} nodim\n'.format(i + 1, i, num_bytes, name))
+
+    header = ['dbd_label: DBD(dinkum_binary_data)file',
+        'encoding_ver: 5',
+        'num_ascii_tags: 10',
+        'filename: unit_1',
+        'filename_extension: dbd',
+        'sensors_per_cycle: {:d}'.format(num_sensors),
+        'sensor_list_crc: 0A1B2C3D',
+        'state_bytes_per_cycle: {:d}'.format(state_bytes_per_cycle),
+        'total_num_sensors: {:d}'.format(len(sensor_lines)),
+        'sensor_list_factored: {:d}'.format(int(factored))]
+
+    data = bytearray('\n'.join(header).encode('ascii') + b'\n')
+    if factored:
+        with open(os.path.join(cache_dir, '0a1b2c3d.cac'), 'w') as fid:
+            fid.write(''.join(sensor_lines))
+    else:
+        data += ''.join(sensor_lines).encode('ascii')
+
+    # Known bytes cycle
+    data += b'sa' + struct.pack(byte_order + 'h', 0x1234) + struct.pack(byte_order + 'f', 123.456) + struct.pack(byte_order + 'd', 123456789.12345)
+
+    expected = np.full((num_cycles, num_sensors), np.nan)
+    previous = [np.nan] * num_sensors
+    for c in range(num_cycles):
+        states = rng.choice([0, 1, 2], num_sensors, p=[0.3, 0.3, 0.4])
+        states[0] = 2
+        state_bytes = bytearray(state_bytes_per_cycle)
+        values = bytearray()
+        for s in range(num_sensors):
+            state_bytes[s // 4] |= int(states[s]) << (6 - 2 * (s % 4))
+            if states[s] == 2:
+                if s == 0:
+                    value = 1.5e9 + c * 4.
+                elif sensor_bytes[s] < 4:
+                    value = int(rng.randint(-100, 100))
+                else:
+                    value = float(np.float32(rng.randn() * 100))
+                values += struct.pack(byte_order + STRUCT_TYPES[sensor_bytes[s]], value)
+                previous[s] = value
+                expected[c, s] = value
+            elif states[s] == 1:
+                expected[c, s] = previous[s]
+        data += b'd' + state_bytes + values
+    data += b'X'
+
+    with open(path, 'wb') as fid:
+        fid.write(data)
+
+    return names, expected
+
+
+@pytest.mark.parametrize('byte_order', ['>', '<'])
+def test_dbd_round_trip(tmpdir, byte_order):
+
+    path = str(tmpdir.join('unit_1.dbd'))
+    names, expected = write_dbd(path, byte_order=byte_order)
+
+    dbd = dbd_to_stream(path, cache_dir=str(tmpdir))
+
+    assert dbd['meta']['sensor_names'] == names
+    for i, name in enumerate(names):
+        np.testing.assert_array_equal(dbd['stream'][name].astype('f8'), expected[:, i])
+    np.testing.assert_array_equal(dbd['stream']['timestamp'], expected[:, 0])
+
+    # The inline sensor list is written to the cache
+    assert os.path.isfile(str(tmpdir.join('0a1b2c3d.cac')))
+
+
+@pytest.mark.parametrize('byte_order', ['>', '<'])
+def test_dbd_factored_sensor_list(tmpdir, byte_order):
+
+    path = str(tmpdir.join('unit_1.sbd'))
+    cache_dir = tmpdir.mkdir('cache')
+    names, expected = write_dbd(path, byte_order=byte_order, factored=True, cache_dir=str(cache_dir), seed=1)
+
+    sensors = ['m_depth', 'x_count', 'x_sensor_14']
+    dbd = dbd_to_stream(path, sensors=sensors, cache_dir=str(cache_dir))
+
+    # The time sensor is always loaded
+    assert dbd['meta']['sensor_names'] == ['m_present_time'] + sensors
+    for name in ['m_present_time'] + sensors:
+        np.testing.assert_array_equal(dbd['stream'][name].astype('f8'), expected[:, names.index(name)])
+
+    # The sensor list cannot be read without the cache file
+    assert dbd_to_stream(path, cache_dir=str(tmpdir)) is None
+
+
+def test_dbd_incomplete_final_cycle(tmpdir):
+
+    path = str(tmpdir.join('unit_1.dbd'))
+    names, expected = write_dbd(path, num_cycles=50)
+
+    # Truncate the file in the middle of the last cycle
+    with open(path, 'rb') as fid:
+        data = fid.read()
+    with open(path, 'wb') as fid:
+        fid.write(data[:-3])
+
+    dbd = dbd_to_stream(path, cache_dir=str(tmpdir))
+    np.testing.assert_array_equal(dbd['stream']['m_present_time'], expected[:-1, 0])
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from calendar import timegm
+from datetime import datetime
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, unquote, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qs
+    from urllib import unquote
+
+from gutils.readers.erddap import fetch_erddap_stream_data, fetch_glider_datasets
+
+# Test dataset: one observation per minute for 10 hours, with no observations
+# between hours 4 and 6
+T0 = 1500000000.
+TIMESTAMPS = T0 + np.arange(600) * 60.
+TIMESTAMPS = TIMESTAMPS[np.logical_or(TIMESTAMPS < T0 + 4 * 3600, TIMESTAMPS >= T0 + 6 * 3600)]
+
+DATASET = {'time' : TIMESTAMPS,
+    'latitude' : 44.5 + 0 * TIMESTAMPS,
+    'longitude' : -124.5 + 0 * TIMESTAMPS,
+    'sci_water_pressure_dbar' : (TIMESTAMPS - T0) / 100.,
+    'sci_water_temp' : 10 + (TIMESTAMPS - T0) / 1e5,
+    'sci_water_cond' : 3.5 + 0 * TIMESTAMPS}
+
+
+class TabledapHandler(BaseHTTPRequestHandler):
+    """Serves the dataset info and the .nc subsets of DATASET as the ERDDAP
+    tabledap dataset /erddap/tabledap/test, and the server.num_datasets
+    dataset search results.  Requests for the server.fail_search result page
+    fail"""
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, content_type='application/octet-stream'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+
+        if url.path == '/erddap/search/advanced.json':
+            return self.search(parse_qs(url.query))
+
+        if url.path == '/erddap/info/test/index.json':
+            rows = []
+            for name in DATASET:
+                rows.append(['variable', name, '', 'double', ''])
+            rows.append(['attribute', 'time', 'actual_range', 'double', '{:0.1f}, {:0.1f}'.format(TIMESTAMPS[0], TIMESTAMPS[-1])])
+            info = {'table' : {'columnNames' : ['Row Type', 'Variable Name', 'Attribute Name', 'Data Type', 'Value'], 'rows' : rows}}
+            return self.send(200, json.dumps(info).encode('utf-8'), 'application/json')
+
+        if url.path != '/erddap/tabledap/test.nc':
+            return self.send(404, b'Not Found')
+
+        query = unquote(url.query).split('&')
+        variables = query[0].split(',')
+        self.server.requests.append(variables)
+        if len(self.server.requests) == self.server.fail_request:
+            return self.send(500, b'Internal Server Error')
+
+        rows = np.ones(TIMESTAMPS.shape[0], dtype=bool)
+        for constraint in query[1:]:
+            match = re.match(r'time(>=|<)(.+)$', constraint)
+            ts = timegm(datetime.strptime(match.group(2), '%Y-%m-%dT%H:%M:%SZ').timetuple())
+            rows &= TIMESTAMPS >= ts if match.group(1) == '>=' else TIMESTAMPS < ts
+        self.server.windows.append(int(rows.sum()))
+        if not rows.any():
+            return self.send(404, b'Error {code=404; message="Not Found: Your query produced no matching results."}')
+
+        fd, nc_path = tempfile.mkstemp(suffix='.nc')
+        os.close(fd)
+        try:
+            with Dataset(nc_path, 'w') as nc:
+                nc.createDimension('row', int(rows.sum()))
+                for name in variables:
+                    var = nc.createVariable(name, 'f8', ('row',))
+                    var[:] = DATASET[name][rows]
+                nc.variables['time'].units = 'seconds since 1970-01-01T00:00:00Z'
+            with open(nc_path, 'rb') as fid:
+                body = fid.read()
+        finally:
+            os.remove(nc_path)
+
+        return self.send(200, body)
+
+    def search(self, query):
+        """Serves the page of dataset search results, or 304 if the page has the
+        If-None-Match ETag"""
+
+        page = int(query['page'][0])
+        items_per_page = int(query['itemsPerPage'][0])
+        etag = self.headers.get('If-None-Match')
+
+        if page == self.server.fail_search:
+            self.server.searches.append((page, 500))
+            return self.send(500, b'Internal Server Error')
+
+        dataset_ids = ['allDatasets'] + ['dataset{:03d}'.format(i) for i in range(self.server.num_datasets)]
+        rows = [[i, 'MOAS {:s}'.format(i)] for i in dataset_ids[(page - 1) * items_per_page:page * items_per_page]]
+        if not rows:
+            self.server.searches.append((page, 404))
+            return self.send(404, b'Error {code=404; message="Not Found: Your query produced no matching results. (nRows = 0)"}')
+
+        body = json.dumps({'table' : {'columnNames' : ['Dataset ID', 'Title'], 'rows' : rows}}).encode('utf-8')
+        page_etag = '"{:s}"'.format(hashlib.md5(body).hexdigest())
+        if etag == page_etag:
+            self.server.searches.append((page, 304))
+            self.send_response(304)
+            self.send_header('ETag', page_etag)
+            self.end_headers()
+            return
+
+        self.server.searches.append((page, 200))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', page_etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def erddap_server():
+
+    server = HTTPServer(('127.0.0.1', 0), TabledapHandler)
+    server.requests = []
+    server.windows = []
+    server.fail_request = None
+    server.num_datasets = 25
+    server.searches = []
+    server.fail_search = None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def dataset_url(server):
+    return 'http://127.0.0.1:{:d}/erddap/tabledap/test'.format(server.server_address[1])
+
+
+def test_fetch_erddap_stream_data_windows(erddap_server):
+    """The dataset time range is fetched in chunk_seconds windows and empty
+    windows are skipped"""
+
+    datasets = list(fetch_erddap_stream_data(dataset_url(erddap_server), chunk_seconds=3600))
+
+    # The last window is open ended
+    assert len(erddap_server.windows) == 10
+    assert erddap_server.windows == [60, 60, 60, 60, 0, 0, 60, 60, 60, 60]
+    assert len(datasets) == 8
+
+
+def test_fetch_erddap_stream_data_variables(erddap_server):
+    """Only the requested variables contained in the dataset, and the required
+    variables, are requested"""
+
+    variables = ['sci_water_temp', 'sci_water_pressure_dbar', 'not_in_dataset']
+    datasets = list(fetch_erddap_stream_data(dataset_url(erddap_server), variables=variables,
+        start_ts=T0 + 3600, end_ts=T0 + 3 * 3600, chunk_seconds=1800))
+
+    assert len(erddap_server.requests) == 4
+    for requested in erddap_server.requests:
+        assert sorted(requested) == sorted(['time', 'latitude', 'longitude', 'sci_water_pressure_dbar', 'sci_water_temp'])
+
+    # The columns contain the observations within [start_ts, end_ts), with the
+    # m2m sensor names
+    rows = np.logical_and(TIMESTAMPS >= T0 + 3600, TIMESTAMPS < T0 + 3 * 3600)
+    for name, erddap_name in [('timestamp', 'time'), ('lat', 'latitude'), ('lon', 'longitude'), ('sci_water_temp', 'sci_water_temp')]:
+        np.testing.assert_array_equal(np.concatenate([d['stream'][name] for d in datasets]), DATASET[erddap_name][rows])
+    assert not datasets[0]['stream'].has_sensor('sci_water_cond')
+
+
+def test_fetch_erddap_stream_data_failed_window(erddap_server):
+    """A failed window raises IOError after the preceding windows have been
+    yielded"""
+
+    erddap_server.fail_request = 3
+    datasets = fetch_erddap_stream_data(dataset_url(erddap_server), chunk_seconds=3600)
+
+    assert len(next(datasets)['stream']) == 60
+    assert len(next(datasets)['stream']) == 60
+    with pytest.raises(IOError):
+        next(datasets)
+
+
+def dataset_ids(datasets):
+    return [d['Dataset ID'] for d in datasets]
+
+
+def erddap_url(server):
+    return 'http://127.0.0.1:{:d}/erddap'.format(server.server_address[1])
+
+
+def test_fetch_glider_datasets_pages(erddap_server):
+    """Search result pages are requested until a partial or missing page"""
+
+    datasets = fetch_glider_datasets(erddap_url(erddap_server), items_per_page=10)
+
+    assert dataset_ids(datasets) == ['dataset{:03d}'.format(i) for i in range(25)]
+    assert datasets[0]['Title'] == 'MOAS dataset000'
+    assert erddap_server.searches == [(1, 200), (2, 200), (3, 200)]
+
+    # The allDatasets record fills the first page
+    erddap_server.num_datasets = 19
+    erddap_server.searches = []
+    datasets = fetch_glider_datasets(erddap_url(erddap_server), items_per_page=10)
+
+    assert len(datasets) == 19
+    assert erddap_server.searches == [(1, 200), (2, 200), (3, 404)]
+
+
+def test_fetch_glider_datasets_cache(erddap_server, tmpdir):
+    """The cached catalog is used for max_age seconds and then revalidated one
+    page at a time"""
+
+    url = erddap_url(erddap_server)
+    cache_dir = str(tmpdir)
+
+    datasets = fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=10)
+    assert len(datasets) == 25
+    assert len(tmpdir.listdir()) == 1
+
+    # Unexpired
+    erddap_server.searches = []
+    assert fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=10) == datasets
+    assert erddap_server.searches == []
+
+    # Expired and unchanged
+    assert fetch_glider_datasets(url, cache_dir=cache_dir, max_age=0, items_per_page=10) == datasets
+    assert erddap_server.searches == [(1, 304), (2, 304), (3, 304)]
+
+    # Expired with new datasets on the last page and a new page
+    erddap_server.num_datasets = 32
+    erddap_server.searches = []
+    datasets = fetch_glider_datasets(url, cache_dir=cache_dir, max_age=0, items_per_page=10)
+    assert len(datasets) == 32
+    assert erddap_server.searches == [(1, 304), (2, 304), (3, 200), (4, 200)]
+
+    # The updated catalog was cached
+    erddap_server.searches = []
+    assert fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=10) == datasets
+    assert erddap_server.searches == []
+
+    # A catalog cached with a different page size is not used
+    assert len(fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=20)) == 32
+    assert erddap_server.searches == [(1, 200), (2, 200)]
+
+
+def test_fetch_glider_datasets_failed(erddap_server, tmpdir):
+    """A failed search page fails the fetch and the cache is not updated"""
+
+    url = erddap_url(erddap_server)
+    cache_dir = str(tmpdir)
+
+    erddap_server.fail_search = 2
+    assert fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=10) is None
+    assert erddap_server.searches == [(1, 200), (2, 500)]
+    assert tmpdir.listdir() == []
+
+    erddap_server.fail_search = None
+    datasets = fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=10)
+    assert len(datasets) == 25
+
+    erddap_server.fail_search = 3
+    erddap_server.num_datasets = 30
+    assert fetch_glider_datasets(url, cache_dir=cache_dir, max_age=0, items_per_page=10) is None
+
+    erddap_server.fail_search = None
+    erddap_server.searches = []
+    assert fetch_glider_datasets(url, cache_dir=cache_dir, items_per_page=10) == datasets
+    assert erddap_server.searches == []
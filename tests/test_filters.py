@@ -0,0 +1,29 @@
+import numpy as np
+
+from gutils.yo.filters import profile_statistics, filter_profiles
+
+
+def make_yo():
+    t = np.arange(100, 200, dtype='f8')
+    return np.column_stack((t, np.abs(np.sin(t / 10.)) * 20))
+
+
+def test_profile_statistics_empty_windows():
+    """Profile windows entirely before or after the yo have no statistics"""
+
+    yo = make_yo()
+    stats = profile_statistics(yo, [[0, 10], [100, 150], [300, 400]])
+
+    np.testing.assert_array_equal(stats['points'], [0, 51, 0])
+    for key in ['depthspan', 'timespan', 'maxgap']:
+        assert np.isnan(stats[key][[0, 2]]).all()
+    assert stats['timespan'][1] == 50
+    assert stats['maxgap'][1] == 1
+
+
+def test_filter_profiles_empty_windows():
+
+    yo = make_yo()
+    profiles = filter_profiles(yo, [[0, 10], [100, 150], [300, 400]])
+
+    np.testing.assert_array_equal(profiles, [[100, 150]])
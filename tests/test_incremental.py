@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from gutils.readers import iter_stream_profiles
+from gutils.readers.stream import GliderStream
+from gutils.yo.incremental import IncrementalYoIndexer
+
+
+def make_stream(n=3000, dt=4.):
+    """Sawtooth dives and climbs between 1 and 201 dbar with a 1200 second
+    period"""
+
+    t = 1500000000. + np.arange(n) * dt
+    phase = ((t - t[0]) % 1200.) / 1200.
+    z = np.where(phase < 0.5, phase * 2, (1 - phase) * 2) * 200 + 1
+
+    return GliderStream({'timestamp' : t, 'pressure' : z})
+
+
+def chunks(stream, cuts):
+
+    bounds = [0] + list(cuts) + [len(stream)]
+    return [('chunk{:d}'.format(i), stream[bounds[i]:bounds[i+1]]) for i in range(len(bounds) - 1)]
+
+
+def profile_times(profiles):
+
+    return np.array([p[1] for p in profiles])
+
+
+def test_append_rejects_nan_timestamps():
+
+    indexer = IncrementalYoIndexer()
+    with pytest.raises(ValueError):
+        indexer.append([1., np.nan, 3.], [1., 2., 3.])
+
+
+def test_iter_stream_profiles_skips_nan_timestamps():
+    """Rows without a timestamp do not stall the indexing"""
+
+    stream = make_stream()
+    t = stream['timestamp'].copy()
+    t[[10, 1500, 2500]] = np.nan
+    nan_stream = GliderStream({'timestamp' : t, 'pressure' : stream['pressure']})
+    profiles = list(iter_stream_profiles(chunks(nan_stream, [1000, 2000]), 'pressure'))
+
+    # The same profiles are indexed as from the stream without those rows
+    expected = list(iter_stream_profiles([('all', nan_stream.take(np.isfinite(t)))], 'pressure'))
+
+    assert len(expected) > 10
+    np.testing.assert_array_equal(profile_times(profiles), profile_times(expected))
+
+
+def test_iter_stream_profiles_carry_over():
+    """Indexing continued from the pending rows of a previous call indexes the
+    same profiles as a single call"""
+
+    stream = make_stream()
+    expected = list(iter_stream_profiles(chunks(stream, [1000, 2000]), 'pressure'))
+
+    indexer = IncrementalYoIndexer()
+    first = list(iter_stream_profiles(chunks(stream[:1500], [1000]), 'pressure', indexer=indexer, flush=False))
+    source, times, pending = first.pop()
+    assert times is None
+    assert len(pending) > 0
+
+    # The overlapping rows of the next stream are skipped
+    indexer = IncrementalYoIndexer(start_time=indexer.resume_time)
+    second = list(iter_stream_profiles(chunks(stream[1400:], [600]), 'pressure', indexer=indexer, pending=pending))
+
+    profiles = first + second
+    np.testing.assert_array_equal(profile_times(profiles), profile_times(expected))
+    for p, e in zip(profiles, expected):
+        np.testing.assert_array_equal(p[2]['timestamp'], e[2]['timestamp'])
@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+
+import numpy as np
+from netCDF4 import Dataset
+
+from gutils.config import load_deployment_config
+from gutils.nc import NC_FILL_VALUES, open_glider_netcdf, create_netcdf_skeleton
+from gutils.readers.stream import GliderStream
+
+CFG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'deployment-master', 'cfg')
+
+DEPLOYMENT = {'glider' : 'ce05moas-gl326',
+    'trajectory_date' : '20170401T0000',
+    'global_attributes' : {'wmo_id' : '4801234', 'deployment_number' : '5'},
+    'platform' : {'type' : 'platform',
+        'id' : 'gl326',
+        'wmo_id' : '4801234',
+        'long_name' : 'Coastal Endurance Glider 326',
+        'comment' : '',
+        'instrument' : ''}}
+
+# Global attributes which depend on the time the file is written
+TIME_ATTRIBUTES = ['history', 'date_created', 'date_modified', 'date_issued']
+
+
+def make_config(tmpdir):
+
+    cfg_path = str(tmpdir.mkdir('cfg'))
+    for name in ['datatypes', 'global_attributes', 'instruments']:
+        shutil.copy(os.path.join(CFG_PATH, '{:s}.json.new'.format(name)), os.path.join(cfg_path, '{:s}.json'.format(name)))
+    with open(os.path.join(cfg_path, 'deployment.json'), 'w') as fid:
+        json.dump(DEPLOYMENT, fid)
+
+    return load_deployment_config(cfg_path)
+
+
+def make_profile_stream(n=200):
+    """Profile rows with missing values and changing scalar values"""
+
+    rng = np.random.RandomState(0)
+    t = 1500000000. + np.arange(n) * 4.
+    pressure = np.linspace(1., 200., n)
+    temp = 10 - pressure / 50
+    temp[rng.rand(n) < 0.2] = np.nan
+
+    return GliderStream({'timestamp' : t,
+        'lat' : 44.5 + np.arange(n) * 1e-5,
+        'lon' : -124.5 - np.arange(n) * 1e-5,
+        'sci_water_pressure_dbar' : pressure,
+        'eos80_depth' : pressure * 0.99,
+        'sci_water_temp' : temp,
+        'practical_salinity' : 33 + pressure / 100,
+        'time_uv' : t,
+        'not_a_datatype' : np.zeros(n)})
+
+
+def write_profile(path, skeleton_path, config, insert):
+
+    shutil.copyfile(skeleton_path, path)
+    with open_glider_netcdf(path, config, mode='a') as glider_nc:
+        glider_nc.set_profile_id(1)
+        insert(glider_nc)
+        glider_nc.update_profile_vars()
+
+    return path
+
+
+def read_netcdf(path):
+    """Returns the raw, unmasked, variable values and the global attributes"""
+
+    with Dataset(path) as nci:
+        nci.set_auto_mask(False)
+        variables = {k : nci.variables[k][:] for k in nci.variables}
+        attrs = {k : nci.getncattr(k) for k in nci.ncattrs() if k not in TIME_ATTRIBUTES}
+
+    return variables, attrs
+
+
+def assert_netcdfs_equal(a, b):
+
+    a_vars, a_attrs = read_netcdf(a)
+    b_vars, b_attrs = read_netcdf(b)
+
+    assert sorted(a_vars.keys()) == sorted(b_vars.keys())
+    for name in a_vars:
+        if a_vars[name].dtype.kind == 'f':
+            # Profile means may differ in the last bit with the summation order
+            np.testing.assert_allclose(a_vars[name], b_vars[name], rtol=1e-12, err_msg=name)
+        else:
+            np.testing.assert_array_equal(a_vars[name], b_vars[name], err_msg=name)
+
+    assert sorted(a_attrs.keys()) == sorted(b_attrs.keys())
+    for name in a_attrs:
+        np.testing.assert_array_equal(a_attrs[name], b_attrs[name], err_msg=name)
+
+
+def test_stream_insert_matches_stream_dict_insert(tmpdir):
+    """Inserting a block of rows writes the same file as inserting each row"""
+
+    config = make_config(tmpdir)
+    skeleton_path = create_netcdf_skeleton(str(tmpdir.join('skeleton.nc')), config)
+    stream = make_profile_stream()
+
+    def insert_rows(glider_nc):
+        for row in stream:
+            glider_nc.stream_dict_insert(row)
+
+    def insert_halves(glider_nc):
+        glider_nc.stream_insert(stream[:75])
+        glider_nc.stream_insert(stream[75:])
+
+    rows_path = write_profile(str(tmpdir.join('rows.nc')), skeleton_path, config, insert_rows)
+    block_path = write_profile(str(tmpdir.join('block.nc')), skeleton_path, config, lambda nc: nc.stream_insert(stream))
+    halves_path = write_profile(str(tmpdir.join('halves.nc')), skeleton_path, config, insert_halves)
+
+    variables, attrs = read_netcdf(rows_path)
+    np.testing.assert_array_equal(variables['time'], stream['timestamp'])
+    np.testing.assert_array_equal(variables['temperature'] == NC_FILL_VALUES['f8'], np.isnan(stream['sci_water_temp']))
+    assert variables['time_uv'] == stream['time_uv'][-1]
+
+    assert_netcdfs_equal(block_path, rows_path)
+    assert_netcdfs_equal(halves_path, rows_path)
+
+    # Each column is also accepted as a dictionary of arrays
+    dict_path = write_profile(str(tmpdir.join('dict.nc')), skeleton_path, config, lambda nc: nc.stream_insert(dict(stream.columns)))
+    assert_netcdfs_equal(dict_path, rows_path)
+
+
+def recalculate_from_file(path, config):
+    """Reopens the file, which disables the running statistics, and updates
+    the profile variables and bounds from the data read back from the file"""
+
+    with open_glider_netcdf(path, config, mode='a') as glider_nc:
+        assert glider_nc.variable_stats is None
+        glider_nc.update_profile_vars()
+
+    return path
+
+
+def test_running_stats_match_file_data(tmpdir):
+    """The profile variables and bounds calculated from the running statistics
+    are the values calculated from the data in the file"""
+
+    config = make_config(tmpdir)
+    skeleton_path = create_netcdf_skeleton(str(tmpdir.join('skeleton.nc')), config)
+    stream = make_profile_stream()
+    # Missing values at the start and end of the bounds variable
+    stream['eos80_depth'][[0, 1, -1]] = np.nan
+
+    def insert_mixed(glider_nc):
+        glider_nc.stream_insert(stream[:50])
+        for row in stream[50:60]:
+            glider_nc.stream_dict_insert(row)
+        glider_nc.stream_insert(stream[60:])
+
+    def insert_missing_lat(glider_nc):
+        missing = dict(stream.columns)
+        missing['lat'] = np.where(np.arange(len(stream)) == 5, np.nan, stream['lat'])
+        glider_nc.stream_insert(missing)
+
+    def overwrite_depth(glider_nc):
+        # Overwriting a variable invalidates its statistics
+        glider_nc.stream_insert(stream)
+        glider_nc.set_array('eos80_depth', stream['eos80_depth'] * 2)
+        glider_nc.set_array_value('lon', 0, -125.)
+
+    for name, insert in [('mixed', insert_mixed), ('missing_lat', insert_missing_lat), ('overwrite', overwrite_depth)]:
+        stats_path = write_profile(str(tmpdir.join('{:s}.nc'.format(name))), skeleton_path, config, insert)
+        file_path = str(tmpdir.join('{:s}_file.nc'.format(name)))
+        shutil.copyfile(stats_path, file_path)
+        recalculate_from_file(file_path, config)
+
+        assert_netcdfs_equal(stats_path, file_path)
+
+        variables, attrs = read_netcdf(stats_path)
+        file_attrs = read_netcdf(file_path)[1]
+        for attr in ['geospatial_vertical_min', 'geospatial_vertical_max']:
+            assert attrs[attr].dtype == file_attrs[attr].dtype, attr
+
+        if name == 'missing_lat':
+            assert variables['profile_lat'] == NC_FILL_VALUES['f8']
+        if name == 'overwrite':
+            assert attrs['geospatial_vertical_max'] == np.nanmax(stream['eos80_depth']) * 2
+            assert variables['profile_lon'] == np.mean(np.concatenate([[-125.], stream['lon'][1:]]))
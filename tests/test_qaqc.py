@@ -0,0 +1,29 @@
+import numpy as np
+
+from gutils.nc import GLIDER_QC, combine_qc_flags
+
+
+def test_combine_qc_flags_precedence():
+    """Suspect and bad flags override the non-severity flags"""
+
+    flags = [GLIDER_QC['bad_data'],
+        GLIDER_QC['bad_data_that_are_potentially_correctable'],
+        GLIDER_QC['good_data'],
+        GLIDER_QC['no_qc_performed'],
+        GLIDER_QC['interpolated_value']]
+    other_flags = [GLIDER_QC['value_changed'],
+        GLIDER_QC['interpolated_value'],
+        GLIDER_QC['probably_good_data'],
+        GLIDER_QC['good_data'],
+        GLIDER_QC['value_changed']]
+
+    combined = combine_qc_flags(flags, other_flags)
+
+    np.testing.assert_array_equal(combined, [GLIDER_QC['bad_data'],
+        GLIDER_QC['bad_data_that_are_potentially_correctable'],
+        GLIDER_QC['probably_good_data'],
+        GLIDER_QC['good_data'],
+        GLIDER_QC['interpolated_value']])
+
+    # The combination does not depend on the order of the methods
+    np.testing.assert_array_equal(combine_qc_flags(other_flags, flags), combined)
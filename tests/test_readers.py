@@ -0,0 +1,50 @@
+import numpy as np
+
+from gutils.readers import merge_streams
+from gutils.readers.stream import GliderStream
+
+
+def pieces(timestamps, value, size):
+    """Split the timestamps into consecutive GliderStream pieces of size rows,
+    with the value column set to value"""
+
+    return [GliderStream({'timestamp' : timestamps[i:i + size], 'value' : np.full(len(timestamps[i:i + size]), value)})
+        for i in range(0, len(timestamps), size)]
+
+
+def test_merge_streams_duplicates():
+    """Overlapping sources are merged in time order with each timestamp kept
+    once, from the first source containing it"""
+
+    a = np.arange(0., 1000., 2.)
+    b = np.arange(500., 1500., 1.)
+    c = np.arange(1200., 1300., 0.5)
+    c[[10, 20]] = np.nan
+
+    sources = [('a.nc', pieces(a, 0, 70)), ('b.nc', pieces(b, 1, 130)), ('c.nc', pieces(c, 2, 33))]
+    merged = list(merge_streams(sources))
+
+    ts = np.concatenate([stream['timestamp'] for source, stream in merged])
+    values = np.concatenate([stream['value'] for source, stream in merged])
+
+    expected = np.unique(np.concatenate((a, b, c[np.isfinite(c)])))
+    np.testing.assert_array_equal(ts, expected)
+
+    np.testing.assert_array_equal(values[np.isin(ts, a)], 0)
+    np.testing.assert_array_equal(values[np.logical_and(~np.isin(ts, a), np.isin(ts, b))], 1)
+    np.testing.assert_array_equal(values[~np.isin(ts, np.concatenate((a, b)))], 2)
+
+    # Each merged stream lists the sources contributing rows to it
+    for source, stream in merged:
+        assert source.split(', ') == [s for s, v in zip(['a.nc', 'b.nc', 'c.nc'], range(3)) if v in stream['value']]
+
+
+def test_merge_streams_unsorted_pieces():
+
+    t = np.arange(100.)
+    shuffled = t[np.random.RandomState(0).permutation(t.shape[0])]
+
+    merged = list(merge_streams([('a.nc', [GliderStream({'timestamp' : shuffled})]),
+        ('b.nc', pieces(t[50:], 1, 10))]))
+
+    np.testing.assert_array_equal(np.concatenate([stream['timestamp'] for source, stream in merged]), t)
@@ -0,0 +1,96 @@
+import numpy as np
+from netCDF4 import Dataset
+
+from gutils.readers.nc import (
+    M2M_REQUIRED_PARAMETERS,
+    m2m_nc_chunks,
+    nc_time_is_sorted,
+    nc_time_slice
+)
+
+# Seconds between the NetCDF and unix epochs
+EPOCH_1900 = 2208988800.
+
+
+def make_m2m_nc(path, timestamps):
+    """Write an m2m source NetCDF file containing an observation at each of
+    the unix timestamps.  sci_water_temp contains the row number."""
+
+    n = len(timestamps)
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('obs', n)
+        for name in M2M_REQUIRED_PARAMETERS:
+            nc.createVariable(name, 'f8', ('obs',))[:] = np.ones(n)
+        nc.variables['time'].units = 'seconds since 1900-01-01 0:0:0'
+        nc.variables['time'].calendar = 'gregorian'
+        nc.variables['time'][:] = np.asarray(timestamps) + EPOCH_1900
+        nc.variables['sci_water_temp'][:] = np.arange(n)
+
+    return path
+
+
+def read_chunks(path, **kwargs):
+
+    return [dataset['stream'] for dataset in m2m_nc_chunks(path, **kwargs)]
+
+
+def test_nc_time_is_sorted(tmpdir):
+
+    t = 1500000000. + np.arange(5000) * 4.
+    with Dataset(make_m2m_nc(str(tmpdir.join('sorted.nc')), t)) as nci:
+        assert nc_time_is_sorted(nci.variables['time'], rows=(0, 2500, 5000))
+
+    # Out of order values near a searched row are detected, even if they are
+    # missed by the evenly spaced samples
+    t[2501], t[2502] = t[2502], t[2501]
+    with Dataset(make_m2m_nc(str(tmpdir.join('unsorted.nc')), t)) as nci:
+        assert nc_time_is_sorted(nci.variables['time'])
+        assert not nc_time_is_sorted(nci.variables['time'], rows=(2500,))
+
+
+def test_m2m_nc_chunks_unsorted_time(tmpdir):
+    """All observations within the time bounds of an unsorted file are read"""
+
+    t = 1500000000. + np.arange(5000) * 4.
+    t = t[np.random.RandomState(0).permutation(t.shape[0])]
+    path = make_m2m_nc(str(tmpdir.join('unsorted.nc')), t)
+
+    start_time = 1500000000. + 1000 * 4.
+    end_time = 1500000000. + 3000 * 4.
+    with Dataset(path) as nci:
+        assert nc_time_slice(nci.variables['time'], start_time, end_time) is None
+
+    streams = read_chunks(path, start_time=start_time, end_time=end_time, chunk_size=1000)
+    rows = np.concatenate([s['sci_water_temp'] for s in streams]).astype('i8')
+
+    expected = np.flatnonzero(np.logical_and(t >= start_time, t <= end_time))
+    np.testing.assert_array_equal(np.sort(rows), expected)
+    np.testing.assert_array_equal(np.concatenate([s['timestamp'] for s in streams]), t[rows])
+
+
+def test_m2m_nc_chunks_boundaries(tmpdir):
+    """Chunks are consecutive and the time bounds are inclusive"""
+
+    t = 1500000000. + np.arange(2500) * 4.
+    path = make_m2m_nc(str(tmpdir.join('sorted.nc')), t)
+
+    for chunk_size in [97, 999, 1000, 2500, 10000]:
+        streams = read_chunks(path, chunk_size=chunk_size)
+        assert [len(s) for s in streams[:-1]] == [chunk_size] * (len(streams) - 1)
+        np.testing.assert_array_equal(np.concatenate([s['timestamp'] for s in streams]), t)
+
+    # Bounds falling on and between observations
+    for start_row, end_row, offset in [(0, 2499, 0.), (1000, 2000, 0.), (1000, 2000, 1.), (1999, 2000, 0.)]:
+        streams = read_chunks(path, start_time=t[start_row] - offset, end_time=t[end_row] + offset, chunk_size=400)
+        np.testing.assert_array_equal(np.concatenate([s['timestamp'] for s in streams]), t[start_row:end_row + 1])
+        assert all([len(s) == 400 for s in streams[:-1]])
+
+    # A single bound
+    streams = read_chunks(path, start_time=t[2400], chunk_size=None)
+    assert len(streams) == 1
+    np.testing.assert_array_equal(streams[0]['timestamp'], t[2400:])
+
+    # No observations within the bounds
+    assert read_chunks(path, start_time=t[-1] + 1.) == []
+    assert read_chunks(path, end_time=t[0] - 1.) == []
+    assert read_chunks(path, start_time=t[10] + 1., end_time=t[11] - 1.) == []
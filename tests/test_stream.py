@@ -0,0 +1,84 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from gutils.readers.stream import GliderStream
+
+
+def make_stream():
+
+    return GliderStream(OrderedDict([('timestamp', np.arange(5.)),
+        ('m_depth', np.array([1., 2., np.nan, 4., 5.])),
+        ('x_flag', np.arange(5, dtype='i1'))]))
+
+
+def test_rows():
+
+    stream = make_stream()
+
+    assert len(stream) == 5
+    assert stream.sensor_names == ['timestamp', 'm_depth', 'x_flag']
+    assert stream[1] == {'timestamp' : 1., 'm_depth' : 2., 'x_flag' : 1}
+    assert [r['x_flag'] for r in stream] == [0, 1, 2, 3, 4]
+    assert list(stream.rows())[3] == stream[3]
+
+
+def test_slice():
+
+    stream = make_stream()
+    sliced = stream[1:4]
+
+    assert isinstance(sliced, GliderStream)
+    assert sliced.sensor_names == stream.sensor_names
+    np.testing.assert_array_equal(sliced['timestamp'], [1., 2., 3.])
+    np.testing.assert_array_equal(sliced['x_flag'], [1, 2, 3])
+    assert sliced['x_flag'].dtype == np.dtype('i1')
+    assert len(stream[5:]) == 0
+
+
+def test_take():
+
+    stream = make_stream()
+
+    taken = stream.take([4, 0, 2])
+    np.testing.assert_array_equal(taken['timestamp'], [4., 0., 2.])
+    np.testing.assert_array_equal(taken['m_depth'], [5., 1., np.nan])
+
+    # Boolean masks and index arrays are also accepted by indexing
+    masked = stream[np.isfinite(stream['m_depth'])]
+    np.testing.assert_array_equal(masked['timestamp'], [0., 1., 3., 4.])
+    np.testing.assert_array_equal(stream[np.array([1, 3])]['x_flag'], [1, 3])
+
+
+def test_concatenate():
+    """Sensors missing from a stream are filled with NaN"""
+
+    a = make_stream()
+    b = GliderStream(OrderedDict([('timestamp', np.array([5., 6.])),
+        ('sci_water_temp', np.array([10., 11.]))]))
+
+    stream = GliderStream.concatenate([a, b])
+
+    assert stream.sensor_names == ['timestamp', 'm_depth', 'x_flag', 'sci_water_temp']
+    assert len(stream) == 7
+    np.testing.assert_array_equal(stream['timestamp'], np.arange(7.))
+    np.testing.assert_array_equal(stream['m_depth'], [1., 2., np.nan, 4., 5., np.nan, np.nan])
+    np.testing.assert_array_equal(stream['sci_water_temp'], [np.nan] * 5 + [10., 11.])
+
+    # Empty streams contribute no rows
+    np.testing.assert_array_equal(GliderStream.concatenate([GliderStream(), b])['timestamp'], [5., 6.])
+
+
+def test_add_column():
+
+    stream = make_stream()
+
+    stream.add_column('time_uv', None)
+    assert np.isnan(stream['time_uv']).all()
+    assert stream['time_uv'].shape == (5,)
+
+    with pytest.raises(ValueError):
+        stream.add_column('bad', np.arange(4.))
+    with pytest.raises(ValueError):
+        GliderStream().add_column('scalar', 1.)
@@ -0,0 +1,116 @@
+import os
+import sys
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import create_ioos_dac_netcdf
+from gutils.readers.stream import GliderStream
+
+
+class FakeGliderNetCDF(object):
+
+    def __init__(self, path, filled):
+        self.path = path
+        self.filled = filled
+
+    def set_scalar(self, key, value):
+        self.filled.setdefault(self.path, {})[key] = value
+
+
+def fake_open_glider_netcdf(filled):
+
+    @contextmanager
+    def open_glider_netcdf(path, config, mode='r'):
+        yield FakeGliderNetCDF(path, filled)
+
+    return open_glider_netcdf
+
+
+def test_update_uv_variables_order(monkeypatch):
+    """Leading profiles are back-filled from the first UV profile and later
+    profiles are filled from the nearest preceding UV profile"""
+
+    filled = {}
+    monkeypatch.setattr(create_ioos_dac_netcdf, 'open_glider_netcdf', fake_open_glider_netcdf(filled))
+
+    uv1 = {'time_uv' : 1.}
+    uv2 = {'time_uv' : 2.}
+    written_profiles = [('empty1.nc', None),
+        ('uv1.nc', uv1),
+        ('empty2.nc', None),
+        ('uv2.nc', uv2),
+        ('empty3.nc', None)]
+
+    create_ioos_dac_netcdf.update_uv_variables(written_profiles, None)
+
+    assert filled == {'empty1.nc' : uv1,
+        'empty2.nc' : uv1,
+        'empty3.nc' : uv2}
+
+
+def test_update_uv_variables_no_uv(monkeypatch):
+
+    filled = {}
+    monkeypatch.setattr(create_ioos_dac_netcdf, 'open_glider_netcdf', fake_open_glider_netcdf(filled))
+
+    create_ioos_dac_netcdf.update_uv_variables([('empty1.nc', None), ('empty2.nc', None)], None)
+
+    assert filled == {}
+
+
+def test_update_uv_variables_across_batches(monkeypatch):
+    """UV values and files waiting to be back-filled are carried over to the
+    next batch"""
+
+    filled = {}
+    monkeypatch.setattr(create_ioos_dac_netcdf, 'open_glider_netcdf', fake_open_glider_netcdf(filled))
+
+    uv1 = {'time_uv' : 1.}
+    uv_values, pending = create_ioos_dac_netcdf.update_uv_variables([('empty1.nc', None)], None)
+    assert uv_values is None
+    assert pending == ['empty1.nc']
+
+    uv_values, pending = create_ioos_dac_netcdf.update_uv_variables([('uv1.nc', uv1)], None,
+        uv_values=uv_values, empty_uv_processed_paths=pending)
+    assert uv_values == uv1
+    assert pending == []
+
+    create_ioos_dac_netcdf.update_uv_variables([('empty2.nc', None)], None,
+        uv_values=uv_values, empty_uv_processed_paths=pending)
+
+    assert filled == {'empty1.nc' : uv1,
+        'empty2.nc' : uv1}
+
+
+def test_pending_netcdfs_removed_on_error(monkeypatch, tmpdir):
+    """Files waiting to be back-filled are removed if writing fails for any
+    reason"""
+
+    pending_dir = tmpdir.mkdir('pending')
+    pending_path = str(pending_dir.join('empty1.nc'))
+
+    def write_profile_netcdfs(*args, **kwargs):
+        open(pending_path, 'w').close()
+        return 2, {'uv_values' : None, 'pending' : [(pending_path, 'empty1.nc')]}
+
+    def iter_stream_profiles(*args, **kwargs):
+        for i in range(create_ioos_dac_netcdf.PROFILE_WRITE_BATCH + 1):
+            yield 'a.nc', (i, i + 1), GliderStream()
+        raise RuntimeError('Unexpected failure')
+
+    monkeypatch.setattr(create_ioos_dac_netcdf, 'read_source_streams', lambda *args, **kwargs: [])
+    monkeypatch.setattr(create_ioos_dac_netcdf, 'iter_stream_profiles', iter_stream_profiles)
+    monkeypatch.setattr(create_ioos_dac_netcdf, 'write_profile_netcdfs', write_profile_netcdfs)
+
+    args = create_ioos_dac_netcdf.create_arg_parser().parse_args(['deployment'])
+    config = namedtuple('Config', ['datatypes'])({})
+    with pytest.raises(RuntimeError):
+        create_ioos_dac_netcdf.write_deployment_netcdfs(args, config, {}, [], None, 'glider', 
+            'deployment', 1, {})
+
+    assert not os.path.exists(pending_path)
+    assert not os.path.exists(str(pending_dir))
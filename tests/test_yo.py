@@ -0,0 +1,223 @@
+import numpy as np
+import pytest
+
+from gutils import clean_dataset, validate_glider_args
+from gutils.yo import (TIME_DIM, DATA_DIM, ProfileIndex, calculate_delta_depth, find_segment_extrema,
+    find_yo_extrema)
+from gutils.yo.filters import filter_profiles, filter_profile_breaks
+
+
+def reference_find_yo_extrema(timestamps, depth, tsint=10):
+    """The original implementation of find_yo_extrema, which appended each
+    profile to the result and searched the full time series for the records of
+    each profile.  Profiles containing no valid depths are dropped.
+    """
+
+    validate_glider_args(timestamps, depth)
+
+    est_data = np.column_stack((timestamps, depth))
+    est_data[est_data[:, DATA_DIM] <= 0] = float('nan')
+    est_data = clean_dataset(est_data)
+
+    ts = np.arange(est_data[:,0].min(), est_data[:,0].max(), tsint)
+    interp_z = np.interp(ts, est_data[:, 0], est_data[:, 1], left=est_data[0, 1], right=est_data[-1, 1])
+
+    # scipy.signal boxcar convolution
+    window_size = int(tsint/2)
+    filtered_z = np.convolve(interp_z, np.ones(window_size), 'same') / window_size
+
+    delta_depth = calculate_delta_depth(filtered_z)
+
+    p_inds = np.empty((0,2))
+    inflections = np.where(np.diff(delta_depth) != 0)[0]
+
+    p_inds = np.append(p_inds, [[0, inflections[0]]], axis=0)
+    for p in range(len(inflections)-1):
+        p_inds = np.append(p_inds,[[inflections[p], inflections[p+1]]], axis=0)
+    p_inds = np.append(p_inds, [[inflections[-1], len(ts)-1]], axis=0)
+
+    ts_window = tsint*2
+
+    profile_times = []
+    for p in p_inds:
+        p0 = int(p[0])
+        p1 = int(p[1])
+        profile_i = np.flatnonzero(np.logical_and(timestamps >= ts[p0]-ts_window, timestamps <= ts[p1]+ts_window))
+        pro = depth[profile_i]
+        if np.isnan(pro).all():
+            continue
+        sorted_i = np.sort([np.nanargmin(pro), np.nanargmax(pro)])
+        profile_times.append([timestamps[profile_i[sorted_i[0]]], timestamps[profile_i[sorted_i[1]]]])
+
+    return np.array(profile_times).reshape((-1, 2))
+
+
+def make_yo(num_dives=12, seed=0):
+    """Sorted timestamps and depths of a glider flying num_dives dives to random
+    depths, sampling every 4 seconds, with surface intervals, noise, missing
+    depths and a 30 minute data gap
+    """
+
+    rng = np.random.RandomState(seed)
+
+    depth = []
+    for d in range(num_dives):
+        max_depth = rng.uniform(30, 150)
+        dive = np.arange(0.5, max_depth, 0.8)
+        depth.append(dive)
+        depth.append(dive[::-1])
+        depth.append(np.full(rng.randint(5, 60), 0.5))
+    depth = np.concatenate(depth)
+    depth += rng.randn(depth.shape[0]) * 0.1
+
+    timestamps = 1500000000. + np.arange(depth.shape[0]) * 4.
+    timestamps[depth.shape[0] // 2:] += 1800
+
+    depth[rng.rand(depth.shape[0]) < 0.05] = np.nan
+
+    return timestamps, depth
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('tsint', [6, 10])
+def test_find_yo_extrema_matches_reference(seed, tsint):
+
+    timestamps, depth = make_yo(seed=seed)
+
+    expected = reference_find_yo_extrema(timestamps, depth, tsint=tsint)
+    profile_times = find_yo_extrema(timestamps, depth, tsint=tsint)
+
+    assert expected.shape[0] > 20
+    np.testing.assert_array_equal(profile_times, expected)
+
+
+def test_find_yo_extrema_unsorted():
+    """Unsorted records are indexed as if sorted"""
+
+    timestamps, depth = make_yo()
+    order = np.random.RandomState(3).permutation(timestamps.shape[0])
+
+    np.testing.assert_array_equal(find_yo_extrema(timestamps[order], depth[order]),
+        find_yo_extrema(timestamps, depth))
+
+
+def test_find_yo_extrema_return_index():
+
+    timestamps, depth = make_yo()
+
+    profile_times = find_yo_extrema(timestamps, depth)
+    profiles = find_yo_extrema(timestamps, depth, return_index=True)
+
+    np.testing.assert_array_equal(profiles.times, profile_times)
+    for s, (t0, t1) in zip(profiles.slices(), profile_times):
+        assert timestamps[s][0] == t0
+        assert timestamps[s][-1] == t1
+
+
+def make_profile_index():
+
+    timestamps = np.arange(10.)
+    depth = np.array([1., 2., 3., 4., 3., 2., 1., np.nan, 2., 3.])
+    profile_times = [[0, 3], [3, 6], [7, 7], [8, 9], [20, 30]]
+
+    return ProfileIndex.from_times(timestamps, depth, profile_times)
+
+
+def test_profile_index_from_times():
+
+    profiles = make_profile_index()
+
+    assert len(profiles) == 5
+    assert profiles.shape == (5, 2)
+    np.testing.assert_array_equal(profiles.start, [0, 3, 7, 8, 10])
+    np.testing.assert_array_equal(profiles.stop, [4, 7, 8, 10, 10])
+    np.testing.assert_array_equal(profiles.min_depth, [1, 1, np.nan, 2, np.nan])
+    np.testing.assert_array_equal(profiles.max_depth, [4, 4, np.nan, 3, np.nan])
+    # Profiles with no valid depths have no direction
+    np.testing.assert_array_equal(profiles.direction, [1, -1, 0, 1, 0])
+
+
+def test_profile_index_times():
+
+    profiles = make_profile_index()
+    times = [[0, 3], [3, 6], [7, 7], [8, 9], [20, 30]]
+
+    np.testing.assert_array_equal(profiles.times, times)
+    np.testing.assert_array_equal(list(profiles), times)
+    np.testing.assert_array_equal(profiles[1], [3, 6])
+    np.testing.assert_array_equal(profiles[np.int64(-1)], [20, 30])
+    assert list(profiles.slices()) == [slice(0, 4), slice(3, 7), slice(7, 8), slice(8, 10), slice(10, 10)]
+
+
+def test_profile_index_select():
+
+    profiles = make_profile_index()
+
+    for key, rows in [(slice(1, 3), [1, 2]), (np.array([3, 0]), [3, 0]), (profiles.direction != 0, [0, 1, 3])]:
+        selected = profiles[key]
+        assert isinstance(selected, ProfileIndex)
+        for name in ['start', 'stop', 't0', 't1', 'min_depth', 'max_depth', 'direction']:
+            np.testing.assert_array_equal(getattr(selected, name), getattr(profiles, name)[rows], err_msg=name)
+
+
+def test_profile_index_unsorted():
+
+    depth = np.ones(4)
+    with pytest.raises(ValueError):
+        ProfileIndex.from_times([0., 2., 1., 3.], depth, [[0, 3]])
+    with pytest.raises(ValueError):
+        ProfileIndex.from_times([0., 1., np.nan, 3.], depth, [[0, 3]])
+
+
+def test_find_segment_extrema():
+    """Matches np.nanargmin/np.nanargmax over overlapping, empty and all-NaN
+    segments, including ties"""
+
+    rng = np.random.RandomState(0)
+    values = rng.randint(0, 20, 500).astype('f8')
+    values[rng.rand(500) < 0.2] = np.nan
+    values[100:110] = np.nan
+
+    starts = rng.randint(0, 500, 200)
+    stops = np.minimum(starts + rng.randint(0, 30, 200), 500)
+    starts = np.concatenate((starts, [100, 0, 500]))
+    stops = np.concatenate((stops, [110, 500, 500]))
+
+    min_i, max_i, valid = find_segment_extrema(values, starts, stops)
+
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        segment = values[start:stop]
+        if stop == start or np.isnan(segment).all():
+            assert not valid[i]
+            continue
+        assert valid[i]
+        assert min_i[i] == start + np.nanargmin(segment)
+        assert max_i[i] == start + np.nanargmax(segment)
+
+    min_i, max_i, valid = find_segment_extrema(np.empty(0), [0], [0])
+    assert not valid.any()
+
+
+def test_profile_index_filters():
+    """Filtering a ProfileIndex selects the same profiles as filtering the
+    profile times"""
+
+    timestamps, depth = make_yo()
+    yo = np.column_stack((timestamps, depth))
+    # Split some profiles at time breaks
+    yo[::7, TIME_DIM] += 3.5
+
+    profile_times = find_yo_extrema(yo[:, TIME_DIM], yo[:, DATA_DIM])
+    profiles = find_yo_extrema(yo[:, TIME_DIM], yo[:, DATA_DIM], return_index=True)
+
+    filtered = filter_profiles(yo, profiles, minpoints=40)
+    filtered_times = filter_profiles(yo, profile_times, minpoints=40)
+    assert isinstance(filtered, ProfileIndex)
+    assert 0 < len(filtered) < len(profiles)
+    np.testing.assert_array_equal(filtered.times, filtered_times)
+
+    split = filter_profile_breaks(yo, profiles)
+    split_times = filter_profile_breaks(yo, profile_times)
+    assert isinstance(split, ProfileIndex)
+    assert len(split) > len(profiles)
+    np.testing.assert_array_equal(split.times, split_times)